@@ -1 +1,5 @@
-# API package 
\ No newline at end of file
+# API package
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file before any module reads its settings
+load_dotenv()
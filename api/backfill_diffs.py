@@ -0,0 +1,35 @@
+"""
+Compute and store the snapshot diffs (trends against the previous capture) missing from the database.
+
+Snapshots saved before diffs were stored, or whose previous capture was
+rewritten since, have no diff; /historical computes those on first read.
+Run this once after upgrading to have every historical view read a stored diff.
+
+Usage:
+    python -m api.backfill_diffs [--db sanvivo_prices.db]
+"""
+import argparse
+import time
+
+from api.database import db_handler
+from api.utils.data_fetcher import backfill_snapshot_diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=db_handler.DB_PATH, help="SQLite database path")
+    args = parser.parse_args()
+
+    db_handler.DB_PATH = args.db
+    db_handler.init_db()
+    pending = len(db_handler.get_timestamps_without_diff())
+    print(f"{pending} snapshots without a stored diff")
+
+    start = time.perf_counter()
+    stored = backfill_snapshot_diffs()
+    print(f"Stored {stored} snapshot diffs in {time.perf_counter() - start:.1f}s")
+    db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compact the price history according to the retention policy and reclaim the freed space.
+
+Keeps every capture of the last --full-days days, the last capture per hour
+up to --hourly-days days back and the last capture per day before that
+(defaults: RETENTION_FULL_DAYS and RETENTION_HOURLY_DAYS). Removes the other
+snapshots and folds the detailed prices of the removed captures into the
+capture kept for their hour or day, one short transaction per batch, so the
+API can keep running. Then recomputes the snapshot diffs that compared with
+a removed capture, and vacuums.
+
+Usage:
+    python -m api.compact_history [--db sanvivo_prices.db] [--full-days 30] [--hourly-days 365]
+                                  [--vacuum incremental|full|off] [--dry-run]
+"""
+import argparse
+import datetime
+
+from api.database import db_handler, retention
+from api.utils.data_fetcher import backfill_snapshot_diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=db_handler.DB_PATH, help="SQLite database path")
+    parser.add_argument("--full-days", type=float, default=retention.RETENTION_FULL_DAYS,
+                        help="Days kept at full resolution")
+    parser.add_argument("--hourly-days", type=float, default=retention.RETENTION_HOURLY_DAYS,
+                        help="Days kept at hourly resolution (0: no daily tier)")
+    parser.add_argument("--vacuum", choices=retention.VACUUM_MODES, default="incremental",
+                        help="How to give the freed pages back (full rewrites the file and enables incremental next time)")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be removed")
+    args = parser.parse_args()
+
+    db_handler.DB_PATH = args.db
+    db_handler.init_db()
+    try:
+        hourly_cutoff, daily_cutoff = retention.retention_cutoffs(datetime.datetime.now(), args.full_days, args.hourly_days)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Thinning to one capture per hour before {hourly_cutoff}"
+          + (f" and one per day before {daily_cutoff}" if daily_cutoff else ""))
+
+    if args.dry_run:
+        with db_handler.get_connection_manager().read() as conn:
+            batches = retention.plan_compaction(conn, hourly_cutoff, daily_cutoff)
+        entries = [entry for batch in batches for entry in batch]
+        snapshots = sum(len(entry["snapshot"][1]) for entry in entries if entry["snapshot"])
+        captures = sum(len(entry["capture"][1]) for entry in entries if entry["capture"])
+        print(f"Would remove {snapshots} snapshots and {captures} detailed price captures "
+              f"from {len(entries)} buckets in {len(batches)} batches")
+        db_handler.get_connection_manager().close()
+        return
+
+    report = retention.run_retention(full_days=args.full_days, hourly_days=args.hourly_days, vacuum=args.vacuum,
+                                     pause_seconds=args.pause)
+    print(f"Removed {report['snapshots_removed']} snapshots, {report['captures_removed']} detailed price captures "
+          f"and {report['rows_removed']:,} price rows in {report['batches']} batches ({report['duration_seconds']:.1f}s)")
+    if report["batches"]:
+        print(f"Recomputed {backfill_snapshot_diffs()} snapshot diffs")
+    vacuum = report["vacuum"]
+    if vacuum:
+        print(f"Vacuum ({vacuum['mode']}, auto_vacuum={vacuum['auto_vacuum']}): reclaimed {vacuum['bytes_reclaimed'] / 2**20:.1f} MiB "
+              f"of {vacuum['free_bytes'] / 2**20:.1f} MiB free, database now {vacuum['file_bytes'] / 2**20:.1f} MiB")
+        if vacuum["auto_vacuum"] != "incremental":
+            print("The free pages stay in the file for reuse; run once with --vacuum full to enable incremental vacuuming")
+    db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
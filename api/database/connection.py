@@ -0,0 +1,116 @@
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+from contextlib import contextmanager
+
+# Pragmas applied to every connection
+BUSY_TIMEOUT_SECONDS = 30
+CACHE_SIZE_KIB = 64 * 1024
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+
+# Number of read-only connections kept for the GET endpoints
+READ_POOL_SIZE = 8
+
+
+class ConnectionManager:
+    """
+    Reusable SQLite connections for one database file.
+
+    Each thread gets its own long-lived read/write connection; reads can use a
+    shared pool of read-only connections instead. The database runs in WAL
+    mode so readers never block the writer and vice versa.
+    """
+
+    def __init__(self, path, read_pool_size=READ_POOL_SIZE):
+        """
+        Args:
+            path: Path of the SQLite database file
+            read_pool_size: Maximum number of pooled read-only connections
+        """
+        self.path = path
+        self._local = threading.local()
+        self._all_writers = []
+        self._writers_lock = threading.Lock()
+        self._read_pool = queue.LifoQueue()
+        self._read_slots = threading.BoundedSemaphore(read_pool_size)
+        self._closed = False
+
+    def _configure(self, conn):
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _open_writer(self):
+        # Only ever used by the owning thread; check_same_thread=False lets close() run from any thread
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            # A new database: lets retention hand freed pages back with incremental_vacuum. Set
+            # before WAL is switched on; on an existing database it would wait for the write lock
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return self._configure(conn)
+
+    def _open_reader(self):
+        conn = sqlite3.connect(
+            f"file:{urllib.parse.quote(os.path.abspath(self.path))}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False
+        )
+        return self._configure(conn)
+
+    def writer(self):
+        """Return this thread's read/write connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open_writer()
+            with self._writers_lock:
+                self._all_writers.append(conn)
+        return conn
+
+    @contextmanager
+    def write(self):
+        """Yield this thread's connection; commit on success, roll back on error."""
+        conn = self.writer()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    @contextmanager
+    def read(self):
+        """Borrow a read-only connection from the pool for the duration of the block."""
+        self._read_slots.acquire()
+        try:
+            try:
+                conn = self._read_pool.get_nowait()
+            except queue.Empty:
+                conn = self._open_reader()
+            try:
+                yield conn
+            finally:
+                # Never hand a connection with an open read transaction back to the pool
+                if conn.in_transaction:
+                    conn.rollback()
+                if self._closed:
+                    conn.close()
+                else:
+                    self._read_pool.put(conn)
+        finally:
+            self._read_slots.release()
+
+    def close(self):
+        """Close every pooled and per-thread connection."""
+        self._closed = True
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._writers_lock:
+            for conn in self._all_writers:
+                conn.close()
+            self._all_writers = []
@@ -1,16 +1,80 @@
-import sqlite3
-import pandas as pd
+import os
+import base64
+import logging
+import threading
+import time
 import datetime
 import json
 
+from api.database.connection import ConnectionManager
+from api.database.price_cube import PriceCube
+from api.utils.comparison import build_price_matrix
+from api.utils.lazy_import import lazy_import
+from api.utils.metrics import span
+from api.utils.vendor_prices import VendorPrices
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
 # Database path
-DB_PATH = "sanvivo_prices.db"
+DB_PATH = os.getenv("SANVIVO_DB_PATH", "sanvivo_prices.db")
+
+# In-memory price cube serving history and previous-capture lookups; saved to PRICE_CUBE_PATH
+# (default: next to the database) on shutdown and memory-mapped back on startup
+PRICE_CUBE_ENABLED = os.getenv("PRICE_CUBE_ENABLED", "1") not in ("0", "false", "False", "")
+PRICE_CUBE_PATH = os.getenv("PRICE_CUBE_PATH")
+
+logger = logging.getLogger(__name__)
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_connection_manager():
+    """Return the connection manager for DB_PATH, replacing it if DB_PATH has changed."""
+    global _manager
+    with _manager_lock:
+        if _manager is None or _manager.path != DB_PATH:
+            if _manager is not None:
+                _manager.close()
+            _manager = ConnectionManager(DB_PATH)
+        return _manager
+
+# Snapshot columns as exposed to the API, and the snapshot_prices column each one is stored in
+SNAPSHOT_COLUMNS = {
+    "id": "product_id",
+    "Sorte": "sorte",
+    "Kultivar": "kultivar",
+    "Pharmacy ID": "pharmacy",
+    "Price (€/g)": "price",
+    "Best Competitor": "best_competitor",
+    "Best Competitor Price (€/g)": "best_competitor_price",
+}
+_SNAPSHOT_SQL_COLUMNS = ", ".join(SNAPSHOT_COLUMNS.values())
+
+# Database file whose schema init_db has already checked in this process
+_initialized_database = None
+
+def _database_identity():
+    try:
+        stat = os.stat(DB_PATH)
+    except FileNotFoundError:
+        return None
+    return (os.path.abspath(DB_PATH), stat.st_dev, stat.st_ino)
 
 def init_db():
-    """Initialize the SQLite database if it doesn't exist."""
-    conn = sqlite3.connect(DB_PATH)
+    """
+    Initialize the SQLite database if it doesn't exist and apply pending migrations.
+
+    Runs once per database file and process: later calls return right away. On
+    a database that is already up to date it only reads, so a worker starting
+    while another one is writing doesn't wait for the write lock.
+    """
+    global _initialized_database
+    if _initialized_database is not None and _initialized_database == _database_identity():
+        return
+    conn = get_connection_manager().writer()
     c = conn.cursor()
-    # Create table if it doesn't exist
+    # Legacy table with one JSON blob per snapshot (no longer written, kept for the backfill)
     c.execute('''
         CREATE TABLE IF NOT EXISTS price_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -18,6 +82,31 @@ def init_db():
             data TEXT NOT NULL
         )
     ''')
+
+    # One row per snapshot
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS snapshots (
+            timestamp TEXT PRIMARY KEY,
+            product_count INTEGER NOT NULL
+        )
+    ''')
+
+    # One row per product per snapshot; position keeps the saved row order
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_prices (
+            timestamp TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            product_id TEXT,
+            sorte TEXT,
+            kultivar TEXT,
+            pharmacy TEXT,
+            price REAL,
+            best_competitor TEXT,
+            best_competitor_price REAL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_prices_timestamp ON snapshot_prices (timestamp, position)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_prices_product ON snapshot_prices (product_id, timestamp)")
     
     # Create table for storing detailed price data from all pharmacies
     c.execute('''
@@ -32,139 +121,1499 @@ def init_db():
             UNIQUE(timestamp, product_id, pharmacy_id)
         )
     ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_detailed_price_key ON detailed_price_data (product_id, pharmacy_id, timestamp)")
+
+    # One row per detailed price ingestion. In change-only storage a price row stays valid
+    # for every capture until the next row for the same product and pharmacy; a NULL price
+    # marks that the pharmacy stopped listing the product.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS detailed_price_captures (
+            timestamp TEXT PRIMARY KEY,
+            price_count INTEGER NOT NULL,
+            rows_written INTEGER NOT NULL
+        )
+    ''')
+
+    # Per-bucket price statistics of every capture (see ROLLUP_RESOLUTIONS), kept up to date on ingest
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS detailed_price_rollups (
+            resolution TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            pharmacy_id TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            min_price REAL NOT NULL,
+            max_price REAL NOT NULL,
+            sum_price REAL NOT NULL,
+            price_count INTEGER NOT NULL,
+            last_price REAL NOT NULL,
+            last_timestamp TEXT NOT NULL,
+            PRIMARY KEY (resolution, product_id, pharmacy_id, bucket)
+        ) WITHOUT ROWID
+    ''')
+
+    # Named sets of pharmacies to compare (see api.utils.pharmacy_groups)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS pharmacy_groups (
+            name TEXT PRIMARY KEY,
+            own_pharmacy_id TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS pharmacy_group_members (
+            group_name TEXT NOT NULL REFERENCES pharmacy_groups (name),
+            pharmacy_id TEXT NOT NULL,
+            pharmacy_name TEXT NOT NULL,
+            PRIMARY KEY (group_name, pharmacy_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Trend of each snapshot against the capture before it, computed once when the snapshot is saved
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_diffs (
+            timestamp TEXT PRIMARY KEY,
+            previous_timestamp TEXT,
+            unchanged INTEGER NOT NULL,
+            increased INTEGER NOT NULL,
+            decreased INTEGER NOT NULL,
+            new INTEGER NOT NULL
+        )
+    ''')
+
+    # One row per snapshot_prices row; position matches snapshot_prices.position
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_diff_rows (
+            timestamp TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            trend TEXT NOT NULL,
+            competitor_trend TEXT,
+            price_delta REAL,
+            competitor_delta REAL,
+            PRIMARY KEY (timestamp, position)
+        ) WITHOUT ROWID
+    ''')
+
+    # Named cross-process leases (see acquire_lease), e.g. which worker ingests snapshots
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+    # One row per history compaction run (see api.database.retention)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS retention_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            hourly_cutoff TEXT NOT NULL,
+            daily_cutoff TEXT,
+            batches INTEGER,
+            snapshots_removed INTEGER,
+            captures_removed INTEGER,
+            rows_removed INTEGER,
+            bytes_reclaimed INTEGER,
+            error TEXT
+        )
+    ''')
+
+    # One row per replay of recorded payloads (see api.utils.replay)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS replay_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            range_start TEXT NOT NULL,
+            range_end TEXT NOT NULL,
+            workers INTEGER NOT NULL,
+            payloads INTEGER,
+            captures INTEGER,
+            snapshots INTEGER,
+            failed INTEGER,
+            error TEXT
+        )
+    ''')
+
+    # Raw upstream payload behind each capture (see api.database.payload_store), for replaying
+    # the ingestion; `snapshot` is 1 if a snapshot was stored from it as well as detailed prices
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS raw_payloads (
+            timestamp TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            encoding TEXT NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            stored_bytes INTEGER NOT NULL,
+            snapshot INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # One row per rewrite of stored history (see on_history_rewrite), so every worker notices it
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS history_rewrites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            rewritten_at TEXT NOT NULL
+        )
+    ''')
     
     conn.commit()
-    conn.close()
 
-def save_to_db(df):
-    """Save the DataFrame to the SQLite database with current timestamp."""
+    _apply_migrations(conn)
+    _initialized_database = _database_identity()
+
+def _migrate_price_data_blobs(conn):
+    """Backfill snapshots/snapshot_prices from the JSON blobs in price_data."""
+    c = conn.cursor()
+    c.execute("SELECT timestamp, data FROM price_data ORDER BY id")
+    migrated = 0
+    for timestamp, blob in c.fetchall():
+        # Older readers returned the first blob for a duplicated timestamp, so keep that one
+        if conn.execute("SELECT 1 FROM snapshots WHERE timestamp = ?", (timestamp,)).fetchone():
+            continue
+        records = json.loads(blob)
+        _insert_snapshot(conn, timestamp, [
+            tuple(record.get(column) for column in SNAPSHOT_COLUMNS) for record in records
+        ])
+        migrated += 1
+    if migrated:
+        logger.info("Migrated %d snapshots from price_data blobs to snapshot_prices", migrated)
+
+def _migrate_detailed_price_captures(conn):
+    """
+    Register existing detailed price timestamps as captures and close the gaps in them.
+
+    Rows written before change-only storage existed hold the full price list of every
+    capture, so a price that is missing from the next capture gets a NULL (removed) row
+    there; otherwise it would be carried forward when history is reconstructed.
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO detailed_price_captures (timestamp, price_count, rows_written)
+        SELECT timestamp, COUNT(price), COUNT(*) FROM detailed_price_data GROUP BY timestamp
+    """)
+    conn.execute("""
+        WITH capture_pairs AS (
+            SELECT timestamp, LEAD(timestamp) OVER (ORDER BY timestamp) AS next_timestamp
+            FROM detailed_price_captures
+        )
+        INSERT INTO detailed_price_data (timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
+        SELECT capture_pairs.next_timestamp, d.product_id, d.product_name, d.pharmacy_id, d.pharmacy_name, NULL
+        FROM detailed_price_data AS d
+        JOIN capture_pairs ON capture_pairs.timestamp = d.timestamp
+        WHERE capture_pairs.next_timestamp IS NOT NULL
+          AND d.price IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM detailed_price_data AS n
+              WHERE n.timestamp = capture_pairs.next_timestamp
+                AND n.product_id = d.product_id
+                AND n.pharmacy_id = d.pharmacy_id
+          )
+    """)
+
+def _migrate_detailed_price_rollups(conn):
+    """Compute the rollups for detailed prices stored before rollups existed."""
+    first, last = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM detailed_price_captures").fetchone()
+    if first is not None:
+        _rebuild_rollups(conn, first, last)
+        logger.info("Computed detailed price rollups from %s to %s", first, last)
+
+# Schema migrations, applied in order; PRAGMA user_version stores how many have run
+MIGRATIONS = [
+    _migrate_price_data_blobs,
+    _migrate_detailed_price_captures,
+    _migrate_detailed_price_rollups,
+]
+
+def _apply_migrations(conn):
+    """
+    Run every migration newer than the database's user_version, each in its own transaction.
+
+    Each migration runs under BEGIN IMMEDIATE after reading the version again, so workers
+    starting together apply it exactly once. An up-to-date database is recognized without
+    taking the write lock.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def _insert_snapshot(conn, timestamp, rows):
+    """
+    Write one snapshot, replacing any snapshot already stored under the same timestamp.
+
+    Args:
+        conn: Open connection (the caller commits)
+        timestamp: Snapshot timestamp
+        rows: Tuples of values in SNAPSHOT_COLUMNS order
+    """
+    conn.execute("DELETE FROM snapshot_prices WHERE timestamp = ?", (timestamp,))
+    _delete_snapshot_diffs(conn, "timestamp = ?", timestamp)
+    conn.execute("INSERT OR REPLACE INTO snapshots (timestamp, product_count) VALUES (?, ?)", (timestamp, len(rows)))
+    conn.executemany(
+        f"""
+        INSERT INTO snapshot_prices (timestamp, position, {_SNAPSHOT_SQL_COLUMNS})
+        VALUES (?, ?{", ?" * len(SNAPSHOT_COLUMNS)})
+        """,
+        ((timestamp, position) + tuple(row) for position, row in enumerate(rows))
+    )
+
+def _read_snapshot(conn, timestamp):
+    """Load one snapshot as a DataFrame with the API column names (None if it doesn't exist)."""
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {_SNAPSHOT_SQL_COLUMNS} FROM snapshot_prices WHERE timestamp = ? ORDER BY position",
+        (timestamp,)
+    )
+    rows = c.fetchall()
+    if not rows:
+        return None
+    df = pd.DataFrame.from_records(rows, columns=list(SNAPSHOT_COLUMNS))
+    df["Price (€/g)"] = df["Price (€/g)"].astype(float)
+    df["Best Competitor Price (€/g)"] = df["Best Competitor Price (€/g)"].astype(float)
+    return df
+
+# Per-row snapshot diff arrays (see api.utils.trend.compute_snapshot_diff), stored in snapshot_diff_rows columns of the same name
+DIFF_ROW_COLUMNS = ["trend", "competitor_trend", "price_delta", "competitor_delta"]
+DIFF_SUMMARY_COLUMNS = ["unchanged", "increased", "decreased", "new"]
+
+def _delete_snapshot_diffs(conn, condition, timestamp):
+    """Delete the stored diffs of the snapshots matching `condition` (an SQL expression on timestamp)."""
+    conn.execute(f"DELETE FROM snapshot_diff_rows WHERE {condition}", (timestamp,))
+    conn.execute(f"DELETE FROM snapshot_diffs WHERE {condition}", (timestamp,))
+
+def _insert_snapshot_diff(conn, timestamp, diff):
+    """
+    Store the diff of one snapshot, replacing any diff stored for it.
+
+    Args:
+        conn: Open connection (the caller commits)
+        timestamp: Snapshot timestamp
+        diff: Dictionary as returned by compute_snapshot_diff, plus "previous_timestamp"
+    """
+    _delete_snapshot_diffs(conn, "timestamp = ?", timestamp)
+    summary = diff["summary"]
+    conn.execute(
+        f"""
+        INSERT INTO snapshot_diffs (timestamp, previous_timestamp, {", ".join(DIFF_SUMMARY_COLUMNS)})
+        VALUES (?, ?{", ?" * len(DIFF_SUMMARY_COLUMNS)})
+        """,
+        (timestamp, diff.get("previous_timestamp")) + tuple(summary[column] for column in DIFF_SUMMARY_COLUMNS)
+    )
+    n = len(diff["trend"])
+    columns = []
+    for key in DIFF_ROW_COLUMNS:
+        values = diff[key]
+        if values is None:
+            columns.append([None] * n)
+        elif key.endswith("_delta"):
+            # NaN (nothing to compare) is stored as NULL
+            columns.append([value if value == value else None for value in values.tolist()])
+        else:
+            columns.append(list(values))
+    conn.executemany(
+        f"""
+        INSERT INTO snapshot_diff_rows (timestamp, position, {", ".join(DIFF_ROW_COLUMNS)})
+        VALUES (?, ?{", ?" * len(DIFF_ROW_COLUMNS)})
+        """,
+        ((timestamp, position) + row for position, row in enumerate(zip(*columns)))
+    )
+
+# Callbacks notified when data at or before an already stored point in time is rewritten
+_history_rewrite_listeners = []
+
+# Database and last history_rewrites id this process has passed on to the listeners
+_history_rewrites_seen = (None, None)
+_history_rewrites_lock = threading.Lock()
+
+def on_history_rewrite(callback):
+    """
+    Register a callback for rewrites of stored history.
+
+    `callback(timestamp)` runs after a snapshot or detailed price capture is stored
+    under a timestamp that is not newer than the latest one already stored (a
+    replaced or back-filled point in time). Anything derived from data at or after
+    that timestamp (e.g. trends) may have changed. Appending newer data doesn't
+    notify.
+
+    Rewrites made by other processes on the same database (another worker's
+    compaction, replay or back-fill) are passed on by poll_history_rewrites.
+    """
+    _history_rewrite_listeners.append(callback)
+
+def _notify_history_rewrite(timestamp):
+    with get_connection_manager().write() as conn:
+        conn.execute("INSERT INTO history_rewrites (timestamp, rewritten_at) VALUES (?, ?)",
+                     (timestamp, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    for callback in _history_rewrite_listeners:
+        callback(timestamp)
+
+def poll_history_rewrites():
+    """
+    Notify the on_history_rewrite listeners of rewrites recorded since the last poll.
+
+    Rewrites recorded by any process count (this process's own were notified
+    already, and notifying them again is harmless). The first poll on a database
+    only records where its log stands. Cheap when nothing changed: one indexed read.
+
+    Returns:
+        int: Id of the latest recorded rewrite (0 if none); it changes with every
+        rewrite, so work that started under one id and finishes under another
+        may have read history from before the rewrite
+    """
+    global _history_rewrites_seen
+    with get_connection_manager().read() as conn:
+        latest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM history_rewrites").fetchone()[0]
+        with _history_rewrites_lock:
+            db_path, seen = _history_rewrites_seen
+            if db_path == DB_PATH and seen == latest:
+                return latest
+            _history_rewrites_seen = (DB_PATH, latest)
+        if db_path != DB_PATH or seen is None:
+            return latest
+        earliest = conn.execute("SELECT MIN(timestamp) FROM history_rewrites WHERE id > ? AND id <= ?",
+                                (seen, latest)).fetchone()[0]
+    if earliest is not None:
+        for callback in _history_rewrite_listeners:
+            callback(earliest)
+    return latest
+
+def save_to_db(df, timestamp=None, diff=None):
+    """
+    Save the DataFrame to the SQLite database with the given (or current) timestamp.
+
+    Args:
+        df: Snapshot DataFrame with the SNAPSHOT_COLUMNS
+        timestamp: Optional timestamp (uses current time if not provided)
+        diff: Optional trend against the previous capture (see compute_snapshot_diff, plus
+            "previous_timestamp"), aligned with the rows of df and stored in the same transaction
+
+    Returns:
+        bool: True if the snapshot was stored
+    """
     if df is None or df.empty:
         return False
     
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    json_data = df.to_json(orient="records")
+    if timestamp is None:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Missing columns are stored as NULL, NaN becomes NULL as well
+    columns = df.reindex(columns=list(SNAPSHOT_COLUMNS)).astype(object)
+    rows = columns.where(columns.notna(), None).itertuples(index=False, name=None)
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO price_data (timestamp, data) VALUES (?, ?)", (timestamp, json_data))
-    conn.commit()
-    conn.close()
+    with span("save_snapshot", rows=len(df)), get_connection_manager().write() as conn:
+        latest = conn.execute("SELECT MAX(timestamp) FROM snapshots").fetchone()[0]
+        _insert_snapshot(conn, timestamp, list(rows))
+        if diff is not None:
+            _insert_snapshot_diff(conn, timestamp, diff)
+        if latest is not None and timestamp < latest:
+            # Later snapshots were compared against what came before this one
+            _delete_snapshot_diffs(conn, "timestamp > ?", timestamp)
+
+    if latest is not None and timestamp <= latest:
+        _notify_history_rewrite(timestamp)
     return True
 
-def save_detailed_prices(data, timestamp=None):
+# Columns of a detailed price row, in detailed_price_data order
+DETAILED_PRICE_COLUMNS = ["product_id", "product_name", "pharmacy_id", "pharmacy_name", "price"]
+
+# Rows per executemany call when bulk-inserting detailed prices
+BULK_BATCH_SIZE = 10_000
+
+# "changes" stores only prices that changed, appeared or disappeared; "full" stores every price of every capture
+DETAILED_PRICE_STORAGE = os.getenv("DETAILED_PRICE_STORAGE", "changes")
+
+def _detailed_columns(data):
+    """
+    Normalize columnar detailed price input to equally long lists of Python values.
+
+    Args:
+        data: DataFrame or mapping of column name to list / NumPy array / Series
+
+    Returns:
+        dict: Column name to list, with NaN prices converted to None
+    """
+    columns = {}
+    for column in DETAILED_PRICE_COLUMNS:
+        if column not in data:
+            raise ValueError(f"Missing detailed price column: {column}")
+        values = data[column]
+        columns[column] = values.tolist() if hasattr(values, "tolist") else list(values)
+
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"Detailed price columns have different lengths: {sorted(lengths)}")
+
+    columns["price"] = [None if price is None or price != price else price for price in columns["price"]]
+    return columns
+
+def _prices_as_of(conn, timestamp, inclusive=False):
+    """
+    Reconstruct the price list in effect at a point in time.
+
+    Args:
+        conn: Open connection
+        timestamp: Point in time (None for the latest state)
+        inclusive: Whether rows written exactly at `timestamp` count
+
+    Returns:
+        dict: (product_id, pharmacy_id) to (product_name, pharmacy_name, price), listed prices only
+    """
+    query = "SELECT product_id, pharmacy_id, product_name, pharmacy_name, price, MAX(timestamp) FROM detailed_price_data"
+    params = []
+    if timestamp is not None:
+        query += " WHERE timestamp <= ?" if inclusive else " WHERE timestamp < ?"
+        params.append(timestamp)
+    # SQLite takes the bare columns from the row holding MAX(timestamp)
+    query += " GROUP BY product_id, pharmacy_id"
+    return {
+        (product_id, pharmacy_id): (product_name, pharmacy_name, price)
+        for product_id, pharmacy_id, product_name, pharmacy_name, price, _ in conn.execute(query, params)
+        if price is not None
+    }
+
+class _ChangeTracker:
+    """Last known price per (product_id, pharmacy_id), kept in memory between ingestions."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.db_path = None
+        self.timestamp = None
+        self.prices = {}
+
+    def state_before(self, conn, timestamp, latest_capture):
+        """Return the prices in effect just before `timestamp`, from memory when it is current."""
+        if latest_capture is not None and timestamp <= latest_capture:
+            # Back-filling an earlier capture: reconstruct from the database, unless it directly
+            # follows the capture written last (captures back-filled in order, e.g. by a replay)
+            capture_before = conn.execute(
+                "SELECT MAX(timestamp) FROM detailed_price_captures WHERE timestamp < ?", (timestamp,)
+            ).fetchone()[0]
+            if capture_before is not None and self.db_path == DB_PATH and self.timestamp == capture_before:
+                return self.prices
+            return _prices_as_of(conn, timestamp)
+        if self.db_path != DB_PATH or self.timestamp != latest_capture:
+            # Another process (or a direct write) has ingested since we last looked
+            self.prices = _prices_as_of(conn, None)
+            self.db_path = DB_PATH
+            self.timestamp = latest_capture
+        return self.prices
+
+    def advance(self, timestamp, prices):
+        self.db_path = DB_PATH
+        self.timestamp = timestamp
+        self.prices = prices
+
+_change_tracker = _ChangeTracker()
+
+def save_detailed_prices_bulk(data, timestamp=None, batch_size=BULK_BATCH_SIZE, deferred=False):
+    """
+    Bulk-insert columnar detailed price data in a single transaction.
+
+    With DETAILED_PRICE_STORAGE = "changes" only prices that changed, appeared or
+    disappeared since the previous capture are written; "full" writes every price
+    (plus removal markers). Either way the capture itself is recorded, so
+    get_pharmacy_price_history can reconstruct every point in time.
+
+    Args:
+        data: DataFrame or mapping of column name to list / NumPy array / Series,
+            with the columns in DETAILED_PRICE_COLUMNS
+        timestamp: Optional timestamp (uses current time if not provided)
+        batch_size: Rows per executemany call
+        deferred: Leave the rollups and the price cube alone, for a caller writing many captures
+            in a row; it must call rebuild_rollups over them afterwards
+
+    Returns:
+        dict: {"inserted": rows that were new, "replaced": rows that overwrote an
+        existing (timestamp, product_id, pharmacy_id) row, "unchanged": prices
+        skipped because they did not change, "removed": prices no longer listed}
+    """
+    columns = _detailed_columns(data)
+    if not columns["product_id"]:
+        return {"inserted": 0, "replaced": 0, "unchanged": 0, "removed": 0}
+
+    if timestamp is None:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    current = {
+        (product_id, pharmacy_id): (product_name, pharmacy_name, price)
+        for product_id, product_name, pharmacy_id, pharmacy_name, price in zip(
+            columns["product_id"], columns["product_name"], columns["pharmacy_id"],
+            columns["pharmacy_name"], columns["price"]
+        )
+        if price is not None
+    }
+
+    with _change_tracker.lock, get_connection_manager().write() as conn:
+        # Take the write lock up front so the state we diff against can't change underneath us
+        conn.execute("BEGIN IMMEDIATE")
+        latest_capture = conn.execute("SELECT MAX(timestamp) FROM detailed_price_captures").fetchone()[0]
+        previous = _change_tracker.state_before(conn, timestamp, latest_capture)
+        next_capture = None
+        if latest_capture is not None and timestamp < latest_capture:
+            next_capture = conn.execute(
+                "SELECT MIN(timestamp) FROM detailed_price_captures WHERE timestamp > ?", (timestamp,)
+            ).fetchone()[0]
+            next_state = _prices_as_of(conn, next_capture, inclusive=True)
+
+        # Re-ingesting a capture replaces it completely
+        recaptured = conn.execute(
+            "SELECT 1 FROM detailed_price_captures WHERE timestamp = ?", (timestamp,)
+        ).fetchone() is not None
+        existing = set(conn.execute(
+            "SELECT product_id, pharmacy_id FROM detailed_price_data WHERE timestamp = ?", (timestamp,)
+        ).fetchall())
+        if existing:
+            conn.execute("DELETE FROM detailed_price_data WHERE timestamp = ?", (timestamp,))
+
+        if DETAILED_PRICE_STORAGE == "full":
+            rows = [(timestamp, key[0], value[0], key[1], value[1], value[2]) for key, value in current.items()]
+        else:
+            rows = [
+                (timestamp, key[0], value[0], key[1], value[1], value[2])
+                for key, value in current.items()
+                if key not in previous or previous[key][2] != value[2]
+            ]
+        removed = [
+            (timestamp, key[0], value[0], key[1], value[1], None)
+            for key, value in previous.items() if key not in current
+        ]
+        rows.extend(removed)
+
+        for start in range(0, len(rows), batch_size):
+            conn.executemany("""
+                INSERT OR REPLACE INTO detailed_price_data
+                (timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows[start:start + batch_size])
+
+        if next_capture is not None:
+            # Keep the following capture's prices as they were before this back-fill
+            _restore_capture(conn, next_capture, next_state, set(current) | set(previous) | existing)
+
+        conn.execute(
+            "INSERT OR REPLACE INTO detailed_price_captures (timestamp, price_count, rows_written) VALUES (?, ?, ?)",
+            (timestamp, len(current), len(rows))
+        )
+
+        if recaptured and not deferred:
+            # The replaced capture's prices are already in the rollups and can't be subtracted
+            _rebuild_rollups(conn, timestamp, timestamp)
+        elif not deferred:
+            _add_to_rollups(conn, timestamp, current, batch_size)
+
+        _change_tracker.advance(timestamp, current)
+        if next_capture is not None:
+            # Snapshots after this capture compared against the prices it replaced
+            _delete_snapshot_diffs(conn, "timestamp > ?", timestamp)
+
+    if not deferred and PRICE_CUBE_ENABLED and _price_cube is not None and _price_cube.db_path == DB_PATH:
+        # Append the new capture (or rebuild after a back-fill) while it's cheap to do so
+        get_price_cube()
+
+    if recaptured or next_capture is not None:
+        _notify_history_rewrite(timestamp)
+
+    replaced = sum(1 for row in rows if (row[1], row[3]) in existing)
+    return {
+        "inserted": len(rows) - replaced,
+        "replaced": replaced,
+        "unchanged": len(current) - (len(rows) - len(removed)),
+        "removed": len(removed),
+    }
+
+def _restore_capture(conn, capture_timestamp, expected, keys):
+    """
+    Pin prices at a capture after an earlier capture was rewritten.
+
+    For every key touched by the earlier write that has no row of its own at
+    `capture_timestamp`, write the price that was in effect there before
+    (or a removal marker), so the later capture reconstructs unchanged.
+    """
+    pinned = set(conn.execute(
+        "SELECT product_id, pharmacy_id FROM detailed_price_data WHERE timestamp = ?", (capture_timestamp,)
+    ).fetchall())
+    now_in_effect = _prices_as_of(conn, capture_timestamp, inclusive=True)
+    rows = []
+    for key in keys:
+        if key in pinned:
+            continue
+        was, now = expected.get(key), now_in_effect.get(key)
+        if was == now:
+            continue
+        if was is not None:
+            rows.append((capture_timestamp, key[0], was[0], key[1], was[1], was[2]))
+        else:
+            rows.append((capture_timestamp, key[0], now[0], key[1], now[1], None))
+    conn.executemany("""
+        INSERT OR REPLACE INTO detailed_price_data
+        (timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows)
+
+# Bucket sizes of the detailed price rollups; hours and days nest inside (Monday-based) weeks
+ROLLUP_RESOLUTIONS = ["hour", "day", "week"]
+
+def rollup_bucket(timestamp, resolution):
+    """
+    Return the start of the rollup bucket containing a timestamp.
+
+    Args:
+        timestamp: Timestamp string (YYYY-MM-DD HH:MM:SS)
+        resolution: One of ROLLUP_RESOLUTIONS
+
+    Returns:
+        str: Bucket start in the same format
+    """
+    if resolution == "hour":
+        return timestamp[:13] + ":00:00"
+    if resolution == "day":
+        return timestamp[:10] + " 00:00:00"
+    if resolution == "week":
+        day = datetime.date.fromisoformat(timestamp[:10])
+        return f"{day - datetime.timedelta(days=day.weekday())} 00:00:00"
+    raise ValueError(f"Unknown resolution: {resolution}. Available: {', '.join(ROLLUP_RESOLUTIONS)}")
+
+def _add_to_rollups(conn, timestamp, prices, batch_size=BULK_BATCH_SIZE):
+    """Fold one new capture's listed prices into the rollup buckets containing it."""
+    buckets = [(resolution, rollup_bucket(timestamp, resolution)) for resolution in ROLLUP_RESOLUTIONS]
+    rows = [
+        (resolution, key[0], key[1], bucket, value[2], value[2], value[2], value[2], timestamp)
+        for key, value in prices.items()
+        for resolution, bucket in buckets
+    ]
+    for start in range(0, len(rows), batch_size):
+        conn.executemany("""
+            INSERT INTO detailed_price_rollups
+            (resolution, product_id, pharmacy_id, bucket, min_price, max_price, sum_price,
+             price_count, last_price, last_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT (resolution, product_id, pharmacy_id, bucket) DO UPDATE SET
+                min_price = MIN(min_price, excluded.min_price),
+                max_price = MAX(max_price, excluded.max_price),
+                sum_price = sum_price + excluded.sum_price,
+                price_count = price_count + 1,
+                last_price = CASE WHEN excluded.last_timestamp >= last_timestamp
+                                  THEN excluded.last_price ELSE last_price END,
+                last_timestamp = MAX(last_timestamp, excluded.last_timestamp)
+        """, rows[start:start + batch_size])
+
+def _rebuild_rollups(conn, start, end):
+    """
+    Recompute every rollup bucket overlapping [start, end] from the reconstructed history.
+
+    Works one week at a time, so at most a week of buckets is held in memory.
+    """
+    week = rollup_bucket(start, "week")
+    while week <= end:
+        week_end = str(datetime.datetime.fromisoformat(week) + datetime.timedelta(days=7))
+        buckets = {}
+        rows = _iter_history_rows(conn, None, None, week, None, None, week_end, None, 1000)
+        for _, timestamp, product_id, _, pharmacy_id, _, price in rows:
+            for resolution in ROLLUP_RESOLUTIONS:
+                key = (resolution, product_id, pharmacy_id, rollup_bucket(timestamp, resolution))
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = [price, price, price, 1, price, timestamp]
+                    continue
+                bucket[0] = min(bucket[0], price)
+                bucket[1] = max(bucket[1], price)
+                bucket[2] += price
+                bucket[3] += 1
+                if timestamp > bucket[5]:
+                    bucket[4], bucket[5] = price, timestamp
+
+        conn.execute(
+            "DELETE FROM detailed_price_rollups WHERE bucket >= ? AND bucket < ?", (week, week_end)
+        )
+        conn.executemany("""
+            INSERT INTO detailed_price_rollups
+            (resolution, product_id, pharmacy_id, bucket, min_price, max_price, sum_price,
+             price_count, last_price, last_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (key + tuple(values) for key, values in buckets.items()))
+        week = week_end
+
+def rebuild_rollups(start, end):
+    """Recompute the rollup buckets overlapping [start, end], e.g. after captures were saved with deferred=True."""
+    with span("rebuild_rollups"), get_connection_manager().write() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _rebuild_rollups(conn, start, end)
+
+def get_price_aggregates(product_id, pharmacy_id=None, resolution="day", start_date=None, end_date=None):
+    """
+    Get bucketed price statistics for one product, per pharmacy, from the rollup tables.
+
+    Every capture counts once: a bucket's min, max and mean are over the price the
+    pharmacy listed at each capture in it, and last is the price at the latest one.
+
+    Args:
+        product_id: Product ID
+        pharmacy_id: Optional pharmacy ID to filter by
+        resolution: Bucket size, one of ROLLUP_RESOLUTIONS
+        start_date: Optional start of the time range (its bucket is included)
+        end_date: Optional end of the time range
+
+    Returns:
+        DataFrame: pharmacy_id, pharmacy_name, bucket, min, max, mean, last and count,
+        ordered by pharmacy and bucket
+    """
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}. Available: {', '.join(ROLLUP_RESOLUTIONS)}")
+
+    query = """
+        SELECT rollups.pharmacy_id, names.pharmacy_name, rollups.bucket,
+               rollups.min_price AS min, rollups.max_price AS max,
+               rollups.sum_price / rollups.price_count AS mean,
+               rollups.last_price AS last, rollups.price_count AS count
+        FROM detailed_price_rollups AS rollups
+        LEFT JOIN (
+            -- SQLite takes the bare column from the row holding MAX(timestamp)
+            SELECT pharmacy_id, pharmacy_name, MAX(timestamp)
+            FROM detailed_price_data WHERE product_id = ? GROUP BY pharmacy_id
+        ) AS names ON names.pharmacy_id = rollups.pharmacy_id
+        WHERE rollups.resolution = ? AND rollups.product_id = ?
+    """
+    params = [product_id, resolution, product_id]
+
+    if pharmacy_id:
+        query += " AND rollups.pharmacy_id = ?"
+        params.append(pharmacy_id)
+
+    if start_date:
+        query += " AND rollups.bucket >= ?"
+        params.append(rollup_bucket(start_date, resolution))
+
+    if end_date:
+        query += " AND rollups.bucket <= ?"
+        params.append(end_date)
+
+    query += " ORDER BY rollups.pharmacy_id, rollups.bucket"
+
+    with get_connection_manager().read() as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def save_detailed_prices(data, timestamp=None, deferred=False):
     """
     Save detailed price data from all top pharmacies for historical analysis.
     
     Args:
-        data: List of dictionaries containing detailed price data
+        data: List of dictionaries containing detailed price data, or a mapping of
+            column name to values (see save_detailed_prices_bulk)
         timestamp: Optional timestamp (uses current time if not provided)
+        deferred: See save_detailed_prices_bulk
     
     Returns:
         bool: Success or failure
     """
-    if not data:
+    if isinstance(data, list):
+        data = {column: [item.get(column) for item in data] for column in DETAILED_PRICE_COLUMNS}
+    if data is None or not len(data.get("price", [])):
         return False
     
-    if timestamp is None:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
     try:
-        for item in data:
-            c.execute("""
-                INSERT OR REPLACE INTO detailed_price_data 
-                (timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                timestamp,
-                item.get("product_id"),
-                item.get("product_name"),
-                item.get("pharmacy_id"),
-                item.get("pharmacy_name"),
-                item.get("price")
-            ))
-        
-        conn.commit()
-        conn.close()
+        with span("save_detailed_prices", rows=len(data["price"])):
+            save_detailed_prices_bulk(data, timestamp, deferred=deferred)
         return True
     except Exception as e:
-        print(f"Error saving detailed price data: {e}")
-        conn.rollback()
-        conn.close()
+        logger.error("Error saving detailed price data: %s", e)
         return False
 
-def get_pharmacy_price_history(product_id=None, pharmacy_id=None, start_date=None, end_date=None):
+# Columns available from the pharmacy price history (for `fields=` projections)
+HISTORY_FIELDS = ["id", "timestamp", "product_id", "product_name", "pharmacy_id", "pharmacy_name", "price"]
+
+# Prices covered by one history query when reading without a limit (exports)
+HISTORY_WINDOW_PRICES = 50_000
+
+def encode_history_cursor(row):
+    """Build the opaque keyset cursor pointing just after a history row."""
+    key = [row["timestamp"], row["product_id"], row["pharmacy_id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def decode_history_cursor(cursor):
+    """Decode a keyset cursor into (timestamp, product_id, pharmacy_id); raises ValueError if malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not (isinstance(key, list) and len(key) == 3 and all(isinstance(part, str) for part in key)):
+            raise ValueError
+        return tuple(key)
+    except (ValueError, UnicodeError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def iter_pharmacy_price_history(product_id=None, pharmacy_id=None, start_date=None, end_date=None,
+                                fields=None, cursor=None, limit=None, chunk_size=1000):
     """
-    Get historical price data filtered by product and/or pharmacy.
-    
+    Stream reconstructed price history rows straight from the SQLite cursor.
+
+    Rows are ordered by timestamp (newest first), then product_id and pharmacy_id,
+    which is also the keyset the cursor points into. The history is read in
+    windows of recent captures, so memory stays bounded however much is read.
+
     Args:
         product_id: Optional product ID to filter by
         pharmacy_id: Optional pharmacy ID to filter by
         start_date: Optional start date for the time range
         end_date: Optional end date for the time range
-        
+        fields: Optional list of HISTORY_FIELDS to return (all by default)
+        cursor: Optional cursor from a previous page; rows after it are returned
+        limit: Optional maximum number of rows
+        chunk_size: Rows fetched from SQLite at a time
+
     Returns:
-        DataFrame: Historical price data matching the criteria
+        Iterator of dicts, one history row with the requested fields each
+
+    Raises:
+        ValueError: If a field is unknown or the cursor is malformed (checked
+        before any row is read)
     """
-    conn = sqlite3.connect(DB_PATH)
-    
-    query = "SELECT * FROM detailed_price_data WHERE 1=1"
+    fields = list(fields) if fields else HISTORY_FIELDS
+    unknown = [field for field in fields if field not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(HISTORY_FIELDS)}")
+    after = decode_history_cursor(cursor) if cursor else None
+    return _stream_history(product_id, pharmacy_id, start_date, end_date, fields, after, limit, chunk_size)
+
+def _stream_history(product_id, pharmacy_id, start_date, end_date, fields, after, limit, chunk_size):
+    positions = [HISTORY_FIELDS.index(field) for field in fields]
+
+    cube = get_price_cube()
+    if cube is not None:
+        for row in cube.iter_history_rows(product_id, pharmacy_id, start_date, end_date, after, limit):
+            yield {field: row[position] for field, position in zip(fields, positions)}
+        return
+
+    with get_connection_manager().read() as conn:
+        # Walk back through windows of captures just large enough for the rows still needed,
+        # so a query never joins (and sorts) the whole history
+        remaining = limit
+        budget = min(limit, HISTORY_WINDOW_PRICES) if limit is not None else HISTORY_WINDOW_PRICES
+        before = None
+        while remaining is None or remaining > 0:
+            window_start = _history_window_start(conn, start_date, end_date, after, before, budget)
+            if window_start is None:
+                return
+
+            produced = 0
+            rows = _iter_history_rows(
+                conn, product_id, pharmacy_id, start_date, end_date, after, before, window_start, chunk_size, remaining
+            )
+            for row in rows:
+                produced += 1
+                yield {field: row[position] for field, position in zip(fields, positions)}
+
+            if remaining is not None:
+                remaining -= produced
+            before = window_start
+            # The filters matched fewer rows per capture than the window was sized for
+            if produced < budget:
+                budget *= 2
+
+def _history_window_start(conn, start_date, end_date, after, before, budget):
+    """
+    Return the oldest capture of the next history window, or None if there are no captures left.
+
+    Captures are taken newest first until they hold at least `budget` prices in total.
+    """
+    filters = ""
     params = []
+    for condition, value in (("timestamp >= ?", start_date), ("timestamp <= ?", end_date),
+                             ("timestamp <= ?", after and after[0]), ("timestamp < ?", before)):
+        if value:
+            filters += f" AND {condition}"
+            params.append(value)
+
+    row = conn.execute(f"""
+        SELECT MIN(timestamp) FROM (
+            SELECT timestamp,
+                   SUM(price_count) OVER (ORDER BY timestamp DESC ROWS UNBOUNDED PRECEDING) - price_count AS preceding
+            FROM detailed_price_captures
+            WHERE 1=1{filters}
+        )
+        WHERE preceding < ?
+    """, params + [budget]).fetchone()
+    return row[0]
+
+def _iter_history_rows(conn, product_id, pharmacy_id, start_date, end_date, after, before, window_start,
+                       chunk_size, limit=None):
+    """Yield reconstructed history rows as tuples in HISTORY_FIELDS order, newest capture first."""
+    # Change rows, each valid from its timestamp until the next row for the same product and pharmacy
+    change_filters = ""
+    change_params = []
     
     if product_id:
-        query += " AND product_id = ?"
-        params.append(product_id)
+        change_filters += " AND product_id = ?"
+        change_params.append(product_id)
     
     if pharmacy_id:
-        query += " AND pharmacy_id = ?"
-        params.append(pharmacy_id)
+        change_filters += " AND pharmacy_id = ?"
+        change_params.append(pharmacy_id)
+
+    # Changes after the range (or after the cursor position) can't be in effect for any returned capture
+    upper_bound = min(bound for bound in (end_date, after and after[0], before) if bound) if (end_date or after or before) else None
+    if upper_bound:
+        change_filters += " AND timestamp <= ?"
+        change_params.append(upper_bound)
+
+    # Every capture in the range, joined with the change row in effect at that capture
+    capture_filters = ""
+    capture_params = []
     
     if start_date:
-        query += " AND timestamp >= ?"
-        params.append(start_date)
+        capture_filters += " AND captures.timestamp >= ?"
+        capture_params.append(start_date)
     
     if end_date:
-        query += " AND timestamp <= ?"
-        params.append(end_date)
-    
-    query += " ORDER BY timestamp DESC"
-    
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
+        capture_filters += " AND captures.timestamp <= ?"
+        capture_params.append(end_date)
+
+    if after:
+        capture_filters += """
+          AND (captures.timestamp < ?
+               OR (captures.timestamp = ? AND (changes.product_id, changes.pharmacy_id) > (?, ?)))"""
+        capture_params.extend([after[0], after[0], after[1], after[2]])
+
+    if before:
+        capture_filters += " AND captures.timestamp < ?"
+        capture_params.append(before)
+
+    if window_start:
+        # Changes superseded before the window can't be in effect inside it
+        capture_filters += " AND captures.timestamp >= ? AND (changes.valid_until IS NULL OR changes.valid_until > ?)"
+        capture_params.extend([window_start, window_start])
+
+    query = f"""
+        WITH changes AS (
+            SELECT id, timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price,
+                   LEAD(timestamp) OVER (PARTITION BY product_id, pharmacy_id ORDER BY timestamp) AS valid_until
+            FROM detailed_price_data
+            WHERE 1=1{change_filters}
+        )
+        SELECT changes.id, captures.timestamp, changes.product_id, changes.product_name,
+               changes.pharmacy_id, changes.pharmacy_name, changes.price
+        FROM changes
+        JOIN detailed_price_captures AS captures
+          ON captures.timestamp >= changes.timestamp
+         AND (changes.valid_until IS NULL OR captures.timestamp < changes.valid_until)
+        WHERE changes.price IS NOT NULL{capture_filters}
+        ORDER BY captures.timestamp DESC, changes.product_id, changes.pharmacy_id
+    """
+    if limit is not None:
+        query += " LIMIT ?"
+        capture_params.append(limit)
+
+    c = conn.cursor()
+    try:
+        c.execute(query, change_params + capture_params)
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        c.close()
+
+def get_pharmacy_price_history(product_id=None, pharmacy_id=None, start_date=None, end_date=None,
+                               fields=None, cursor=None, limit=None):
+    """
+    Get one page of historical price data filtered by product and/or pharmacy.
     
-    return df
+    Args:
+        product_id: Optional product ID to filter by
+        pharmacy_id: Optional pharmacy ID to filter by
+        start_date: Optional start date for the time range
+        end_date: Optional end date for the time range
+        fields: Optional list of HISTORY_FIELDS to return (all by default)
+        cursor: Optional cursor returned with the previous page
+        limit: Optional page size (all matching rows if not provided)
+        
+    Returns:
+        tuple: (list of row dictionaries, one per capture with the price each pharmacy
+        listed at that capture; cursor for the next page or None if this is the last one)
+    """
+    fields = list(fields) if fields else HISTORY_FIELDS
+    # The cursor needs the keyset columns even if they weren't requested
+    keyset = ["timestamp", "product_id", "pharmacy_id"]
+    selected = fields + [field for field in keyset if field not in fields]
+
+    rows = list(iter_pharmacy_price_history(
+        product_id, pharmacy_id, start_date, end_date, selected, cursor,
+        limit + 1 if limit is not None else None
+    ))
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1])
+
+    if selected != fields:
+        rows = [{field: row[field] for field in fields} for row in rows]
+    return rows, next_cursor
+
+# Created by the first get_price_cube call, so importing this module doesn't load NumPy
+_price_cube = None
+_price_cube_lock = threading.Lock()
+
+def _price_cube_path():
+    return PRICE_CUBE_PATH or f"{DB_PATH}.cube"
+
+def get_price_cube():
+    """
+    Return the price cube, synced with the database (None if PRICE_CUBE_ENABLED is off).
+
+    The first call loads the saved cube (or builds it from detailed_price_data);
+    later calls only append captures stored since.
+    """
+    global _price_cube
+    if not PRICE_CUBE_ENABLED:
+        return None
+    with _price_cube_lock:
+        if _price_cube is None:
+            _price_cube = PriceCube()
+    with _price_cube.lock:
+        if _price_cube.db_path != DB_PATH:
+            _price_cube.load(_price_cube_path(), DB_PATH)
+        with get_connection_manager().read() as conn:
+            _price_cube.sync(conn, DB_PATH)
+    return _price_cube
+
+def save_price_cube():
+    """
+    Save the price cube next to the database so the next start can memory-map it.
+
+    Worker processes shutting down together would write the same files, so only
+    the one that takes the "price-cube-save" lease saves; the others skip.
+    """
+    if PRICE_CUBE_ENABLED and _price_cube is not None and _price_cube.db_path == DB_PATH:
+        owner = f"{os.getpid()}:{id(_price_cube)}"
+        if not acquire_lease("price-cube-save", owner, 300):
+            return
+        try:
+            _price_cube.save(_price_cube_path())
+        finally:
+            release_lease("price-cube-save", owner)
+
+def get_price_summary_before(timestamp, competitor_excluded=None, pharmacies=None, inclusive=False):
+    """
+    Get the cheapest and best competitor price per product at the last capture before a timestamp.
+
+    Args:
+        timestamp: Point in time (exclusive unless `inclusive`)
+        competitor_excluded: Pharmacy ID that doesn't count as a competitor
+        pharmacies: Mapping of pharmacy ID to display name to compare (None for every stored pharmacy)
+        inclusive: Whether a capture at exactly `timestamp` counts
+
+    Returns:
+        tuple: (capture timestamp, DataFrame), or (None, None) if there is no earlier
+        capture, or the price cube is disabled and no pharmacies were given
+    """
+    cube = get_price_cube()
+    if cube is not None:
+        return cube.summary_before(timestamp, competitor_excluded, pharmacies, inclusive)
+    if pharmacies is None:
+        return None, None
+
+    # Without the cube, reconstruct the group's prices at that capture from the change rows
+    with get_connection_manager().read() as conn:
+        conn.execute("BEGIN")
+        capture = conn.execute(
+            f"SELECT MAX(timestamp) FROM detailed_price_captures WHERE timestamp {'<=' if inclusive else '<'} ?", (timestamp,)
+        ).fetchone()[0]
+        if capture is None:
+            return None, None
+        prices = _prices_as_of(conn, capture, inclusive=True)
+    rows = [(key, value) for key, value in prices.items() if key[1] in pharmacies]
+    products = {}
+    for (product_id, _), (product_name, _, _) in rows:
+        products.setdefault(product_id, product_name)
+    product_index = {product_id: position for position, product_id in enumerate(products)}
+    vendor_ids = list(pharmacies)
+    vendor_index = {pharmacy_id: position for position, pharmacy_id in enumerate(vendor_ids)}
+    vendor_prices = VendorPrices(
+        np.array(list(products), dtype=object),
+        np.array(list(products.values()), dtype=object),
+        np.full(len(products), "", dtype=object),
+        np.array(vendor_ids, dtype=object),
+        np.array([product_index[product_id] for (product_id, _), _ in rows], dtype=np.int32),
+        np.array([vendor_index[pharmacy_id] for (_, pharmacy_id), _ in rows], dtype=np.int32),
+        np.array([price for _, (_, _, price) in rows], dtype=np.float64),
+    )
+    return capture, vendor_prices.summary(pharmacies, competitor_excluded).drop(columns=["Kultivar"])
 
 def get_all_timestamps():
     """Get all timestamps from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT timestamp FROM price_data ORDER BY timestamp DESC")
-    timestamps = [row[0] for row in c.fetchall()]
-    conn.close()
-    return timestamps
+    return get_snapshot_timestamps()
+
+def get_snapshot_timestamps(start=None, end=None, before=None, limit=None):
+    """
+    Get snapshot timestamps, newest first, optionally filtered to a range and paged.
+
+    Args:
+        start: Earliest timestamp to include
+        end: Latest timestamp to include
+        before: Only timestamps strictly older than this one (the last timestamp of the previous page)
+        limit: Maximum number of timestamps to return
+
+    Returns:
+        list: Timestamps, newest first
+    """
+    conditions, params = [], []
+    for condition, value in (("timestamp >= ?", start), ("timestamp <= ?", end), ("timestamp < ?", before)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    query = "SELECT timestamp FROM snapshots"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    with get_connection_manager().read() as conn:
+        return [row[0] for row in conn.execute(query, params)]
+
+def get_retention_runs(limit=10):
+    """Return the latest history compaction runs as dicts, newest first."""
+    with get_connection_manager().read() as conn:
+        cursor = conn.execute("SELECT * FROM retention_runs ORDER BY id DESC LIMIT ?", (limit,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+def save_raw_payload(timestamp, payload, snapshot=False):
+    """
+    Record which raw payload a capture was derived from.
+
+    Args:
+        timestamp: Capture timestamp
+        payload: Stored payload, as returned by payload_store.PayloadRecorder.close
+        snapshot: Whether a snapshot was stored from it (a later call with False keeps an earlier True)
+    """
+    with get_connection_manager().write() as conn:
+        conn.execute("""
+            INSERT INTO raw_payloads (timestamp, digest, encoding, raw_bytes, stored_bytes, snapshot)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (timestamp) DO UPDATE SET
+                digest = excluded.digest, encoding = excluded.encoding, raw_bytes = excluded.raw_bytes,
+                stored_bytes = excluded.stored_bytes, snapshot = MAX(snapshot, excluded.snapshot)
+        """, (timestamp, payload["digest"], payload["encoding"], payload["raw_bytes"], payload["stored_bytes"], int(snapshot)))
+
+def get_raw_payloads(start=None, end=None):
+    """
+    Return the recorded raw payloads of the captures in a range as dicts, oldest first.
+
+    Args:
+        start: Earliest timestamp to include
+        end: Latest timestamp to include
+    """
+    conditions, params = [], []
+    for condition, value in (("timestamp >= ?", start), ("timestamp <= ?", end)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    query = "SELECT timestamp, digest, encoding, raw_bytes, stored_bytes, snapshot FROM raw_payloads"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp"
+    with get_connection_manager().read() as conn:
+        cursor = conn.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+def get_timestamps_version():
+    """
+    Return a value that changes whenever the list of snapshot timestamps may have changed.
+
+    Cheap to compute (no snapshot is read), for use as a validator.
+    """
+    with get_connection_manager().read() as conn:
+        # snapshots rows get a new rowid whenever a snapshot is added or replaced
+        count, max_rowid = conn.execute("SELECT COUNT(*), MAX(rowid) FROM snapshots").fetchone()
+    return f"{count}-{max_rowid or 0}"
 
 def get_data_by_timestamp(timestamp):
     """Retrieve data from the database by timestamp."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT data FROM price_data WHERE timestamp = ?", (timestamp,))
-    result = c.fetchone()
-    conn.close()
-    
-    if result:
-        return pd.read_json(result[0], orient="records")
-    return None
+    with get_connection_manager().read() as conn:
+        return _read_snapshot(conn, timestamp)
+
+def get_snapshot_prices(timestamps, price_column="Price (€/g)"):
+    """
+    Read one price column of several stored snapshots through one connection.
+
+    Each snapshot is an indexed range read of two columns; the product names
+    are only read from the newest snapshots until every product has one.
+    See get_price_matrix for the vectorized read from the price cube.
+
+    Args:
+        timestamps: Snapshot timestamps
+        price_column: Snapshot column to read ("Price (€/g)" or "Best Competitor Price (€/g)")
+
+    Returns:
+        dict: "product_ids" and "prices", one list per timestamp in snapshot order, and
+        "names", product ID -> Sorte as listed in the newest of the snapshots
+    """
+    if price_column not in ("Price (€/g)", "Best Competitor Price (€/g)"):
+        raise ValueError(f"Not a price column: {price_column}")
+    product_ids, prices = [], []
+    names = {}
+    with get_connection_manager().read() as conn:
+        query = f"SELECT product_id, {SNAPSHOT_COLUMNS[price_column]} FROM snapshot_prices WHERE timestamp = ? ORDER BY position"
+        for timestamp in timestamps:
+            rows = conn.execute(query, (timestamp,)).fetchall()
+            columns = list(zip(*rows)) if rows else [(), ()]
+            product_ids.append(list(columns[0]))
+            prices.append(list(columns[1]))
+        remaining = set().union(*product_ids) if product_ids else set()
+        for timestamp in sorted(timestamps, reverse=True):
+            if not remaining:
+                break
+            for product_id, sorte in conn.execute("SELECT product_id, sorte FROM snapshot_prices WHERE timestamp = ?", (timestamp,)):
+                if product_id in remaining:
+                    names[product_id] = sorte
+                    remaining.discard(product_id)
+    return {"product_ids": product_ids, "prices": prices, "names": names}
+
+def get_price_matrix(timestamps, price_column="Price (€/g)", competitor_excluded=None, pharmacies=None, stored_group=True):
+    """
+    Get one price per product at several snapshots as a product × snapshot matrix.
+
+    Computed from the price cube in one vectorized pass when every timestamp is
+    a detailed price capture in it, otherwise read from the stored snapshots.
+
+    Args:
+        timestamps: Snapshot timestamps, oldest first
+        price_column: "Price (€/g)" (the cheapest price) or "Best Competitor Price (€/g)"
+        competitor_excluded: Pharmacy ID that doesn't count as a competitor
+        pharmacies: Mapping of pharmacy ID to display name to compare (None for every stored pharmacy)
+        stored_group: Whether the pharmacies are the group the snapshots were stored with, so the
+            stored snapshots can stand in for the cube
+
+    Returns:
+        tuple: (product IDs, product names, float matrix with one row per product and one column
+        per timestamp, NaN where there is no price)
+
+    Raises:
+        ValueError: If the snapshots can't be compared with another group than they were stored with
+    """
+    if price_column not in ("Price (€/g)", "Best Competitor Price (€/g)"):
+        raise ValueError(f"Not a price column: {price_column}")
+    cube = get_price_cube()
+    if cube is not None:
+        matrix = cube.price_matrix(timestamps, competitor_excluded, pharmacies, competitor=price_column != "Price (€/g)")
+        if matrix is not None:
+            return matrix
+    if not stored_group:
+        raise ValueError("Comparing another pharmacy group needs the detailed prices of every selected snapshot in the price cube")
+    return build_price_matrix(timestamps, get_snapshot_prices(timestamps, price_column))
+
+def save_snapshot_diff(timestamp, diff):
+    """
+    Store the diff of an already saved snapshot (see save_to_db).
+
+    Returns:
+        bool: False if there is no snapshot under `timestamp` or its size doesn't match the diff
+    """
+    with get_connection_manager().write() as conn:
+        row = conn.execute("SELECT product_count FROM snapshots WHERE timestamp = ?", (timestamp,)).fetchone()
+        if row is None or row[0] != len(diff["trend"]):
+            return False
+        _insert_snapshot_diff(conn, timestamp, diff)
+    return True
+
+def get_data_with_diff(timestamp):
+    """
+    Load a snapshot joined with its stored diff.
+
+    Returns:
+        tuple: (snapshot DataFrame with "Trend" and "Competitor Trend" columns, dict with
+        "previous_timestamp" and the summary counts); (DataFrame without trend columns, None)
+        if no diff is stored; (None, None) if there is no snapshot
+    """
+    with get_connection_manager().read() as conn:
+        # One read transaction, so the snapshot and its diff are consistent
+        conn.execute("BEGIN")
+        summary = conn.execute(
+            f"SELECT previous_timestamp, {', '.join(DIFF_SUMMARY_COLUMNS)} FROM snapshot_diffs WHERE timestamp = ?",
+            (timestamp,)
+        ).fetchone()
+        if summary is None:
+            return _read_snapshot(conn, timestamp), None
+        rows = conn.execute(
+            f"""
+            SELECT {", ".join("p." + column for column in SNAPSHOT_COLUMNS.values())},
+                   d.trend, d.competitor_trend
+            FROM snapshot_prices AS p
+            JOIN snapshot_diff_rows AS d ON d.timestamp = p.timestamp AND d.position = p.position
+            WHERE p.timestamp = ?
+            ORDER BY p.position
+            """,
+            (timestamp,)
+        ).fetchall()
+    if not rows:
+        return None, None
+    df = pd.DataFrame.from_records(rows, columns=list(SNAPSHOT_COLUMNS) + ["Trend", "Competitor Trend"])
+    df["Price (€/g)"] = df["Price (€/g)"].astype(float)
+    df["Best Competitor Price (€/g)"] = df["Best Competitor Price (€/g)"].astype(float)
+    return df, dict(zip(["previous_timestamp"] + DIFF_SUMMARY_COLUMNS, summary))
+
+def get_snapshot_diff(timestamp):
+    """
+    Load the stored diff of a snapshot, per product.
+
+    Returns:
+        tuple: (DataFrame with id, Sorte, Trend, Competitor Trend, Price Change (€/g) and
+        Competitor Price Change (€/g), dict with "previous_timestamp" and the summary counts),
+        or (None, None) if no diff is stored
+    """
+    with get_connection_manager().read() as conn:
+        # One read transaction, so the snapshot and its diff are consistent
+        conn.execute("BEGIN")
+        summary = conn.execute(
+            f"SELECT previous_timestamp, {', '.join(DIFF_SUMMARY_COLUMNS)} FROM snapshot_diffs WHERE timestamp = ?",
+            (timestamp,)
+        ).fetchone()
+        if summary is None:
+            return None, None
+        rows = conn.execute(
+            """
+            SELECT p.product_id, p.sorte, d.trend, d.competitor_trend, d.price_delta, d.competitor_delta
+            FROM snapshot_diff_rows AS d
+            JOIN snapshot_prices AS p ON p.timestamp = d.timestamp AND p.position = d.position
+            WHERE d.timestamp = ?
+            ORDER BY d.position
+            """,
+            (timestamp,)
+        ).fetchall()
+    df = pd.DataFrame.from_records(rows, columns=[
+        "id", "Sorte", "Trend", "Competitor Trend", "Price Change (€/g)", "Competitor Price Change (€/g)"
+    ])
+    df["Price Change (€/g)"] = df["Price Change (€/g)"].astype(float)
+    df["Competitor Price Change (€/g)"] = df["Competitor Price Change (€/g)"].astype(float)
+    return df, dict(zip(["previous_timestamp"] + DIFF_SUMMARY_COLUMNS, summary))
+
+def get_timestamps_without_diff():
+    """Timestamps of the snapshots that have no stored diff, oldest first."""
+    with get_connection_manager().read() as conn:
+        return [row[0] for row in conn.execute("""
+            SELECT timestamp FROM snapshots
+            WHERE timestamp NOT IN (SELECT timestamp FROM snapshot_diffs)
+            ORDER BY timestamp
+        """)]
+
+def get_pharmacy_group_rows(name=None):
+    """
+    Load the stored pharmacy groups (or only the one called `name`).
+
+    Returns:
+        list: Dictionaries with name, own_pharmacy_id and pharmacies (pharmacy ID to name), by name
+    """
+    with get_connection_manager().read() as conn:
+        conn.execute("BEGIN")
+        params = (name,) if name is not None else ()
+        groups = {
+            group_name: {"name": group_name, "own_pharmacy_id": own_pharmacy_id, "pharmacies": {}}
+            for group_name, own_pharmacy_id in conn.execute(
+                f"SELECT name, own_pharmacy_id FROM pharmacy_groups {'WHERE name = ?' if params else ''} ORDER BY name",
+                params
+            )
+        }
+        members = conn.execute(
+            f"SELECT group_name, pharmacy_id, pharmacy_name FROM pharmacy_group_members {'WHERE group_name = ?' if params else ''}",
+            params
+        ).fetchall()
+    for group_name, pharmacy_id, pharmacy_name in members:
+        if group_name in groups:
+            groups[group_name]["pharmacies"][pharmacy_id] = pharmacy_name
+    return list(groups.values())
+
+def save_pharmacy_group(name, pharmacies, own_pharmacy_id=None):
+    """
+    Create or replace a pharmacy group.
+
+    Args:
+        name: Group name
+        pharmacies: Mapping of pharmacy ID to display name
+        own_pharmacy_id: Pharmacy excluded from the best competitor, or None
+    """
+    with get_connection_manager().write() as conn:
+        conn.execute("DELETE FROM pharmacy_group_members WHERE group_name = ?", (name,))
+        conn.execute("INSERT OR REPLACE INTO pharmacy_groups (name, own_pharmacy_id) VALUES (?, ?)", (name, own_pharmacy_id))
+        conn.executemany(
+            "INSERT INTO pharmacy_group_members (group_name, pharmacy_id, pharmacy_name) VALUES (?, ?, ?)",
+            [(name, pharmacy_id, pharmacy_name) for pharmacy_id, pharmacy_name in pharmacies.items()]
+        )
+
+def delete_pharmacy_group(name):
+    """Delete a pharmacy group; returns False if it didn't exist."""
+    with get_connection_manager().write() as conn:
+        conn.execute("DELETE FROM pharmacy_group_members WHERE group_name = ?", (name,))
+        return conn.execute("DELETE FROM pharmacy_groups WHERE name = ?", (name,)).rowcount > 0
 
 def get_most_recent_data_before(current_timestamp):
     """Get the most recent data before the given timestamp."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT timestamp, data FROM price_data WHERE timestamp < ? ORDER BY timestamp DESC LIMIT 1", (current_timestamp,))
-    result = c.fetchone()
-    conn.close()
+    with get_connection_manager().read() as conn:
+        c = conn.cursor()
+        c.execute("SELECT timestamp FROM snapshots WHERE timestamp < ? ORDER BY timestamp DESC LIMIT 1", (current_timestamp,))
+        result = c.fetchone()
+        df = _read_snapshot(conn, result[0]) if result else None
     
-    if result:
-        return result[0], pd.read_json(result[1], orient="records")
-    return None, None 
\ No newline at end of file
+    if df is not None:
+        return result[0], df
+    return None, None
+
+def acquire_lease(name, owner, seconds, replace_owner=None):
+    """
+    Take or renew a named lease shared by every process using the database.
+
+    The lease is granted if nobody holds it, `owner` already holds it, or the holder's
+    lease has expired (a crashed or hung process loses it after `seconds`).
+
+    Args:
+        name: Lease name
+        owner: Unique ID of the caller (process)
+        seconds: How long the lease is valid unless renewed
+        replace_owner: Holder to take the lease from even if it hasn't expired (known to be gone)
+
+    Returns:
+        bool: True if `owner` holds the lease now
+    """
+    now = time.time()
+    with get_connection_manager().write() as conn:
+        cursor = conn.execute("""
+            INSERT INTO leases (name, owner, acquired_at, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                acquired_at = CASE WHEN leases.owner = excluded.owner THEN leases.acquired_at ELSE excluded.acquired_at END,
+                owner = excluded.owner,
+                expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at < excluded.acquired_at OR leases.owner = ?
+        """, (name, owner, now, now + seconds, replace_owner))
+        return cursor.rowcount == 1
+
+def release_lease(name, owner):
+    """Give up a lease held by `owner` (no-op if someone else holds it)."""
+    with get_connection_manager().write() as conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+def get_lease(name):
+    """
+    Return the current holder of a lease.
+
+    Returns:
+        dict: owner, acquired_at and expires_at (Unix times), or None if nobody holds an unexpired lease
+    """
+    with get_connection_manager().read() as conn:
+        row = conn.execute(
+            "SELECT owner, acquired_at, expires_at FROM leases WHERE name = ? AND expires_at >= ?", (name, time.time())
+        ).fetchone()
+    if row is None:
+        return None
+    return {"owner": row[0], "acquired_at": row[1], "expires_at": row[2]}
@@ -0,0 +1,213 @@
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import zlib
+
+from api.database import db_handler
+
+try:
+    import zstandard
+except ImportError:
+    # Optional: without it payloads are stored gzip-compressed
+    zstandard = None
+
+# Keep every raw upstream response, so history can be re-derived from it later (see api.replay_payloads)
+RAW_PAYLOAD_RECORDING = os.getenv("RAW_PAYLOAD_RECORDING", "1") not in ("0", "false", "False", "")
+
+# Directory of the compressed payloads (default: next to the database)
+RAW_PAYLOAD_PATH = os.getenv("RAW_PAYLOAD_PATH")
+
+# Compression of newly stored payloads: "zstd" (needs the zstandard package) or "gzip";
+# payloads already stored keep theirs
+RAW_PAYLOAD_COMPRESSION = os.getenv("RAW_PAYLOAD_COMPRESSION", "zstd" if zstandard is not None else "gzip")
+
+ENCODINGS = {"gzip": ".json.gz", "zstd": ".json.zst"}
+
+# Bytes of decompressed payload handed to a parser at a time when reading one back
+READ_CHUNK_BYTES = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def payload_store_path():
+    return RAW_PAYLOAD_PATH or f"{db_handler.DB_PATH}.payloads"
+
+
+def payload_path(digest, encoding, root=None):
+    """
+    Where a payload is stored: content-addressed by the SHA-256 of its raw bytes.
+
+    Args:
+        digest: Hex SHA-256 of the uncompressed payload
+        encoding: One of ENCODINGS
+        root: Store directory (None for payload_store_path())
+
+    Returns:
+        str: File path
+    """
+    return os.path.join(root or payload_store_path(), digest[:2], digest + ENCODINGS[encoding])
+
+
+def _compressor(encoding):
+    if encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("RAW_PAYLOAD_COMPRESSION is zstd, but the zstandard package is not installed")
+        return zstandard.ZstdCompressor(level=10).compressobj()
+    if encoding == "gzip":
+        # wbits 31: gzip container, so the files also open with gzip / zcat
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    raise ValueError(f"Unknown payload compression: {encoding}. Available: {', '.join(ENCODINGS)}")
+
+
+class PayloadRecorder:
+    """
+    Hashes and compresses one upstream response as it streams in, then stores it once.
+
+    Only the compressed bytes are held in memory. close() files them under
+    the SHA-256 of the raw body; a payload that is already stored (an
+    unchanged catalogue, or a retried fetch) is not written again.
+    """
+
+    def __init__(self, encoding=None, root=None):
+        """
+        Args:
+            encoding: Compression, one of ENCODINGS (None for RAW_PAYLOAD_COMPRESSION)
+            root: Store directory (None for payload_store_path())
+        """
+        self.encoding = encoding or RAW_PAYLOAD_COMPRESSION
+        self.root = root or payload_store_path()
+        self._compressor = _compressor(self.encoding)
+        self._hash = hashlib.sha256()
+        self._chunks = []
+        self._raw_bytes = 0
+
+    def feed(self, chunk):
+        """Add the next chunk of the response body (bytes)."""
+        self._hash.update(chunk)
+        self._raw_bytes += len(chunk)
+        compressed = self._compressor.compress(chunk)
+        if compressed:
+            self._chunks.append(compressed)
+
+    def close(self):
+        """
+        Store the payload unless it is stored already.
+
+        Returns:
+            dict: {"digest", "encoding", "raw_bytes", "stored_bytes", "new": False if it was already stored}
+        """
+        self._chunks.append(self._compressor.flush())
+        data = b"".join(self._chunks)
+        self._chunks = []
+        digest = self._hash.hexdigest()
+        path = payload_path(digest, self.encoding, self.root)
+        new = not os.path.exists(path)
+        if new:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written next to its final name and moved into place, so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        return {"digest": digest, "encoding": self.encoding, "raw_bytes": self._raw_bytes,
+                "stored_bytes": len(data), "new": new}
+
+
+def record_payload(body, encoding=None, root=None):
+    """
+    Store a complete payload (bytes).
+
+    Returns:
+        dict: See PayloadRecorder.close
+    """
+    recorder = PayloadRecorder(encoding, root)
+    recorder.feed(body)
+    return recorder.close()
+
+
+class RecordingParser:
+    """
+    Wraps a streaming payload parser so the body it parses is recorded as well.
+
+    Recording never fails the parse: if the payload can't be stored, a
+    warning is logged and `payload` stays None.
+    """
+
+    def __init__(self, parser, encoding=None, root=None):
+        """
+        Args:
+            parser: Object with feed(bytes) and close() -> result
+            encoding: Compression, one of ENCODINGS (None for RAW_PAYLOAD_COMPRESSION)
+            root: Store directory (None for payload_store_path())
+        """
+        self.parser = parser
+        self.recorder = PayloadRecorder(encoding, root)
+        # Set by close(): see PayloadRecorder.close
+        self.payload = None
+
+    def feed(self, chunk):
+        self.recorder.feed(chunk)
+        self.parser.feed(chunk)
+
+    def close(self):
+        result = self.parser.close()
+        try:
+            self.payload = self.recorder.close()
+        except Exception as e:
+            logger.warning("Could not record the upstream payload: %s", e)
+        return result
+
+
+def open_payload(digest, encoding, root=None):
+    """
+    Open a stored payload for reading its uncompressed bytes.
+
+    Returns:
+        A binary file object (close it, or use it as a context manager)
+
+    Raises:
+        FileNotFoundError: If the payload is not in the store
+        ValueError: If it is zstd-compressed and zstandard is not installed
+    """
+    path = payload_path(digest, encoding, root)
+    if encoding == "gzip":
+        return gzip.open(path, "rb")
+    if zstandard is None:
+        raise ValueError(f"Payload {digest} is zstd-compressed, but the zstandard package is not installed")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+
+
+def parse_payload(digest, encoding, make_parser, root=None):
+    """
+    Feed a stored payload to a fresh streaming parser, the way a live response is parsed.
+
+    Args:
+        digest: Hex SHA-256 of the payload
+        encoding: Its compression
+        make_parser: Returns an object with feed(bytes) and close() -> result
+        root: Store directory (None for payload_store_path())
+
+    Returns:
+        The parser's result
+
+    Raises:
+        ValueError: If the digest doesn't match the stored bytes or the parser rejects them
+    """
+    parser = make_parser()
+    digest_check = hashlib.sha256()
+    with open_payload(digest, encoding, root) as f:
+        while True:
+            chunk = f.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest_check.update(chunk)
+            parser.feed(chunk)
+    if digest_check.hexdigest() != digest:
+        raise ValueError(f"Stored payload {digest} is corrupt")
+    return parser.close()
@@ -0,0 +1,516 @@
+import bisect
+import json
+import os
+import threading
+
+from api.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+# Change rows read from the database per batch while building or catching up
+REPLAY_BATCH_ROWS = 65536
+
+# Prices (captures × keys) looked up per vectorized step when turning the history into rows
+HISTORY_BLOCK_CELLS = 65536
+
+# Low bits of a change's sort key holding its capture position; the high bits hold its key
+CAPTURE_BITS = 32
+CAPTURE_MASK = (1 << CAPTURE_BITS) - 1
+
+
+def _lookup(changes, prices, row_ids, keys, captures):
+    """
+    Prices in effect for `keys` at each of `captures`, from the sorted change arrays.
+
+    Args:
+        changes: Sorted int64 array of key << CAPTURE_BITS | capture position
+        prices: Price of each change (NaN where the key was delisted)
+        row_ids: detailed_price_data row of each change (None to skip the row ids)
+        keys: Key positions to look up
+        captures: Capture positions to look up
+
+    Returns:
+        tuple: (float64 captures × keys matrix, NaN where nothing was listed,
+        int64 matrix of the row ids those prices came from, or None without row_ids)
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    captures = np.asarray(captures, dtype=np.int64)
+    if not len(changes):
+        shape = (len(captures), len(keys))
+        return np.full(shape, np.nan), None if row_ids is None else np.zeros(shape, dtype=np.int64)
+    # The last change of each key at or before the capture, if the key has one
+    positions = np.searchsorted(changes, (keys[None, :] << CAPTURE_BITS) | captures[:, None], side="right") - 1
+    found = positions >= 0
+    positions[~found] = 0
+    found &= (changes[positions] >> CAPTURE_BITS) == keys[None, :]
+    if row_ids is None:
+        return np.where(found, prices[positions], np.nan), None
+    return np.where(found, prices[positions], np.nan), np.where(found, row_ids[positions], 0)
+
+
+class PriceCube:
+    """
+    In-memory columnar copy of the detailed price history.
+
+    Holds the stored change rows, not a price per capture: one entry per
+    (product, pharmacy) key and capture at which its price changed, appeared
+    or disappeared, in three parallel arrays sorted by key, then capture:
+    `changes` (key << CAPTURE_BITS | capture position), `prices` (NaN where the
+    pharmacy delisted the product) and `row_ids` (the detailed_price_data row).
+    The price of any key at any capture is one searchsorted away, and memory
+    grows with the number of stored changes (24 bytes each), not with
+    captures × products × pharmacies. The cube is built from the stored
+    changes, merges new captures in incrementally and can be saved to disk
+    and memory-mapped back on startup.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.db_path = None
+        self.timestamps = []
+        self.product_ids = []
+        self.product_names = []
+        self.product_index = {}
+        self.pharmacy_ids = []
+        self.pharmacy_names = []
+        self.pharmacy_index = {}
+        # (product, pharmacy) positions -> key position
+        self.key_index = {}
+        self.key_products = np.zeros(0, dtype=np.int64)
+        self.key_pharmacies = np.zeros(0, dtype=np.int64)
+        # Key positions ordered by product ID, then pharmacy ID: the order of history rows
+        self.key_order = np.zeros(0, dtype=np.int64)
+        self.changes = np.zeros(0, dtype=np.int64)
+        self.prices = np.zeros(0)
+        self.row_ids = np.zeros(0, dtype=np.int64)
+        # (MAX(rowid) of detailed_price_captures, MAX(id) of detailed_price_data, last finished
+        # retention run, last replay run) the cube reflects
+        self.fingerprint = None
+
+    # Building and catching up
+
+    def _key(self, product_id, product_name, pharmacy_id, pharmacy_name):
+        """Return the key position, registering new products, pharmacies and keys and tracking the latest names."""
+        product = self.product_index.get(product_id)
+        if product is None:
+            product = self.product_index[product_id] = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.product_names.append(product_name)
+        else:
+            self.product_names[product] = product_name
+        pharmacy = self.pharmacy_index.get(pharmacy_id)
+        if pharmacy is None:
+            pharmacy = self.pharmacy_index[pharmacy_id] = len(self.pharmacy_ids)
+            self.pharmacy_ids.append(pharmacy_id)
+            self.pharmacy_names.append(pharmacy_name)
+        else:
+            self.pharmacy_names[pharmacy] = pharmacy_name
+        key = self.key_index.get((product, pharmacy))
+        if key is None:
+            key = self.key_index[(product, pharmacy)] = len(self.key_index)
+        return key
+
+    def _index_keys(self):
+        """Refresh the key arrays after keys were registered."""
+        self.key_products = np.fromiter((product for product, _ in self.key_index), dtype=np.int64, count=len(self.key_index))
+        self.key_pharmacies = np.fromiter((pharmacy for _, pharmacy in self.key_index), dtype=np.int64, count=len(self.key_index))
+        product_rank = np.empty(len(self.product_ids), dtype=np.int64)
+        product_rank[sorted(range(len(self.product_ids)), key=self.product_ids.__getitem__)] = np.arange(len(self.product_ids))
+        pharmacy_rank = np.empty(len(self.pharmacy_ids), dtype=np.int64)
+        pharmacy_rank[sorted(range(len(self.pharmacy_ids)), key=self.pharmacy_ids.__getitem__)] = np.arange(len(self.pharmacy_ids))
+        self.key_order = np.lexsort((pharmacy_rank[self.key_pharmacies], product_rank[self.key_products]))
+
+    def _replay(self, conn, after):
+        """Append every capture after `after` (None for all) and merge in its change rows."""
+        first = len(self.timestamps)
+        self.timestamps.extend(row[0] for row in conn.execute(
+            "SELECT timestamp FROM detailed_price_captures WHERE timestamp > ? ORDER BY timestamp", (after or "",)
+        ))
+        positions = {capture: first + offset for offset, capture in enumerate(self.timestamps[first:])}
+        cursor = conn.execute("""
+            SELECT id, timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price
+            FROM detailed_price_data WHERE timestamp > ? ORDER BY timestamp
+        """, (after or "",))
+
+        batches = []
+        while True:
+            rows = cursor.fetchmany(REPLAY_BATCH_ROWS)
+            if not rows:
+                break
+            changes, prices, row_ids = [], [], []
+            for row_id, timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price in rows:
+                capture = positions.get(timestamp)
+                if capture is None:
+                    # A change between captures takes effect at the next one
+                    capture = bisect.bisect_left(self.timestamps, timestamp)
+                    if capture == len(self.timestamps):
+                        continue
+                key = self._key(product_id, product_name, pharmacy_id, pharmacy_name)
+                changes.append(key << CAPTURE_BITS | capture)
+                prices.append(np.nan if price is None else price)
+                row_ids.append(row_id)
+            batches.append((np.array(changes, dtype=np.int64), np.array(prices, dtype=np.float64),
+                            np.array(row_ids, dtype=np.int64)))
+        self._index_keys()
+        if not batches:
+            return
+
+        changes, prices, row_ids = (np.concatenate(columns) for columns in zip(*batches))
+        # Stable, so of two changes landing on one capture the later one wins
+        order = np.argsort(changes, kind="stable")
+        changes, prices, row_ids = changes[order], prices[order], row_ids[order]
+        if len(self.changes):
+            # New captures come after every stored one: each change goes to the end of its key's run
+            at = np.searchsorted(self.changes, changes, side="right")
+            changes, prices, row_ids = (np.insert(stored, at, new) for stored, new in
+                                        ((self.changes, changes), (self.prices, prices), (self.row_ids, row_ids)))
+        self.changes, self.prices, self.row_ids = changes, prices, row_ids
+
+    def _database_fingerprint(self, conn):
+        # The last finished retention run changes whenever captures were compacted away, the last
+        # replay run whenever a range of captures was deleted to be replayed (in the same transaction)
+        return conn.execute("""
+            SELECT (SELECT MAX(rowid) FROM detailed_price_captures), (SELECT MAX(id) FROM detailed_price_data),
+                (SELECT MAX(id) FROM retention_runs WHERE finished_at IS NOT NULL), (SELECT MAX(id) FROM replay_runs)
+        """).fetchone()
+
+    def sync(self, conn, db_path):
+        """
+        Bring the cube up to date with the database.
+
+        New captures after the last one are appended; anything else (a back-filled
+        or re-ingested capture, a compacted history, another database) rebuilds
+        the cube from scratch.
+
+        Args:
+            conn: Open connection to the database
+            db_path: Path of the database, to notice when it changes
+        """
+        with self.lock:
+            fingerprint = self._database_fingerprint(conn)
+            if self.db_path == db_path and fingerprint == self.fingerprint:
+                return
+
+            # Read the changes and the fingerprint they lead to from one consistent snapshot
+            conn.execute("BEGIN")
+            try:
+                self._sync(conn, db_path)
+            finally:
+                conn.rollback()
+
+    def _sync(self, conn, db_path):
+        fingerprint = self._database_fingerprint(conn)
+
+        last = self.timestamps[-1] if self.timestamps else None
+        appended_only = self.db_path == db_path and self.fingerprint is not None and \
+            self.fingerprint[2:] == fingerprint[2:] and not conn.execute("""
+            SELECT EXISTS (SELECT 1 FROM detailed_price_captures WHERE rowid > ? AND timestamp <= ?)
+                OR EXISTS (SELECT 1 FROM detailed_price_data WHERE id > ? AND timestamp <= ?)
+        """, (self.fingerprint[0] or 0, last or "", self.fingerprint[1] or 0, last or "")).fetchone()[0]
+
+        if not appended_only:
+            self._reset()
+            last = None
+        self.db_path = db_path
+        self._replay(conn, last)
+        self.fingerprint = fingerprint
+
+    def invalidate(self):
+        """Drop everything; the next sync rebuilds the cube."""
+        with self.lock:
+            self._reset()
+
+    # Persistence
+
+    def save(self, directory):
+        """
+        Write the cube to `directory` (changes.npy, prices.npy, row_ids.npy and meta.json).
+
+        The arrays are written first and the metadata last, so an interrupted save
+        leaves metadata that doesn't match the arrays and the cube is rebuilt.
+        """
+        with self.lock:
+            os.makedirs(directory, exist_ok=True)
+            for name, array in (("changes", self.changes), ("prices", self.prices), ("row_ids", self.row_ids)):
+                path = os.path.join(directory, f"{name}.npy")
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, np.ascontiguousarray(array))
+                os.replace(path + ".tmp", path)
+            meta = {
+                "db_path": os.path.abspath(self.db_path) if self.db_path else None,
+                "fingerprint": self.fingerprint,
+                "timestamps": self.timestamps,
+                "product_ids": self.product_ids,
+                "product_names": self.product_names,
+                "pharmacy_ids": self.pharmacy_ids,
+                "pharmacy_names": self.pharmacy_names,
+                "keys": list(self.key_index),
+                "changes": len(self.changes),
+            }
+            with open(os.path.join(directory, "meta.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(os.path.join(directory, "meta.json.tmp"), os.path.join(directory, "meta.json"))
+
+    def load(self, directory, db_path):
+        """
+        Memory-map a cube saved with save(); pages are read lazily as queries touch them.
+
+        Returns:
+            bool: True if a cube for `db_path` was loaded
+        """
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                      for name in ("changes", "prices", "row_ids")]
+            keys, size = meta["keys"], meta["changes"]
+        except (OSError, ValueError, KeyError):
+            return False
+
+        if meta["db_path"] != os.path.abspath(db_path) or any(array.shape != (size,) for array in arrays):
+            return False
+
+        with self.lock:
+            self._reset()
+            self.db_path = db_path
+            self.fingerprint = tuple(meta["fingerprint"]) if meta["fingerprint"] else None
+            self.timestamps = meta["timestamps"]
+            self.product_ids = meta["product_ids"]
+            self.product_names = meta["product_names"]
+            self.product_index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+            self.pharmacy_ids = meta["pharmacy_ids"]
+            self.pharmacy_names = meta["pharmacy_names"]
+            self.pharmacy_index = {pharmacy_id: i for i, pharmacy_id in enumerate(self.pharmacy_ids)}
+            self.key_index = {(product, pharmacy): i for i, (product, pharmacy) in enumerate(keys)}
+            self._index_keys()
+            self.changes, self.prices, self.row_ids = arrays
+        return True
+
+    # Queries
+
+    def _view(self):
+        """Consistent references to the current state, safe to use without holding the lock."""
+        with self.lock:
+            # Syncs replace the arrays rather than modify them, so references stay consistent
+            return (
+                list(self.timestamps), list(self.product_ids), list(self.product_names),
+                list(self.pharmacy_ids), list(self.pharmacy_names),
+                self.key_products, self.key_pharmacies, self.key_order,
+                self.changes, self.prices, self.row_ids,
+            )
+
+    def memory_usage(self):
+        """
+        Return the size of the cube.
+
+        Returns:
+            dict: {"captures", "products", "pharmacies", "keys" (product × pharmacy pairs ever listed),
+            "changes" (stored change rows), "price_points" (listed prices over all captures),
+            "bytes_used" (changes × 24 bytes plus the key arrays), "dense_bytes" (what a capture × product ×
+            pharmacy array of prices and row ids would take)}
+        """
+        with self.lock:
+            captures = len(self.timestamps)
+            keys = self.changes >> CAPTURE_BITS
+            positions = self.changes & CAPTURE_MASK
+            # Each change holds until the key's next change, or to the last capture
+            until = np.append(positions[1:], captures)
+            until[np.append(keys[1:] != keys[:-1], True)] = captures
+            listed = ~np.isnan(self.prices)
+            return {
+                "captures": captures,
+                "products": len(self.product_ids),
+                "pharmacies": len(self.pharmacy_ids),
+                "keys": len(self.key_index),
+                "changes": len(self.changes),
+                "price_points": int((until - positions)[listed].sum()),
+                "bytes_used": int(self.changes.nbytes + self.prices.nbytes + self.row_ids.nbytes
+                                  + self.key_products.nbytes + self.key_pharmacies.nbytes + self.key_order.nbytes),
+                "dense_bytes": captures * len(self.product_ids) * len(self.pharmacy_ids) * 16,
+            }
+
+    def iter_history_rows(self, product_id=None, pharmacy_id=None, start_date=None, end_date=None,
+                          after=None, limit=None):
+        """
+        Yield history rows in the same order and shape as the SQL reconstruction.
+
+        Rows are (id, timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
+        tuples, newest capture first, then by product_id and pharmacy_id. Names are the
+        latest ones stored for the product and pharmacy.
+
+        Args:
+            product_id: Optional product ID to filter by
+            pharmacy_id: Optional pharmacy ID to filter by
+            start_date: Optional start of the time range
+            end_date: Optional end of the time range
+            after: Optional (timestamp, product_id, pharmacy_id) keyset position to continue after
+            limit: Optional maximum number of rows
+        """
+        (timestamps, product_ids, product_names, pharmacy_ids, pharmacy_names,
+         key_products, key_pharmacies, key_order, changes, prices, row_ids) = self._view()
+
+        keys = key_order
+        for wanted, ids, key_positions in ((product_id, product_ids, key_products),
+                                           (pharmacy_id, pharmacy_ids, key_pharmacies)):
+            if wanted is not None:
+                position = ids.index(wanted) if wanted in ids else -1
+                keys = keys[key_positions[keys] == position]
+        if not len(keys):
+            return
+        labels = [
+            (product_ids[product], product_names[product], pharmacy_ids[pharmacy], pharmacy_names[pharmacy])
+            for product, pharmacy in zip(key_products[keys].tolist(), key_pharmacies[keys].tolist())
+        ]
+
+        low = bisect.bisect_left(timestamps, start_date) if start_date else 0
+        high = bisect.bisect_right(timestamps, end_date) if end_date else len(timestamps)
+        if after:
+            high = min(high, bisect.bisect_right(timestamps, after[0]))
+
+        remaining = limit
+        while high > low and (remaining is None or remaining > 0):
+            block_captures = max(1, HISTORY_BLOCK_CELLS // len(keys))
+            if remaining is not None:
+                # No more captures than the rows still needed could fill
+                block_captures = min(block_captures, -(-remaining // len(keys)))
+            block_low = max(low, high - block_captures)
+            # Newest capture first, keys in product ID, then pharmacy ID order
+            block_prices, block_ids = _lookup(changes, prices, row_ids, keys, np.arange(high - 1, block_low - 1, -1))
+            times, positions = np.nonzero(~np.isnan(block_prices))
+            block_prices = block_prices[times, positions].tolist()
+            block_ids = block_ids[times, positions].tolist()
+
+            for t, k, price, row_id in zip(times.tolist(), positions.tolist(), block_prices, block_ids):
+                timestamp = timestamps[high - 1 - t]
+                label = labels[k]
+                if after and timestamp == after[0] and (label[0], label[2]) <= (after[1], after[2]):
+                    continue
+                yield (row_id, timestamp, *label, price)
+                if remaining is not None:
+                    remaining -= 1
+                    if remaining == 0:
+                        return
+            high = block_low
+
+    def _prices_at(self, view, capture, pharmacy_positions=None):
+        """Products × pharmacies price matrix at one capture position, inf where nothing is listed."""
+        _, product_ids, _, pharmacy_ids, _, key_products, key_pharmacies, _, changes, prices, _ = view
+        keys = np.arange(len(key_products))
+        if pharmacy_positions is not None:
+            keys = keys[np.isin(key_pharmacies, pharmacy_positions)]
+        values, _ = _lookup(changes, prices, None, keys, [capture])
+        values = values[0]
+        listed = ~np.isnan(values)
+        row = np.full((len(product_ids), len(pharmacy_ids)), np.inf)
+        row[key_products[keys][listed], key_pharmacies[keys][listed]] = values[listed]
+        return row
+
+    def summary_before(self, timestamp, competitor_excluded=None, pharmacies=None, inclusive=False):
+        """
+        Cheapest and best competitor price per product at the last capture before `timestamp`.
+
+        Args:
+            timestamp: Point in time (exclusive unless `inclusive`)
+            competitor_excluded: Pharmacy ID left out of the best competitor (our own pharmacy)
+            pharmacies: Mapping of pharmacy ID to display name to compare (None for every stored pharmacy)
+            inclusive: Whether a capture at exactly `timestamp` counts
+
+        Returns:
+            tuple: (capture timestamp, DataFrame with id, Sorte, Pharmacy ID, Price (€/g),
+            Best Competitor and Best Competitor Price (€/g) per listed product), or (None, None)
+        """
+        view = self._view()
+        timestamps, product_ids, product_names, pharmacy_ids, pharmacy_names = view[:5]
+        capture = (bisect.bisect_right if inclusive else bisect.bisect_left)(timestamps, timestamp) - 1
+        if capture < 0:
+            return None, None
+
+        names = np.array(pharmacy_names, dtype=object)
+        if pharmacies is not None:
+            # Only the group's columns, named as in the group
+            columns = [position for position, pharmacy_id in enumerate(pharmacy_ids) if pharmacy_id in pharmacies]
+            row = self._prices_at(view, capture, columns)[:, columns]
+            names = np.array([pharmacies[pharmacy_ids[position]] for position in columns], dtype=object)
+            pharmacy_ids = [pharmacy_ids[position] for position in columns]
+            if not columns:
+                return timestamps[capture], pd.DataFrame(columns=["id", "Sorte", "Pharmacy ID", "Price (€/g)", "Best Competitor", "Best Competitor Price (€/g)"])
+        else:
+            row = self._prices_at(view, capture)
+        listed = np.isfinite(row).any(axis=1)
+        cheapest = row.argmin(axis=1)
+
+        competitors = row.copy()
+        if competitor_excluded in pharmacy_ids:
+            competitors[:, pharmacy_ids.index(competitor_excluded)] = np.inf
+        best_competitor = competitors.argmin(axis=1)
+        best_competitor_price = competitors[np.arange(len(row)), best_competitor]
+        has_competitor = np.isfinite(best_competitor_price)
+
+        df = pd.DataFrame({
+            "id": np.array(product_ids, dtype=object),
+            "Sorte": np.array(product_names, dtype=object),
+            "Pharmacy ID": names[cheapest] if len(names) else None,
+            "Price (€/g)": row[np.arange(len(row)), cheapest],
+            "Best Competitor": np.where(has_competitor, names[best_competitor], None) if len(names) else None,
+            "Best Competitor Price (€/g)": np.where(has_competitor, best_competitor_price, np.nan),
+        })[listed]
+        return timestamps[capture], df.sort_values("Price (€/g)").reset_index(drop=True)
+
+    def price_matrix(self, timestamps, competitor_excluded=None, pharmacies=None, competitor=False):
+        """
+        Cheapest (or best competitor) price per product at several captures.
+
+        Captures are looked up in blocks of about HISTORY_BLOCK_CELLS prices, each
+        reduced to one price per product before the next, so memory doesn't grow
+        with captures × products × pharmacies.
+
+        Args:
+            timestamps: Capture timestamps, oldest first
+            competitor_excluded: Pharmacy ID left out of the best competitor (our own pharmacy)
+            pharmacies: Mapping of pharmacy ID to display name to compare (None for every stored pharmacy)
+            competitor: Whether to take the best competitor price instead of the cheapest price
+
+        Returns:
+            tuple: (product IDs, product names, float matrix with one row per product listed at
+            any of the captures and one column per timestamp, NaN where there is no price),
+            or None if a timestamp is not a capture in the cube
+        """
+        (captures, product_ids, product_names, pharmacy_ids, _,
+         key_products, key_pharmacies, _, changes, prices, _) = self._view()
+        positions = []
+        for timestamp in timestamps:
+            position = bisect.bisect_left(captures, timestamp)
+            if position == len(captures) or captures[position] != timestamp:
+                return None
+            positions.append(position)
+
+        in_group = np.array([pharmacies is None or pharmacy_id in pharmacies for pharmacy_id in pharmacy_ids], dtype=bool)
+        keys = np.flatnonzero(in_group[key_pharmacies]) if len(pharmacy_ids) else np.zeros(0, dtype=np.int64)
+        # Grouped by product, so each block reduces to one price per product with reduceat
+        keys = keys[np.argsort(key_products[keys], kind="stable")]
+        products, starts = np.unique(key_products[keys], return_index=True)
+        compared = np.arange(len(keys))
+        if competitor:
+            compared = compared[np.array(pharmacy_ids, dtype=object)[key_pharmacies[keys]] != competitor_excluded]
+        compared_products, compared_starts = np.unique(key_products[keys[compared]], return_index=True)
+        compared_rows = np.searchsorted(products, compared_products)
+
+        listed = np.zeros(len(products), dtype=bool)
+        best = np.full((len(products), len(positions)), np.inf)
+        block = max(1, HISTORY_BLOCK_CELLS // max(1, len(keys)))
+        for low in range(0, len(positions) if len(keys) else 0, block):
+            values, _ = _lookup(changes, prices, None, keys, positions[low:low + block])
+            found = ~np.isnan(values)
+            listed |= np.logical_or.reduceat(found, starts, axis=1).any(axis=0)
+            if len(compared):
+                values = np.where(found, values, np.inf)[:, compared]
+                best[compared_rows, low:low + block] = np.minimum.reduceat(values, compared_starts, axis=1).T
+        best = best[listed]
+        best[np.isinf(best)] = np.nan
+        rows = products[listed]
+        return np.array(product_ids, dtype=object)[rows], np.array(product_names, dtype=object)[rows], best
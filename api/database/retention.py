@@ -0,0 +1,348 @@
+import datetime
+import logging
+import os
+import time
+
+from api.database import db_handler
+from api.utils.metrics import span
+
+# Compaction policy: every capture of the last RETENTION_FULL_DAYS days is kept, older ones are
+# thinned to the last capture per hour, and captures older than RETENTION_HOURLY_DAYS to the last
+# one per day. Unset (or 0) RETENTION_FULL_DAYS disables compaction; unset RETENTION_HOURLY_DAYS
+# keeps hourly captures for good.
+RETENTION_FULL_DAYS = float(os.getenv("RETENTION_FULL_DAYS", "0"))
+RETENTION_HOURLY_DAYS = float(os.getenv("RETENTION_HOURLY_DAYS", "0"))
+
+# Captures removed per write transaction, so the write lock is only ever held briefly
+RETENTION_BATCH_CAPTURES = int(os.getenv("RETENTION_BATCH_CAPTURES", "96"))
+
+# Pages released per incremental_vacuum step (one short transaction each)
+VACUUM_STEP_PAGES = 2048
+
+VACUUM_MODES = ("incremental", "full", "off")
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+logger = logging.getLogger(__name__)
+
+
+def retention_cutoffs(now, full_days=RETENTION_FULL_DAYS, hourly_days=RETENTION_HOURLY_DAYS):
+    """
+    Where the hourly and daily tiers of the policy end.
+
+    Cutoffs are aligned down to the start of their bucket, so only whole hours
+    and days are ever compacted.
+
+    Args:
+        now: Current time (datetime)
+        full_days: Days kept at full resolution
+        hourly_days: Days kept at hourly resolution (0 for no daily tier)
+
+    Returns:
+        tuple: (hourly cutoff, daily cutoff or None) as timestamp strings; captures
+        before the hourly cutoff are thinned to one per hour, before the daily cutoff
+        to one per day
+
+    Raises:
+        ValueError: If the policy is inconsistent
+    """
+    if full_days <= 0:
+        raise ValueError("Retention is disabled: the days kept at full resolution must be positive")
+    if hourly_days and hourly_days < full_days:
+        raise ValueError(f"RETENTION_HOURLY_DAYS ({hourly_days}) must not be less than RETENTION_FULL_DAYS ({full_days})")
+    hourly_cutoff = db_handler.rollup_bucket((now - datetime.timedelta(days=full_days)).strftime(_TIMESTAMP_FORMAT), "hour")
+    daily_cutoff = None
+    if hourly_days:
+        daily_cutoff = db_handler.rollup_bucket((now - datetime.timedelta(days=hourly_days)).strftime(_TIMESTAMP_FORMAT), "day")
+    return hourly_cutoff, daily_cutoff
+
+
+def settled_before(hourly_days=RETENTION_HOURLY_DAYS):
+    """
+    Where history stops changing under compaction.
+
+    Snapshots before the coarsest tier's cutoff of the last successful run are
+    already thinned to their final resolution, so compaction never removes them
+    or changes their trends again. Later snapshots may still be removed, and the
+    trends of the ones kept recomputed.
+
+    Args:
+        hourly_days: Days kept at hourly resolution (0 for no daily tier)
+
+    Returns:
+        str: Timestamp before which compaction no longer changes anything, or None
+        if no run has reached the coarsest tier yet
+    """
+    column = "daily_cutoff" if hourly_days else "hourly_cutoff"
+    with db_handler.get_connection_manager().read() as conn:
+        row = conn.execute(f"""
+            SELECT {column} FROM retention_runs WHERE finished_at IS NOT NULL AND error IS NULL
+            ORDER BY id DESC LIMIT 1
+        """).fetchone()
+    return row[0] if row else None
+
+
+def _thin(timestamps, hourly_cutoff, daily_cutoff):
+    """
+    Group timestamps (oldest first, all before the hourly cutoff) into retention buckets.
+
+    Returns:
+        dict: Bucket start -> (kept timestamp, removed timestamps), for buckets with something to remove
+    """
+    buckets = {}
+    for timestamp in timestamps:
+        resolution = "day" if daily_cutoff is not None and timestamp < daily_cutoff else "hour"
+        buckets.setdefault(db_handler.rollup_bucket(timestamp, resolution), []).append(timestamp)
+    # The last capture of a bucket represents it, like the "last" price of a rollup
+    return {bucket: (members[-1], members[:-1]) for bucket, members in buckets.items() if len(members) > 1}
+
+
+def plan_compaction(conn, hourly_cutoff, daily_cutoff, batch_captures=RETENTION_BATCH_CAPTURES):
+    """
+    Work out which snapshots and detailed price captures the policy removes, in batches.
+
+    Args:
+        conn: Open connection
+        hourly_cutoff, daily_cutoff: Result of retention_cutoffs
+        batch_captures: Snapshots plus captures removed per batch (whole buckets are never split)
+
+    Returns:
+        list: Batches, oldest first, each a list of buckets as dicts with "bucket",
+        "snapshot" and "capture" entries of (kept timestamp, removed timestamps) or None
+    """
+    snapshots = _thin([row[0] for row in conn.execute(
+        "SELECT timestamp FROM snapshots WHERE timestamp < ? ORDER BY timestamp", (hourly_cutoff,)
+    )], hourly_cutoff, daily_cutoff)
+    captures = _thin([row[0] for row in conn.execute(
+        "SELECT timestamp FROM detailed_price_captures WHERE timestamp < ? ORDER BY timestamp", (hourly_cutoff,)
+    )], hourly_cutoff, daily_cutoff)
+
+    batches, batch, size = [], [], 0
+    for bucket in sorted(set(snapshots) | set(captures)):
+        entry = {"bucket": bucket, "snapshot": snapshots.get(bucket), "capture": captures.get(bucket)}
+        batch.append(entry)
+        size += sum(len(entry[kind][1]) for kind in ("snapshot", "capture") if entry[kind])
+        if size >= batch_captures:
+            batches.append(batch)
+            batch, size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _compact_snapshots(conn, kept, removed):
+    """Delete the removed snapshots of a bucket, with their diffs and legacy blobs."""
+    for timestamp in removed:
+        conn.execute("DELETE FROM snapshot_prices WHERE timestamp = ?", (timestamp,))
+        db_handler._delete_snapshot_diffs(conn, "timestamp = ?", timestamp)
+        conn.execute("DELETE FROM snapshots WHERE timestamp = ?", (timestamp,))
+        conn.execute("DELETE FROM price_data WHERE timestamp = ?", (timestamp,))
+
+
+def _compact_captures(conn, kept, removed):
+    """
+    Fold the removed detailed price captures of a bucket into the capture that represents it.
+
+    A change row stays valid until the next row of its product and pharmacy, so
+    for every price touched between the previous remaining capture and `kept`
+    the latest change is moved to `kept` (unless it ends where the price was
+    before, e.g. a price that went up and back down), then the removed
+    captures' rows are deleted. Every remaining capture reconstructs exactly
+    as before.
+
+    Returns:
+        int: Detailed price rows deleted, net of the ones moved
+    """
+    previous = conn.execute(
+        "SELECT MAX(timestamp) FROM detailed_price_captures WHERE timestamp < ?", (removed[0],)
+    ).fetchone()[0]
+    latest = {}
+    for row in conn.execute("""
+        SELECT timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price
+        FROM detailed_price_data WHERE timestamp > ? AND timestamp <= ? ORDER BY timestamp
+    """, (previous or "", kept)):
+        latest[(row[1], row[3])] = row
+
+    moved = []
+    for (product_id, pharmacy_id), row in latest.items():
+        if row[0] == kept:
+            continue
+        before = None
+        if previous is not None:
+            before = conn.execute("""
+                SELECT price FROM detailed_price_data
+                WHERE product_id = ? AND pharmacy_id = ? AND timestamp <= ?
+                ORDER BY timestamp DESC LIMIT 1
+            """, (product_id, pharmacy_id, previous)).fetchone()
+        # A NULL price and no row at all both mean "not listed"
+        if (before[0] if before else None) == row[5]:
+            continue
+        moved.append((kept,) + row[1:])
+
+    conn.executemany("""
+        INSERT INTO detailed_price_data (timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, moved)
+    deleted = 0
+    for timestamp in removed:
+        deleted += conn.execute("DELETE FROM detailed_price_data WHERE timestamp = ?", (timestamp,)).rowcount
+        conn.execute("DELETE FROM detailed_price_captures WHERE timestamp = ?", (timestamp,))
+    conn.execute(
+        "UPDATE detailed_price_captures SET rows_written = rows_written + ? WHERE timestamp = ?", (len(moved), kept)
+    )
+    return deleted - len(moved)
+
+
+def compact_batch(conn, batch):
+    """
+    Apply one batch of plan_compaction in the caller's transaction.
+
+    The diffs of remaining snapshots that were compared with a removed capture
+    are dropped; they are recomputed against the capture that is now before them.
+
+    Returns:
+        dict: {"snapshots_removed", "captures_removed", "rows_removed"}
+    """
+    removed_snapshots, removed_captures, rows_removed = [], [], 0
+    for entry in batch:
+        if entry["snapshot"]:
+            _compact_snapshots(conn, *entry["snapshot"])
+            removed_snapshots.extend(entry["snapshot"][1])
+        if entry["capture"]:
+            rows_removed += _compact_captures(conn, *entry["capture"])
+            removed_captures.extend(entry["capture"][1])
+
+    removed = set(removed_snapshots) | set(removed_captures)
+    stale = [
+        timestamp for timestamp, previous in conn.execute(
+            "SELECT timestamp, previous_timestamp FROM snapshot_diffs WHERE previous_timestamp >= ? AND previous_timestamp <= ?",
+            (min(removed), max(removed))
+        ) if previous in removed
+    ] if removed else []
+    for timestamp in stale:
+        db_handler._delete_snapshot_diffs(conn, "timestamp = ?", timestamp)
+    return {"snapshots_removed": len(removed_snapshots), "captures_removed": len(removed_captures), "rows_removed": rows_removed}
+
+
+def database_size(conn):
+    """Return (page_count, freelist_count, page_size) of the database."""
+    return tuple(conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_count", "freelist_count", "page_size"))
+
+
+def reclaim_space(conn, mode="incremental", step_pages=VACUUM_STEP_PAGES):
+    """
+    Give the pages freed by compaction back to the file system.
+
+    "incremental" releases free pages with PRAGMA incremental_vacuum, one short
+    transaction of `step_pages` at a time; it needs a database in
+    auto_vacuum=INCREMENTAL mode (new databases are). "full" runs VACUUM, which
+    rewrites the whole file under an exclusive lock (and switches an older
+    database to incremental mode for next time).
+
+    Args:
+        conn: This thread's read/write connection, outside a transaction
+        mode: One of VACUUM_MODES
+
+    Returns:
+        dict: {"mode", "auto_vacuum", "free_bytes" (before), "bytes_reclaimed", "file_bytes"
+        (database and WAL file after a checkpoint)}
+    """
+    if mode not in VACUUM_MODES:
+        raise ValueError(f"Unknown vacuum mode: {mode}. Available: {', '.join(VACUUM_MODES)}")
+    pages, free, page_size = database_size(conn)
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+    if mode == "full":
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    elif mode == "incremental" and auto_vacuum == 2:
+        while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            # executescript steps the pragma to completion (execute() would free a single page)
+            conn.executescript(f"PRAGMA incremental_vacuum({step_pages});")
+    elif mode == "incremental" and free:
+        logger.info("auto_vacuum is off: %d free pages stay in the file for reuse (run a full vacuum once to switch it on)", free)
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    pages_after = database_size(conn)[0]
+    path = db_handler.DB_PATH
+    return {
+        "mode": mode,
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0]),
+        "free_bytes": free * page_size,
+        "bytes_reclaimed": (pages - pages_after) * page_size,
+        "file_bytes": sum(os.path.getsize(file) for file in (path, f"{path}-wal") if os.path.exists(file)),
+    }
+
+
+def run_retention(now=None, full_days=RETENTION_FULL_DAYS, hourly_days=RETENTION_HOURLY_DAYS, vacuum="incremental",
+                  pause_seconds=0.0, batch_captures=RETENTION_BATCH_CAPTURES, stop=None):
+    """
+    Compact the history according to the retention policy, one short transaction per batch.
+
+    The run is recorded in retention_runs; finishing it (even after an error)
+    makes the price cube of every worker rebuild on its next use.
+
+    Args:
+        now: Current time (defaults to now)
+        full_days, hourly_days: Policy (see retention_cutoffs)
+        vacuum: How to reclaim the freed space, one of VACUUM_MODES
+        pause_seconds: Sleep between batches, leaving the write lock to the ingest
+        batch_captures: See plan_compaction
+        stop: Optional threading.Event; the run ends after the current batch once it is set
+
+    Returns:
+        dict: Report with the cutoffs, the number of batches, removed snapshots, captures
+        and rows, the vacuum result and the duration
+    """
+    now = now or datetime.datetime.now()
+    hourly_cutoff, daily_cutoff = retention_cutoffs(now, full_days, hourly_days)
+    started = time.perf_counter()
+    manager = db_handler.get_connection_manager()
+    with manager.write() as conn:
+        run_id = conn.execute(
+            "INSERT INTO retention_runs (started_at, hourly_cutoff, daily_cutoff) VALUES (?, ?, ?)",
+            (now.strftime(_TIMESTAMP_FORMAT), hourly_cutoff, daily_cutoff)
+        ).lastrowid
+    with manager.read() as conn:
+        batches = plan_compaction(conn, hourly_cutoff, daily_cutoff, batch_captures)
+
+    report = {
+        "hourly_cutoff": hourly_cutoff, "daily_cutoff": daily_cutoff, "batches": 0,
+        "snapshots_removed": 0, "captures_removed": 0, "rows_removed": 0, "vacuum": None,
+    }
+    error = None
+    try:
+        for batch in batches:
+            if stop is not None and stop.is_set():
+                break
+            with span("retention_batch") as fields, manager.write() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                counts = compact_batch(conn, batch)
+                fields.update(rows=counts["rows_removed"], snapshots=counts["snapshots_removed"], captures=counts["captures_removed"])
+            report["batches"] += 1
+            for key, value in counts.items():
+                report[key] += value
+            if pause_seconds:
+                time.sleep(pause_seconds)
+        if report["batches"] and vacuum != "off":
+            with span("vacuum"):
+                report["vacuum"] = reclaim_space(manager.writer(), vacuum)
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        report["duration_seconds"] = round(time.perf_counter() - started, 3)
+        bytes_reclaimed = report["vacuum"]["bytes_reclaimed"] if report["vacuum"] else None
+        with manager.write() as conn:
+            conn.execute("""
+                UPDATE retention_runs SET finished_at = ?, batches = ?, snapshots_removed = ?, captures_removed = ?,
+                    rows_removed = ?, bytes_reclaimed = ?, error = ? WHERE id = ?
+            """, (datetime.datetime.now().strftime(_TIMESTAMP_FORMAT), report["batches"], report["snapshots_removed"],
+                  report["captures_removed"], report["rows_removed"], bytes_reclaimed, error, run_id))
+        if report["batches"]:
+            # Trends and cached responses from the first compacted bucket on are stale
+            db_handler._notify_history_rewrite(batches[0][0]["bucket"])
+    logger.info("Retention: removed %d snapshots, %d captures and %d price rows in %d batches, reclaimed %s bytes",
+                report["snapshots_removed"], report["captures_removed"], report["rows_removed"], report["batches"],
+                bytes_reclaimed)
+    return report
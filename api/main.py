@@ -1,12 +1,36 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-from typing import List, Optional
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+import asyncio
 import datetime
+import hashlib
 import json
+import logging
+import os
 
-from api.database.db_handler import init_db, save_to_db, get_all_timestamps, get_data_by_timestamp, get_most_recent_data_before, get_pharmacy_price_history
-from api.utils.data_fetcher import fetch_product_data, add_trend_analysis, fetch_and_analyze_all_pharmacy_prices
+from api.database import retention
+from api.database.db_handler import HISTORY_FIELDS, get_connection_manager, init_db, get_snapshot_timestamps, get_price_matrix, get_timestamps_version, get_pharmacy_price_history, get_snapshot_diff, get_price_aggregates, get_price_cube, iter_pharmacy_price_history, on_history_rewrite, poll_history_rewrites, save_price_cube
+from api.utils.data_fetcher import fetch_and_analyze_all_pharmacy_prices, get_data_with_trend, get_group_view, get_historical_group_view, upstream_client
+from api.utils.comparison import COMPARISON_PRICES, delta_summary, matrix_deltas, order_products, parse_stride, select_timestamps
+from api.utils.downsample import lttb_indices
+from api.utils.pharmacy_groups import get_pharmacy_group, get_pharmacy_groups, pharmacy_names, put_pharmacy_group, remove_pharmacy_group
+from api.utils.export import EXPORT_MEDIA_TYPES, iter_csv, iter_gzip, iter_ndjson
+from api.utils.live_updates import LiveUpdates
+from api.utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware, callback
+from api.utils.response_cache import CachedResponse, ResponseCache, etag_matches, make_etag
+from api.utils.retention_job import retention_job
+from api.utils.scheduler import snapshot_scheduler
+from api.utils.serialization import RESPONSE_FORMATS, embed_json, embed_json_members, frame_to_json, json_envelope, matrix_to_json, records_to_json
+from api.utils.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+# Log level of the API's own loggers (stage timings are logged at DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+logger = logging.getLogger(__name__)
 
 # Initialize the FastAPI app
 app = FastAPI(
@@ -24,93 +48,418 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database on startup
+# Latency, status and size of every response, exposed on /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Serialized /historical responses kept in memory, bounded by total size
+HISTORICAL_CACHE_MAX_BYTES = int(os.getenv("HISTORICAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Most snapshots one /compare request may select
+COMPARE_MAX_SNAPSHOTS = int(os.getenv("COMPARE_MAX_SNAPSHOTS", "500"))
+
+# Timestamps in one page of /timestamps when the client doesn't ask for a size, and the most it may ask for
+TIMESTAMPS_DEFAULT_LIMIT = 500
+TIMESTAMPS_MAX_LIMIT = 10000
+
+# A stored snapshot out of reach of compaction never changes, so clients may keep it for good
+HISTORICAL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# /current and /timestamps change with every capture: clients must revalidate (cheap 304 if unchanged)
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Idle time before a live update stream gets a keepalive comment (and checks for a capture by another worker)
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "15"))
+# Events a live subscriber may fall behind before it gets a full snapshot instead
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "16"))
+
+historical_cache = ResponseCache(HISTORICAL_CACHE_MAX_BYTES)
+
+# Every new capture is pushed to the open /api/prices/stream connections
+live_updates = LiveUpdates(get_group_view, snapshot_scheduler.current, LIVE_KEEPALIVE_SECONDS, LIVE_QUEUE_SIZE)
+snapshot_scheduler.on_snapshot(live_updates.notify)
+
+# A historical response includes the trend against the previous capture, so rewriting a
+# point in time (a replaced or back-filled snapshot) changes every response from there on.
+# Rewrites by other workers are picked up by polling the database on every /historical request.
+on_history_rewrite(lambda timestamp: historical_cache.invalidate(lambda key: key[0] >= timestamp))
+
+callback("sanvivo_historical_cache_lookups", "Lookups of serialized /historical responses", "counter",
+         ["result"], lambda: {("hit",): historical_cache.stats()["hits"], ("miss",): historical_cache.stats()["misses"]})
+callback("sanvivo_live_subscribers", "Open /api/prices/stream connections", "gauge",
+         [], lambda: {(): live_updates.subscribers()})
+callback("sanvivo_historical_cache_bytes", "Size of the serialized /historical responses kept in memory", "gauge",
+         [], lambda: {(): historical_cache.stats()["bytes"]})
+
+class PharmacyGroupBody(BaseModel):
+    # Pharmacy ID -> display name (null to show the ID)
+    pharmacies: Dict[str, Optional[str]]
+    own_pharmacy_id: Optional[str] = None
+
+def check_format(format):
+    """Reject an unknown ?format= value with a 400."""
+    if format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}. Available: {', '.join(RESPONSE_FORMATS)}")
+
+def resolve_group(group):
+    """Look up the ?group= pharmacy group (the default group if not given), 404 if unknown."""
+    try:
+        return get_pharmacy_group(group)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Pharmacy group not found: {group}")
+
+def historical_cache_control(timestamp):
+    """
+    Cache-Control of a /historical response.
+
+    With a retention policy, compaction may still remove the snapshots around
+    `timestamp` and recompute its trend, so clients revalidate it (by ETag)
+    until compaction has settled that far back.
+    """
+    if retention.RETENTION_FULL_DAYS <= 0:
+        return HISTORICAL_CACHE_CONTROL
+    settled = retention.settled_before(retention.RETENTION_HOURLY_DAYS)
+    if settled is not None and timestamp < settled:
+        return HISTORICAL_CACHE_CONTROL
+    return REVALIDATE_CACHE_CONTROL
+
+def not_modified_or(if_none_match, etag, cache_control, render):
+    """Return a 304 if the client already has `etag`, else the JSON response built by render()."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(render(), media_type="application/json", headers=headers)
+
+def preload_price_cube():
+    try:
+        get_price_cube()
+    except Exception:
+        # Requests that need the cube load it themselves (and report the error)
+        logger.exception("Could not load the price cube")
+
+# Initialize database, start loading the price cube and start the snapshot scheduler and history compaction on startup
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    # Loaded in a worker thread: the worker answers requests that don't need the cube (or NumPy) right away
+    app.state.price_cube_preload = asyncio.get_running_loop().run_in_executor(None, preload_price_cube)
+    snapshot_scheduler.start()
+    retention_job.start()
+
+# Stop the background jobs and live update pushes, save the price cube and close the pooled upstream and database connections on shutdown
+@app.on_event("shutdown")
+async def shutdown_event():
+    await snapshot_scheduler.stop()
+    await live_updates.stop()
+    await retention_job.stop()
+    await app.state.price_cube_preload
+    await upstream_client.aclose()
+    save_price_cube()
+    get_connection_manager().close()
+
+async def get_latest_snapshot():
+    """
+    Return the latest processed snapshot from the scheduler (or from the worker holding the ingest lease).
+
+    Captures one on demand if the scheduler is disabled or hasn't produced a snapshot yet.
+    """
+    latest = await snapshot_scheduler.current()
+    if snapshot_scheduler.enabled and latest is not None:
+        return latest
+    return await snapshot_scheduler.run_once()
 
 # API routes
 @app.get("/api/prices/current")
-async def get_current_prices():
-    """Fetch current prices from the DrAnsay API"""
+async def get_current_prices(format: str = "records", group: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+    """
+    Get the latest price snapshot captured from the DrAnsay API
+    
+    The ETag changes with every capture; send it back in If-None-Match to get a 304
+    while the scheduler hasn't captured a newer snapshot.
+    
+    Parameters:
+    - format: records (a list of product objects) or columnar (one array per column)
+    - group: Pharmacy group to compare (defaults to the default group)
+    """
+    check_format(format)
+    pharmacy_group = resolve_group(group)
     try:
-        df = fetch_product_data()
-        if df is None or df.empty:
-            raise HTTPException(status_code=500, detail="Failed to fetch prices from API")
-        
-        # Add trend analysis
-        df_with_trend = add_trend_analysis(df)
-        
-        # Save the original data (without trend) to database
-        save_success = save_to_db(df)
+        latest = await get_latest_snapshot()
+        etag = (f'"current-{latest["timestamp"].replace(" ", "T")}-{int(bool(latest["save_success"]))}-{format}'
+                f'-{pharmacy_group.name}-{pharmacy_group.digest()}"')
         
-        # Convert DataFrame to list of dictionaries (JSON serializable format)
-        result = df_with_trend.to_dict(orient="records")
+        # Serialize the DataFrame column by column straight to JSON, along with metadata
+        render = lambda: json_envelope(
+            frame_to_json(get_group_view(latest, pharmacy_group), format),
+            timestamp=latest["timestamp"],
+            save_success=latest["save_success"],
+            group=pharmacy_group.name
+        )
         
-        # Return the data along with metadata
-        return {
-            "data": result,
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "save_success": save_success
-        }
+        return not_modified_or(if_none_match, etag, REVALIDATE_CACHE_CONTROL, render)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/api/prices/stream")
+async def stream_prices(group: Optional[str] = None):
+    """
+    Live price updates as server-sent events
+    
+    The first event ("snapshot") holds the full latest view, as /current returns
+    it. After every capture a "delta" event follows with only the products that
+    changed ("data"), the IDs no longer listed ("removed") and the
+    "previous_timestamp" it applies to. A client that falls behind gets a new
+    "snapshot" instead. Subscribers never fetch from DrAnsay themselves: one
+    capture is diffed and encoded once per pharmacy group, however many
+    dashboards are connected.
+    
+    Parameters:
+    - group: Pharmacy group to compare (defaults to the default group)
+    """
+    pharmacy_group = resolve_group(group)
+    try:
+        # Captures one only if none was captured yet
+        latest = await snapshot_scheduler.current() or await snapshot_scheduler.run_once()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    return StreamingResponse(
+        live_updates.stream(pharmacy_group, latest),
+        media_type="text/event-stream",
+        # Tell reverse proxies not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/api/prices/timestamps")
-async def get_timestamps():
-    """Get all available timestamps from the database"""
+async def get_timestamps(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = Query(TIMESTAMPS_DEFAULT_LIMIT, ge=1, le=TIMESTAMPS_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get the available timestamps from the database, newest first
+    
+    The list is always paged: "next_cursor" is the cursor of the next (older)
+    page, or null on the last one. The ETag changes whenever a snapshot is
+    added, rewritten or compacted away; send it back in If-None-Match to get a
+    304 without the list being read.
+    
+    Parameters:
+    - start: Earliest timestamp to include (format: YYYY-MM-DD HH:MM:SS)
+    - end: Latest timestamp to include (format: YYYY-MM-DD HH:MM:SS)
+    - limit: Maximum number of timestamps to return (default 500)
+    - cursor: next_cursor of the previous page
+    """
     try:
-        timestamps = get_all_timestamps()
-        return {"timestamps": timestamps}
+        query = json.dumps([start, end, limit, cursor]).encode("utf-8")
+        etag = f'"timestamps-{get_timestamps_version()}-{hashlib.sha1(query).hexdigest()[:16]}"'
+
+        def render():
+            # One extra timestamp tells whether there is a next page
+            timestamps = get_snapshot_timestamps(start, end, before=cursor, limit=limit + 1)
+            next_cursor = None
+            if len(timestamps) > limit:
+                timestamps = timestamps[:limit]
+                next_cursor = timestamps[-1]
+            return json.dumps({"timestamps": timestamps, "next_cursor": next_cursor}, separators=(",", ":")).encode("utf-8")
+
+        return not_modified_or(if_none_match, etag, REVALIDATE_CACHE_CONTROL, render)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving timestamps: {str(e)}")
 
+def render_historical(timestamp, format="records", group=None):
+    """Build the serialized /historical response for a timestamp (None if there is no snapshot)."""
+    if group is None:
+        # The trend against the previous capture is stored with the snapshot, so this is a single read
+        df_with_trend = get_data_with_trend(timestamp)
+    else:
+        df_with_trend = get_historical_group_view(timestamp, group)
+    if df_with_trend is None or df_with_trend.empty:
+        return None
+    
+    # Missing prices (NaN) become null
+    if group is None:
+        return json_envelope(frame_to_json(df_with_trend, format), timestamp=timestamp)
+    return json_envelope(frame_to_json(df_with_trend, format), timestamp=timestamp, group=group.name)
+
 @app.get("/api/prices/historical/{timestamp}")
-async def get_historical_prices(timestamp: str):
-    """Get historical prices from a specific timestamp"""
+async def get_historical_prices(timestamp: str, format: str = "records", group: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+    """
+    Get historical prices from a specific timestamp
+    
+    Responses are cached in memory and sent with a strong ETag; If-None-Match
+    with that ETag returns a 304. They are marked immutable unless history
+    compaction may still change them.
+    
+    Parameters:
+    - format: records (a list of product objects) or columnar (one array per column)
+    - group: Pharmacy group to compare, rebuilt from the stored pharmacy prices (defaults to the stored snapshot)
+    """
+    check_format(format)
+    pharmacy_group = resolve_group(group) if group is not None else None
+    # A group's responses are keyed by its definition, so redefining it never serves stale data
+    key = (timestamp, format) if pharmacy_group is None else (timestamp, format, pharmacy_group.name, pharmacy_group.digest())
     try:
-        df = get_data_by_timestamp(timestamp)
-        if df is None or df.empty:
-            raise HTTPException(status_code=404, detail="Data not found for the specified timestamp")
-        
-        # Add trend analysis to historical data
-        df_with_trend = add_trend_analysis(df, timestamp)
+        rewrites = poll_history_rewrites()
+        cached = historical_cache.get(key)
+        if cached is None:
+            body = render_historical(timestamp, format, pharmacy_group)
+            if body is None:
+                raise HTTPException(status_code=404, detail="Data not found for the specified timestamp")
+            if poll_history_rewrites() == rewrites:
+                cached = historical_cache.put(key, body)
+            else:
+                # History was rewritten while rendering: the body may predate it, so don't keep it
+                cached = CachedResponse(body, make_etag(body))
         
-        # Convert DataFrame to list of dictionaries
-        result = df_with_trend.to_dict(orient="records")
-        
-        return {
-            "data": result,
-            "timestamp": timestamp
-        }
+        return not_modified_or(if_none_match, cached.etag, historical_cache_control(timestamp), lambda: cached.body)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving historical data: {str(e)}")
 
-@app.get("/api/prices/best-competitor")
-async def get_best_competitor_prices():
-    """Get the latest prices with focus on best competitor prices"""
+@app.get("/api/prices/historical/{timestamp}/diff")
+async def get_historical_diff(timestamp: str, format: str = "records"):
+    """
+    Get the stored comparison of a snapshot with the capture before it
+    
+    Returns the summary counts and, per product, the trend labels and the price
+    and best competitor price changes (null where there is nothing to compare).
+    
+    Parameters:
+    - format: records (a list of product objects) or columnar (one array per column)
+    """
+    check_format(format)
     try:
-        df = fetch_product_data()
-        if df is None or df.empty:
-            raise HTTPException(status_code=500, detail="Failed to fetch prices from API")
+        df, summary = get_snapshot_diff(timestamp)
+        if df is None:
+            # Not stored yet: computing the trend stores it
+            if get_data_with_trend(timestamp) is None:
+                raise HTTPException(status_code=404, detail="Data not found for the specified timestamp")
+            df, summary = get_snapshot_diff(timestamp)
         
-        # Add trend analysis
-        df_with_trend = add_trend_analysis(df)
+        return Response(json_envelope(
+            frame_to_json(df, format),
+            timestamp=timestamp,
+            previous_timestamp=summary.pop("previous_timestamp"),
+            summary=summary
+        ), media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving snapshot diff: {str(e)}")
+
+@app.get("/api/prices/compare")
+async def compare_snapshots(
+    timestamps: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    stride: Optional[str] = None,
+    base: str = "previous",
+    price: str = "price",
+    group: Optional[str] = None,
+    format: str = "records",
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Compare the prices of several stored snapshots in one request
+    
+    Returns the products of the selected snapshots ("data", id and Sorte), a
+    product × snapshot price matrix ("prices", one row per product aligned with
+    "timestamps", null where a snapshot doesn't list the product), the price
+    changes against the base ("deltas") and per snapshot the number of
+    increased, decreased, unchanged and not comparable products ("summary").
+    The matrix is computed from the price cube a block of snapshots at a time
+    (or read from the stored snapshots through one connection), off the event
+    loop. The ETag changes
+    whenever a snapshot is added or rewritten.
+    
+    Parameters:
+    - timestamps: Comma-separated snapshot timestamps to compare (instead of a range)
+    - start, end: Range of snapshots to compare (inclusive, all snapshots if neither is given)
+    - stride: Every Nth snapshot of the range (e.g. 4), or one snapshot per time step counted back
+      from the newest (e.g. 1d or 1w for week over week)
+    - base: previous (each snapshot against the one before it), first, last, or one of the selected timestamps
+    - price: price (the cheapest price) or competitor (the best competitor price)
+    - group: Pharmacy group to compare (defaults to the default group)
+    - format: records or columnar, for "data"
+    """
+    check_format(format)
+    pharmacy_group = resolve_group(group)
+    if price not in COMPARISON_PRICES:
+        raise HTTPException(status_code=400, detail=f"Unknown price: {price}. Available: {', '.join(COMPARISON_PRICES)}")
+    loop = asyncio.get_running_loop()
+    try:
+        if timestamps is not None:
+            if start or end or stride:
+                raise ValueError("Pass either timestamps or a range (start, end, stride), not both")
+            selected = sorted({timestamp.strip() for timestamp in timestamps.split(",") if timestamp.strip()})
+            # Only the stored timestamps between the first and last selected one are read
+            available = set(await loop.run_in_executor(None, get_snapshot_timestamps, selected[0], selected[-1])) if selected else set()
+            missing = sorted(set(selected) - available)
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Data not found for the timestamps: {', '.join(missing)}")
+        else:
+            step = parse_stride(stride) if stride else None
+            available = (await loop.run_in_executor(None, get_snapshot_timestamps, start, end))[::-1]
+            selected = select_timestamps(available, start, end, step)
+        if not selected:
+            raise HTTPException(status_code=404, detail="No snapshots in the selected range")
+        if len(selected) > COMPARE_MAX_SNAPSHOTS:
+            raise ValueError(f"{len(selected)} snapshots selected, at most {COMPARE_MAX_SNAPSHOTS} can be compared; use a larger stride")
+
+        query = json.dumps([selected, base, price, format, pharmacy_group.name, pharmacy_group.digest()]).encode("utf-8")
+        etag = f'"compare-{get_timestamps_version()}-{hashlib.sha1(query).hexdigest()[:16]}"'
+
+        def render():
+            products, matrix = order_products(*get_price_matrix(
+                selected, COMPARISON_PRICES[price], pharmacy_group.own_pharmacy_id, pharmacy_group.pharmacies,
+                stored_group=pharmacy_group.key() == get_pharmacy_group().key()
+            ))
+            deltas = matrix_deltas(matrix, selected, base)
+            return embed_json_members(
+                {"data": frame_to_json(products, format), "prices": matrix_to_json(matrix), "deltas": matrix_to_json(deltas)},
+                timestamps=selected,
+                base=base,
+                price=COMPARISON_PRICES[price],
+                group=pharmacy_group.name,
+                summary=delta_summary(deltas, selected)
+            )
+
+        # Rendering (the price matrix in particular) runs in a worker thread to keep the event loop responsive
+        body = None if etag_matches(if_none_match, etag) else await loop.run_in_executor(None, render)
+        return not_modified_or(if_none_match, etag, REVALIDATE_CACHE_CONTROL, lambda: body)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error comparing snapshots: {str(e)}")
+
+@app.get("/api/prices/best-competitor")
+async def get_best_competitor_prices(format: str = "records", group: Optional[str] = None):
+    """
+    Get the latest prices with focus on best competitor prices
+    
+    Parameters:
+    - format: records (a list of product objects) or columnar (one array per column)
+    - group: Pharmacy group to compare (defaults to the default group)
+    """
+    check_format(format)
+    pharmacy_group = resolve_group(group)
+    try:
+        latest = await get_latest_snapshot()
+        df_with_trend = get_group_view(latest, pharmacy_group)
         
         # Filter data to show only products where Sanvivo isn't the cheapest or where competitor price exists
         filtered_df = df_with_trend[df_with_trend["Best Competitor"].notna()]
         
-        # Convert DataFrame to list of dictionaries
-        result = filtered_df.to_dict(orient="records")
-        
         # Return the data along with metadata
-        return {
-            "data": result,
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "filter_applied": "best_competitor_only"
-        }
+        return Response(json_envelope(
+            frame_to_json(filtered_df, format),
+            timestamp=latest["timestamp"],
+            filter_applied="best_competitor_only",
+            group=pharmacy_group.name
+        ), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -119,49 +468,167 @@ async def get_pharmacy_history(
     product_id: Optional[str] = None,
     pharmacy_id: Optional[str] = None,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    cursor: Optional[str] = None,
+    format: str = "records"
 ):
     """
-    Get price history for specific pharmacies and products
+    Get price history for specific pharmacies and products, one page at a time
     
     Parameters:
     - product_id: Filter by product ID
     - pharmacy_id: Filter by pharmacy ID
     - start_date: Filter by start date (format: YYYY-MM-DD HH:MM:SS)
     - end_date: Filter by end date (format: YYYY-MM-DD HH:MM:SS)
+    - fields: Comma-separated columns to return (id, timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
+    - limit: Maximum number of rows in this page (1-10000)
+    - cursor: The next_cursor value from the previous page
+    - format: records (a list of row objects) or columnar (one array per field)
     """
+    check_format(format)
     try:
-        df = get_pharmacy_price_history(product_id, pharmacy_id, start_date, end_date)
+        field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        result, next_cursor = get_pharmacy_price_history(
+            product_id, pharmacy_id, start_date, end_date, field_list, cursor, limit
+        )
         
-        if df.empty:
+        if not result:
             return {
-                "data": [],
+                "data": {} if format == "columnar" else [],
+                "next_cursor": None,
                 "message": "No pharmacy history data found matching the criteria"
             }
         
-        # Convert DataFrame to list of dictionaries
-        result = df.to_dict(orient="records")
-        
-        return {
-            "data": result,
-            "count": len(result),
-            "filters_applied": {
+        return Response(json_envelope(
+            records_to_json(result, format),
+            count=len(result),
+            next_cursor=next_cursor,
+            filters_applied={
                 "product_id": product_id,
                 "pharmacy_id": pharmacy_id,
                 "start_date": start_date,
-                "end_date": end_date
+                "end_date": end_date,
+                "fields": field_list
             }
-        }
+        ), media_type="application/json")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving pharmacy history data: {str(e)}")
 
+@app.get("/api/prices/pharmacy-history/export")
+async def export_pharmacy_history(
+    product_id: Optional[str] = None,
+    pharmacy_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = "ndjson",
+    gzip: bool = False
+):
+    """
+    Stream the full matching price history as a file download
+    
+    Rows are written straight from the database in chunks, so the export can be
+    arbitrarily large without being held in memory.
+    
+    Parameters:
+    - product_id, pharmacy_id, start_date, end_date, fields: Same as /api/prices/pharmacy-history
+    - format: ndjson (one JSON object per line) or csv
+    - gzip: Compress the download (served as a .gz file)
+    """
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}. Available: {', '.join(EXPORT_MEDIA_TYPES)}")
+    
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else HISTORY_FIELDS
+    try:
+        rows = iter_pharmacy_price_history(product_id, pharmacy_id, start_date, end_date, field_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    body = iter_csv(rows, field_list) if format == "csv" else iter_ndjson(rows)
+    filename = f"pharmacy-history.{format}"
+    media_type = EXPORT_MEDIA_TYPES[format]
+    if gzip:
+        body = iter_gzip(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+@app.get("/api/prices/aggregates")
+async def get_aggregates(
+    product_id: str,
+    pharmacy_id: Optional[str] = None,
+    resolution: str = "day",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    max_points: int = Query(500, ge=3, le=5000),
+    format: str = "records"
+):
+    """
+    Get bucketed price series of one product, one series per pharmacy
+    
+    Parameters:
+    - product_id: Product ID
+    - pharmacy_id: Filter by pharmacy ID
+    - resolution: Bucket size (hour, day or week)
+    - start_date: Filter by start date (format: YYYY-MM-DD HH:MM:SS)
+    - end_date: Filter by end date (format: YYYY-MM-DD HH:MM:SS)
+    - max_points: Maximum points per series; longer series are downsampled (LTTB on the mean)
+    - format: records (a list of point objects per series) or columnar (one array per field per series)
+    """
+    check_format(format)
+    try:
+        df = get_price_aggregates(product_id, pharmacy_id, resolution, start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving price aggregates: {str(e)}")
+    
+    series = []
+    for series_pharmacy_id, points in df.groupby("pharmacy_id", sort=False):
+        bucket_count = len(points)
+        if bucket_count > max_points:
+            x = pd.to_datetime(points["bucket"]).to_numpy(dtype="datetime64[s]").astype(float)
+            points = points.iloc[lttb_indices(x, points["mean"].to_numpy(), max_points)]
+        series.append(embed_json(
+            "points",
+            frame_to_json(points[["bucket", "min", "max", "mean", "last", "count"]], format),
+            pharmacy_id=series_pharmacy_id,
+            pharmacy_name=points["pharmacy_name"].iloc[-1],
+            bucket_count=bucket_count
+        ))
+    
+    return Response(embed_json(
+        "series",
+        b"[" + b",".join(series) + b"]",
+        product_id=product_id,
+        resolution=resolution,
+        max_points=max_points
+    ), media_type="application/json")
+
 @app.get("/api/prices/pharmacy-history/refresh")
 async def refresh_pharmacy_history():
     """
     Manually trigger a refresh of pharmacy price history data
+    
+    Only the worker holding the ingest lease stores prices; other workers answer
+    that the ingesting worker's next capture will.
     """
     try:
-        df = fetch_and_analyze_all_pharmacy_prices()
+        lease = snapshot_scheduler.lease
+        if lease is not None and not await asyncio.get_running_loop().run_in_executor(None, lease.acquire):
+            return {
+                "success": False,
+                "message": "Another worker is ingesting snapshots; its next capture stores the pharmacy prices"
+            }
+        
+        df = await fetch_and_analyze_all_pharmacy_prices()
         
         if df.empty:
             return {
@@ -175,4 +642,100 @@ async def refresh_pharmacy_history():
             "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error refreshing pharmacy history data: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error refreshing pharmacy history data: {str(e)}")
+
+@app.get("/api/pharmacy-groups")
+async def list_pharmacy_groups():
+    """
+    Get every pharmacy group, including the default group the stored snapshots compare
+    """
+    try:
+        return {"groups": [group.to_dict() for group in get_pharmacy_groups().values()]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving pharmacy groups: {str(e)}")
+
+@app.get("/api/pharmacy-groups/{name}")
+async def get_pharmacy_group_by_name(name: str):
+    """
+    Get one pharmacy group
+    """
+    return resolve_group(name).to_dict()
+
+@app.put("/api/pharmacy-groups/{name}")
+async def put_pharmacy_group_by_name(name: str, body: PharmacyGroupBody):
+    """
+    Create or replace a pharmacy group
+    
+    Takes effect immediately: the latest capture is re-evaluated for the group
+    from its vendor price index, without fetching or parsing the catalogue again.
+    Redefining the default group changes the snapshots stored from the next capture on.
+    
+    Parameters:
+    - pharmacies: Pharmacy ID to display name (null to show the ID)
+    - own_pharmacy_id: Pharmacy left out of the best competitor (one of the pharmacies, or null)
+    """
+    try:
+        group = put_pharmacy_group(name, body.pharmacies, body.own_pharmacy_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving pharmacy group: {str(e)}")
+    historical_cache.invalidate(lambda key: len(key) > 2 and key[2] == name)
+    return group.to_dict()
+
+@app.delete("/api/pharmacy-groups/{name}")
+async def delete_pharmacy_group_by_name(name: str):
+    """
+    Delete a pharmacy group
+    
+    Deleting the default group restores the built-in list of top pharmacies.
+    """
+    try:
+        deleted = remove_pharmacy_group(name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting pharmacy group: {str(e)}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Pharmacy group not found: {name}")
+    historical_cache.invalidate(lambda key: len(key) > 2 and key[2] == name)
+    return {"success": True, "name": name}
+
+@app.get("/api/pharmacies")
+async def get_pharmacies():
+    """
+    Get every vendor in the latest capture with the number of products it lists,
+    for picking the members of a pharmacy group
+    """
+    try:
+        latest = await get_latest_snapshot()
+        vendors = latest["vendor_prices"].vendors(pharmacy_names())
+        return Response(json_envelope(frame_to_json(vendors, "records"), timestamp=latest["timestamp"]), media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving pharmacies: {str(e)}")
+
+@app.get("/api/scheduler/status")
+async def get_scheduler_status():
+    """
+    Get the state of the background snapshot scheduler: its configuration,
+    the last run's start, end, duration and error, and failure counts.
+    """
+    return snapshot_scheduler.status()
+
+@app.get("/api/retention/status")
+async def get_retention_status():
+    """
+    Get the history retention policy, the state of the background compaction
+    job and the latest compaction runs with what they removed and reclaimed.
+    """
+    try:
+        return retention_job.status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving retention status: {str(e)}")
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Metrics of this worker process in the Prometheus text format: HTTP latency
+    and response sizes per route, the duration and row counts of each pipeline
+    stage, upstream payload sizes and cache hit counts.
+    """
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,67 @@
+"""
+Re-derive stored history from the recorded raw upstream payloads, fully offline.
+
+Parses and aggregates every payload recorded between --start and --end again
+with the current code and configuration, in a pool of --workers processes,
+and stores the results in timestamp order, replacing the detailed prices,
+snapshots and trends derived from them before. Use it after fixing the
+parser or changing the pharmacy groups / DETAILED_PRICE_VENDORS, so history
+reflects the change. Snapshot diffs after the range are recomputed.
+
+Usage:
+    python -m api.replay_payloads [--db sanvivo_prices.db] [--payloads DIR] [--start "2024-01-01"]
+                                  [--end "2024-03-31 23:59:59"] [--workers 4] [--dry-run]
+"""
+import argparse
+
+from api.database import db_handler, payload_store
+from api.utils import replay
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=db_handler.DB_PATH, help="SQLite database path")
+    parser.add_argument("--payloads", default=payload_store.RAW_PAYLOAD_PATH,
+                        help="Payload store directory (default: next to the database)")
+    parser.add_argument("--start", help="Earliest capture to replay (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--end", help="Latest capture to replay (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--workers", type=int, default=replay.REPLAY_WORKERS,
+                        help="Worker processes parsing payloads (0: parse in this process)")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be replayed")
+    args = parser.parse_args()
+
+    # A bare date as --end covers that whole day
+    end = f"{args.end} 23:59:59" if args.end and len(args.end) == 10 else args.end
+
+    db_handler.DB_PATH = args.db
+    payload_store.RAW_PAYLOAD_PATH = args.payloads
+    db_handler.init_db()
+
+    if args.dry_run:
+        records = db_handler.get_raw_payloads(args.start, end)
+        if records:
+            print(f"Would replay {len(records)} captures from {records[0]['timestamp']} to {records[-1]['timestamp']}: "
+                  f"{sum(record['snapshot'] for record in records)} with a snapshot, "
+                  f"{len({record['digest'] for record in records})} distinct payloads, "
+                  f"{sum(record['raw_bytes'] for record in records) / 2**20:.1f} MiB to parse")
+        else:
+            print("No recorded payloads in that range")
+        db_handler.get_connection_manager().close()
+        return
+
+    try:
+        report = replay.replay_payloads(args.start, end, workers=args.workers)
+    except ValueError as e:
+        db_handler.get_connection_manager().close()
+        parser.error(str(e))
+    print(f"Replayed {report['payloads']} captures ({report['distinct_payloads']} distinct payloads, "
+          f"{report['raw_bytes'] / 2**20:.1f} MiB) with {args.workers} workers in {report['duration_seconds']:.1f}s: "
+          f"{report['captures']} detailed price captures and {report['snapshots']} snapshots stored, "
+          f"{report['diffs_recomputed']} later snapshot diffs recomputed")
+    for timestamp, error in report["failed"].items():
+        print(f"Failed: {timestamp}: {error}")
+    db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import bisect
+import datetime
+import re
+from itertools import chain
+
+from api.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Snapshot price columns a comparison can be built from (?price= value -> API column)
+COMPARISON_PRICES = {
+    "price": "Price (€/g)",
+    "competitor": "Best Competitor Price (€/g)",
+}
+
+# Points the deltas of a comparison can be taken against, besides one of the selected timestamps
+COMPARISON_BASES = ("previous", "first", "last")
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_STRIDE_UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+
+def parse_stride(stride):
+    """
+    Parse a ?stride= value.
+
+    Args:
+        stride: "N" for every Nth snapshot, or "N" followed by m, h, d or w for one snapshot per time step
+
+    Returns:
+        int or timedelta: Snapshot count or time step
+
+    Raises:
+        ValueError: If the stride is malformed or not positive
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([mhdw]?)\s*", str(stride))
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid stride: {stride}. Use a snapshot count (e.g. 4) or a time step (e.g. 12h, 1d, 1w)")
+    count, unit = int(match.group(1)), match.group(2)
+    if not unit:
+        return count
+    return datetime.timedelta(**{_STRIDE_UNITS[unit]: count})
+
+
+def select_timestamps(available, start=None, end=None, stride=None):
+    """
+    Pick the snapshots of a range to compare.
+
+    A time step is counted back from the last snapshot of the range: each
+    point gets the latest snapshot at or before it, so a weekly stride compares
+    the newest snapshot with the one a week earlier, and so on.
+
+    Args:
+        available: Every stored timestamp, oldest first
+        start: Optional first timestamp of the range (inclusive)
+        end: Optional last timestamp of the range (inclusive)
+        stride: Optional result of parse_stride (every snapshot if None)
+
+    Returns:
+        list: Selected timestamps, oldest first
+    """
+    low = bisect.bisect_left(available, start) if start else 0
+    high = bisect.bisect_right(available, end) if end else len(available)
+    in_range = available[low:high]
+    if not in_range or stride is None:
+        return in_range
+    if isinstance(stride, int):
+        # Counted back from the end as well, so the latest snapshot is always included
+        return in_range[::-1][::stride][::-1]
+
+    times = [datetime.datetime.strptime(timestamp, _TIMESTAMP_FORMAT) for timestamp in in_range]
+    selected = []
+    point = times[-1]
+    index = len(times) - 1
+    while index >= 0:
+        # Latest snapshot at or before the point
+        index = bisect.bisect_right(times, point, 0, index + 1) - 1
+        if index < 0:
+            break
+        selected.append(in_range[index])
+        point -= stride
+        index -= 1
+    return selected[::-1]
+
+
+def build_price_matrix(timestamps, snapshot_prices):
+    """
+    Arrange stored snapshot prices into a product × snapshot matrix.
+
+    Args:
+        timestamps: Selected timestamps, oldest first (the matrix columns)
+        snapshot_prices: Result of get_snapshot_prices for the timestamps
+
+    Returns:
+        tuple: (product IDs, product names, float matrix with one row per product and one
+        column per timestamp, NaN where a snapshot doesn't list the product)
+    """
+    lengths = [len(product_ids) for product_ids in snapshot_prices["product_ids"]]
+    column = np.repeat(np.arange(len(timestamps)), lengths)
+    product_codes, product_ids = pd.factorize(np.fromiter(chain.from_iterable(snapshot_prices["product_ids"]), dtype=object, count=sum(lengths)))
+    # None (no price) becomes NaN
+    prices = np.array(list(chain.from_iterable(snapshot_prices["prices"])), dtype=float)
+
+    # A product listed twice in one snapshot keeps its first row, as in the trend comparison
+    cells, first = np.unique(product_codes * len(timestamps) + column, return_index=True)
+    matrix = np.full(len(product_ids) * len(timestamps), np.nan)
+    matrix[cells] = prices[first]
+    matrix = matrix.reshape(len(product_ids), len(timestamps))
+
+    names = snapshot_prices["names"]
+    product_names = np.array([names.get(product_id) for product_id in product_ids], dtype=object)
+    return np.asarray(product_ids, dtype=object), product_names, matrix
+
+
+def order_products(product_ids, product_names, matrix):
+    """
+    Sort the rows of a price matrix by product name, then ID.
+
+    Returns:
+        tuple: (DataFrame with "id" and "Sorte" per row, matrix in the same order)
+    """
+    products = pd.DataFrame({"id": product_ids, "Sorte": product_names})
+    position = np.lexsort((products["id"].astype(str).to_numpy(), products["Sorte"].fillna("").astype(str).to_numpy()))
+    return products.iloc[position].reset_index(drop=True), matrix[position]
+
+
+def matrix_deltas(matrix, timestamps, base="previous"):
+    """
+    Price changes between the columns of a price matrix.
+
+    Args:
+        matrix: Product × snapshot matrix from build_price_matrix
+        timestamps: The matrix columns
+        base: "previous" (each snapshot against the one before it), "first", "last",
+            or one of the timestamps to compare every snapshot with
+
+    Returns:
+        ndarray: Deltas rounded to 2 decimals, NaN where either price is missing
+        (and in the first column for "previous")
+
+    Raises:
+        ValueError: If base is neither one of the above nor a selected timestamp
+    """
+    if base == "previous":
+        deltas = np.full(matrix.shape, np.nan)
+        deltas[:, 1:] = matrix[:, 1:] - matrix[:, :-1]
+        return np.round(deltas, 2)
+    if base == "first":
+        index = 0
+    elif base == "last":
+        index = len(timestamps) - 1
+    elif base in timestamps:
+        index = list(timestamps).index(base)
+    else:
+        raise ValueError(f"Unknown base: {base}. Use {', '.join(COMPARISON_BASES)} or one of the selected timestamps")
+    return np.round(matrix - matrix[:, [index]], 2)
+
+
+def delta_summary(deltas, timestamps):
+    """
+    Count increased, decreased, unchanged and not comparable products per snapshot.
+
+    Returns:
+        dict: Timestamp -> {"increased", "decreased", "unchanged", "missing"}
+    """
+    comparable = ~np.isnan(deltas)
+    # Same threshold as the trend labels
+    unchanged = comparable & (np.abs(np.where(comparable, deltas, 0)) < 0.01)
+    increased = comparable & ~unchanged & (np.where(comparable, deltas, 0) > 0)
+    decreased = comparable & ~unchanged & ~increased
+    return {
+        timestamp: {
+            "increased": int(increased[:, j].sum()),
+            "decreased": int(decreased[:, j].sum()),
+            "unchanged": int(unchanged[:, j].sum()),
+            "missing": int((~comparable[:, j]).sum()),
+        }
+        for j, timestamp in enumerate(timestamps)
+    }
@@ -0,0 +1,149 @@
+import logging
+import os
+import pickle
+import socket
+import threading
+import uuid
+
+from api.database import db_handler
+
+# Worker processes serving the same database elect one ingesting worker through this lease
+INGEST_LEASE_NAME = "snapshot-ingest"
+
+# Where the ingesting worker publishes its latest snapshot for the others (default: next to the database)
+SHARED_SNAPSHOT_PATH = os.getenv("SHARED_SNAPSHOT_PATH")
+
+_PROCESS_TOKEN = uuid.uuid4().hex[:8]
+
+logger = logging.getLogger(__name__)
+
+
+def process_id():
+    """Unique ID of this process, as lease owner and in status output."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_PROCESS_TOKEN}"
+
+
+def _process_gone(owner):
+    """Whether a process_id() belongs to a process on this host that no longer runs."""
+    host, _, rest = owner.partition(":")
+    pid = rest.partition(":")[0]
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+class IngestLease:
+    """
+    The right to capture and store snapshots, held by one process at a time.
+
+    Backed by a row in the database's leases table, so it works across the
+    worker processes of one deployment. The holder renews it on every
+    capture; if it stops (crash, hang), another worker takes over once the
+    lease has expired.
+    """
+
+    def __init__(self, name, seconds):
+        """
+        Args:
+            name: Lease name
+            seconds: Validity of the lease after each renewal
+        """
+        self.name = name
+        self.seconds = seconds
+        self.owner = process_id()
+        self.held = False
+
+    def acquire(self):
+        """Take or renew the lease; returns whether this process holds it."""
+        self.held = db_handler.acquire_lease(self.name, self.owner, self.seconds)
+        if not self.held:
+            holder = db_handler.get_lease(self.name)
+            if holder is not None and _process_gone(holder["owner"]):
+                # A worker on this host that exited without releasing it, e.g. after a crash
+                self.held = db_handler.acquire_lease(self.name, self.owner, self.seconds, replace_owner=holder["owner"])
+        return self.held
+
+    def release(self):
+        """Give the lease up so another worker can take over right away."""
+        if self.held:
+            db_handler.release_lease(self.name, self.owner)
+            self.held = False
+
+    def status(self):
+        holder = db_handler.get_lease(self.name)
+        return {
+            "owner": self.owner,
+            "role": "ingesting" if holder and holder["owner"] == self.owner else "following",
+            "holder": holder,
+            "lease_seconds": self.seconds,
+        }
+
+
+class SharedSnapshot:
+    """
+    The latest capture result, shared between worker processes through a file.
+
+    The ingesting worker pickles each result to a temporary file and renames
+    it into place, so readers always see a complete snapshot. Readers stat
+    the file and only load it again when it was replaced.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: File to share through (None for SHARED_SNAPSHOT_PATH, or next to the database)
+        """
+        self._path = path
+        self._signature = None
+        self._result = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path or SHARED_SNAPSHOT_PATH or f"{db_handler.DB_PATH}.latest"
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (self.path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def publish(self, result):
+        """Write a capture result for the other workers."""
+        path = self.path
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        with self._lock:
+            self._signature = self._stat()
+            self._result = result
+
+    def changed(self):
+        """Whether the file was replaced since this process last read or wrote it (cheap: one stat)."""
+        signature = self._stat()
+        return signature is not None and signature != self._signature
+
+    def load(self):
+        """
+        Return the latest published result (None if nothing was published yet).
+
+        The file is only read again if it was replaced since the last call.
+        """
+        with self._lock:
+            signature = self._stat()
+            if signature is not None and signature != self._signature:
+                try:
+                    with open(self.path, "rb") as f:
+                        self._result = pickle.load(f)
+                    self._signature = signature
+                except (OSError, EOFError, pickle.UnpicklingError) as e:
+                    logger.warning("Could not read the shared snapshot: %s", e)
+            return self._result
@@ -1,138 +1,170 @@
 import os
-import requests
-import pandas as pd
-from dotenv import load_dotenv
-from api.database.db_handler import get_most_recent_data_before, get_data_by_timestamp, get_all_timestamps, save_detailed_prices
+import asyncio
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+from api.database import payload_store
+from api.database.db_handler import get_most_recent_data_before, get_data_by_timestamp, get_data_with_diff, get_all_timestamps, get_price_summary_before, get_timestamps_without_diff, save_detailed_prices, save_raw_payload, save_snapshot_diff, save_to_db
+from api.utils.lazy_import import lazy_import
+from api.utils.metrics import callback, span
+from api.utils.payload_parser import ProductStreamParser
+from api.utils.pharmacy_groups import get_pharmacy_group, pharmacy_names
+from api.utils.snapshot import SnapshotCache
+from api.utils.upstream import UpstreamClient
+from api.utils.trend import apply_snapshot_diff, compute_snapshot_diff, compute_trends
 
-# Load environment variables from .env file
-load_dotenv()
+httpx = lazy_import("httpx")
+pd = lazy_import("pandas")
 
 # API configuration
-API_ENDPOINT = "https://europe-west3-au-digital.cloudfunctions.net/dransay/api/webshop/products?sandbox=0"
+API_ENDPOINT = os.getenv("DRANSAY_API_ENDPOINT", "https://europe-west3-au-digital.cloudfunctions.net/dransay/api/webshop/products?sandbox=0")
 API_KEY = os.getenv("DRANSAY_API_KEY")
 HEADERS = {"x-api-key": API_KEY}
 
-# Define the top pharmacies by their IDs
-TOP_PHARMACY_IDS = {
-    "zMztHDq7X50CjGIs5NeX": "Asavita",
-    "CaotAefOXilSE0hewO1c": "Herbery Online Apotheke",
-    "FhCdipzdTKWJMGYvPK0P": "higreen Drei hasen Apotheke",
-    "QV7wYUp0cGHmAgUZWkT9": "Grafenberg Apotheke",
-    "i03wd7KWpfpLHv7xYT37": "360 Grad Apotheke",
-    "hxG2kWd9KHdqWin4L771": "higreen Adler Apotheke",
-    "rKtJBabOpl3G8wd9Rilm": "Medivital Apo420",
-    "2f6ANjI8S2zTFfYDagp6": "Cannoiva (Ehrlich Apotheke)",
-    "Ox4GxbMJuJUs4cTWPJQy": "sanvivo"
-}
-
-# Sanvivo pharmacy ID
-SANVIVO_ID = "Ox4GxbMJuJUs4cTWPJQy"
-
-def fetch_product_data():
-    """Fetches product data from the DrAnsay API and processes it, considering only top pharmacies."""
+# Seconds a fetched catalogue is reused by all endpoints before DrAnsay is queried again
+SNAPSHOT_TTL_SECONDS = float(os.getenv("SNAPSHOT_TTL_SECONDS", "60"))
+
+# Upstream client settings
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "30"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+
+# Vendors whose detailed prices are stored with every capture: "all" (every vendor in the
+# catalogue, so a group defined later has history for all its pharmacies) or "groups" (only
+# members of a pharmacy group at capture time, for catalogues with very many vendors)
+DETAILED_PRICE_VENDORS = os.getenv("DETAILED_PRICE_VENDORS", "all")
+
+# Group views of the latest captures kept in memory
+GROUP_VIEW_CACHE_SIZE = int(os.getenv("GROUP_VIEW_CACHE_SIZE", "32"))
+
+logger = logging.getLogger(__name__)
+
+class ProductSnapshot:
+    """One parsed DrAnsay catalogue that every endpoint derives its view from."""
+
+    def __init__(self, timestamp, vendor_prices, payload=None):
+        """
+        Args:
+            timestamp: Time the payload was fetched (YYYY-MM-DD HH:MM:SS)
+            vendor_prices: VendorPrices with every vendor's price of every product
+            payload: The raw payload as recorded in the payload store (None if not recorded)
+        """
+        self.timestamp = timestamp
+        self.vendor_prices = vendor_prices
+        self.payload = payload
+        # Cheapest and best competitor price per product among the default pharmacy group
+        self.group = get_pharmacy_group()
+        self.summary = self.group_summary(self.group)
+        # Detailed price columns (product_id, product_name, kultivar, pharmacy_id, pharmacy_name, price)
+        names = pharmacy_names()
+        self.detailed_prices = vendor_prices.detailed_columns(names, None if DETAILED_PRICE_VENDORS == "all" else names)
+        self.price_count = len(self.detailed_prices["price"])
+        self._save_lock = threading.Lock()
+        self._detailed_saved = False
+
+    def group_summary(self, group):
+        """Cheapest and best competitor price per product among a PharmacyGroup."""
+        return self.vendor_prices.summary(group.pharmacies, group.own_pharmacy_id)
+
+    def save_detailed_prices(self):
+        """
+        Persist the detailed pharmacy prices of this snapshot exactly once.
+
+        The recorded raw payload is registered under the snapshot's timestamp
+        as well, so the capture can be replayed.
+
+        Returns:
+            bool: True if the prices are stored (now or by an earlier call)
+        """
+        with self._save_lock:
+            if not self._detailed_saved and self.price_count:
+                self._detailed_saved = save_detailed_prices(self.detailed_prices, self.timestamp)
+                if self._detailed_saved:
+                    logger.info("Saved %d pharmacy price points at %s", self.price_count, self.timestamp)
+                    self.record_payload()
+            return self._detailed_saved
+
+    def record_payload(self, snapshot=False):
+        """Register the raw payload under this snapshot's timestamp (no-op if it wasn't recorded)."""
+        if self.payload is None:
+            return
+        try:
+            save_raw_payload(self.timestamp, self.payload, snapshot)
+        except Exception as e:
+            logger.warning("Could not register the raw payload of %s: %s", self.timestamp, e)
+
+def new_payload_parser():
+    """Return a streaming parser for one DrAnsay product payload."""
+    return ProductStreamParser()
+
+def parse_product_payload(data):
+    """
+    Parse an already decoded DrAnsay product payload, considering the default pharmacy group.
+
+    Args:
+        data: Decoded JSON payload (a list of products or a dict with a 'products' key)
+
+    Returns:
+        tuple: (DataFrame with one summary row per product, dict of detailed price columns)
+    """
+    products_list = data if isinstance(data, list) else data.get('products', [])
+    parser = new_payload_parser()
+    for product in products_list:
+        parser.add_product(product)
+    snapshot = ProductSnapshot(None, parser.result())
+    return snapshot.summary, snapshot.detailed_prices
+
+# Pooled keep-alive client for the DrAnsay API
+upstream_client = UpstreamClient(API_ENDPOINT, HEADERS, timeout=UPSTREAM_TIMEOUT_SECONDS, max_retries=UPSTREAM_MAX_RETRIES)
+
+async def _load_snapshot():
+    """Fetch the product payload from the DrAnsay API and parse it into a ProductSnapshot."""
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    previous = _snapshot_cache.peek()
+    parsers = []
+
+    def make_parser():
+        parser = new_payload_parser()
+        if payload_store.RAW_PAYLOAD_RECORDING:
+            # The raw body is compressed into the payload store as it is parsed
+            parser = payload_store.RecordingParser(parser)
+        parsers.append(parser)
+        return parser
+
+    # The body is parsed chunk by chunk as it arrives, never held in memory as a whole
+    response = await upstream_client.fetch_parsed(make_parser, revalidate=previous is not None)
+
+    # An unchanged catalogue (304) reuses the previous parse (and payload) under the new timestamp
+    if response.not_modified:
+        return ProductSnapshot(timestamp, previous.vendor_prices, previous.payload)
+
+    return ProductSnapshot(timestamp, response.body, getattr(parsers[-1], "payload", None))
+
+# Shared by /current, /best-competitor and /pharmacy-history/refresh
+_snapshot_cache = SnapshotCache(_load_snapshot, SNAPSHOT_TTL_SECONDS)
+
+async def get_product_snapshot(force=False):
+    """
+    Return the current parsed catalogue, fetching it at most once per TTL.
+
+    Concurrent callers share a single in-flight upstream request.
+
+    Args:
+        force: Fetch a fresh snapshot even if the cached one has not expired
+
+    Returns:
+        ProductSnapshot: The shared snapshot
+    """
     if not API_KEY:
         raise ValueError("API key not found. Please ensure it's set in the .env file.")
+    return await _snapshot_cache.get(force=force)
 
-    try:
-        response = requests.get(API_ENDPOINT, headers=HEADERS)
-        response.raise_for_status()
-        data = response.json()
-
-        products_list = data if isinstance(data, list) else data.get('products', [])
-        if not products_list:
-            return pd.DataFrame(columns=["id", "Sorte", "Kultivar", "Pharmacy ID", "Price (€/g)", "Best Competitor", "Best Competitor Price (€/g)"])
-
-        # Also collect detailed price data for historical analysis
-        detailed_prices = []
-        
-        extracted_data = []
-        for product in products_list:
-            product_id = product.get('id')
-            product_name = product.get('sorte')
-            if not product_name or not product_id:  # Skip products without a name or ID
-                continue
-
-            kultivar = product.get('kultivar', '')
-            vendors = product.get('vendors', {})
-            
-            # Initialize variables for overall cheapest price and non-Sanvivo cheapest price
-            cheapest_price = float('inf')
-            cheapest_vendor_id = None
-            best_competitor_price = float('inf')
-            best_competitor_id = None
-
-            # Find the cheapest vendor and best competitor among the top pharmacies
-            for vendor_id, vendor_data in vendors.items():
-                if vendor_id not in TOP_PHARMACY_IDS:
-                    continue
-                price_cents = vendor_data.get('price')
-                if price_cents is not None:
-                    try:
-                        price_euros = float(price_cents) / 100.0
-                        
-                        # Save this pharmacy's price for historical analysis
-                        detailed_prices.append({
-                            "product_id": product_id,
-                            "product_name": product_name,
-                            "pharmacy_id": vendor_id,
-                            "pharmacy_name": TOP_PHARMACY_IDS.get(vendor_id),
-                            "price": price_euros
-                        })
-                        
-                        # Update overall cheapest price
-                        if price_euros < cheapest_price:
-                            cheapest_price = price_euros
-                            cheapest_vendor_id = vendor_id
-                        
-                        # Update best competitor (excluding Sanvivo)
-                        if vendor_id != SANVIVO_ID and price_euros < best_competitor_price:
-                            best_competitor_price = price_euros
-                            best_competitor_id = vendor_id
-                    except (ValueError, TypeError):
-                        continue
-
-            # If we found a valid price and vendor from the top list, add to results
-            if cheapest_vendor_id is not None:
-                pharmacy_name = TOP_PHARMACY_IDS.get(cheapest_vendor_id, cheapest_vendor_id)
-                
-                # Set best competitor information
-                best_competitor_name = None
-                if best_competitor_id is not None:
-                    best_competitor_name = TOP_PHARMACY_IDS.get(best_competitor_id, best_competitor_id)
-                
-                # If no competitors found or only Sanvivo has this product
-                if best_competitor_price == float('inf'):
-                    best_competitor_price = None
-                
-                extracted_data.append({
-                    "id": product_id,
-                    "Sorte": product_name,
-                    "Kultivar": kultivar,
-                    "Pharmacy ID": pharmacy_name,
-                    "Price (€/g)": cheapest_price,
-                    "Best Competitor": best_competitor_name,
-                    "Best Competitor Price (€/g)": best_competitor_price
-                })
-
-        # Save detailed price data for historical analysis
-        if detailed_prices:
-            save_detailed_prices(detailed_prices)
-            print(f"Saved {len(detailed_prices)} detailed price points for historical analysis")
-
-        if not extracted_data:
-            return pd.DataFrame(columns=["id", "Sorte", "Kultivar", "Pharmacy ID", "Price (€/g)", "Best Competitor", "Best Competitor Price (€/g)"])
-
-        df = pd.DataFrame(extracted_data)
-        return df.sort_values(by="Price (€/g)").reset_index(drop=True)
-
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Error fetching data from API: {e}")
-    except ValueError as e:
-        raise Exception(f"Error parsing JSON response: {e}")
-    except Exception as e:
-        raise Exception(f"An unexpected error occurred: {e}")
+async def _save_snapshot_prices(snapshot):
+    """Persist a snapshot's detailed prices off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, snapshot.save_detailed_prices)
 
-def fetch_and_analyze_all_pharmacy_prices():
+async def fetch_and_analyze_all_pharmacy_prices():
     """
     Fetch prices from all top pharmacies and analyze them.
     Returns DataFrame with detailed pharmacy price data.
@@ -141,76 +173,86 @@ def fetch_and_analyze_all_pharmacy_prices():
         raise ValueError("API key not found. Please ensure it's set in the .env file.")
 
     try:
-        response = requests.get(API_ENDPOINT, headers=HEADERS)
-        response.raise_for_status()
-        data = response.json()
-
-        products_list = data if isinstance(data, list) else data.get('products', [])
-        if not products_list:
-            return pd.DataFrame()
-
-        detailed_prices = []
-        
-        for product in products_list:
-            product_id = product.get('id')
-            product_name = product.get('sorte')
-            if not product_name or not product_id:
-                continue
-
-            kultivar = product.get('kultivar', '')
-            vendors = product.get('vendors', {})
-            
-            for vendor_id, vendor_data in vendors.items():
-                if vendor_id not in TOP_PHARMACY_IDS:
-                    continue
-                    
-                price_cents = vendor_data.get('price')
-                if price_cents is not None:
-                    try:
-                        price_euros = float(price_cents) / 100.0
-                        detailed_prices.append({
-                            "product_id": product_id,
-                            "product_name": product_name,
-                            "kultivar": kultivar,
-                            "pharmacy_id": vendor_id,
-                            "pharmacy_name": TOP_PHARMACY_IDS.get(vendor_id),
-                            "price": price_euros
-                        })
-                    except (ValueError, TypeError):
-                        continue
-        
+        snapshot = await get_product_snapshot()
+
         # Save the detailed prices to the database
-        if detailed_prices:
-            timestamp = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-            save_detailed_prices(detailed_prices, timestamp)
-            print(f"Saved {len(detailed_prices)} pharmacy price points at {timestamp}")
-            
+        if snapshot.price_count and await _save_snapshot_prices(snapshot):
             # Create a DataFrame for further analysis
-            df = pd.DataFrame(detailed_prices)
-            return df
-        
+            return pd.DataFrame(snapshot.detailed_prices)
+
         return pd.DataFrame()
     
     except Exception as e:
-        print(f"Error fetching and analyzing pharmacy prices: {e}")
+        logger.error("Error fetching and analyzing pharmacy prices: %s", e)
         return pd.DataFrame()
 
-def add_trend_analysis(current_df, timestamp=None):
-    """Add trend analysis by comparing with the previous dataset."""
-    if current_df is None or current_df.empty:
-        return current_df
-    
-    # Make a copy to avoid modifying the original
-    df = current_df.copy()
-    
+def _analyze_and_store(snapshot):
+    """Compute the trend against the capture before the snapshot, then store it and its diff under its timestamp."""
+    df = snapshot.summary.copy()
+    diff = diff_against_previous(df, snapshot.timestamp)
+    save_success = save_to_db(df, snapshot.timestamp, diff)
+    if save_success:
+        snapshot.record_payload(snapshot=True)
+    return apply_snapshot_diff(df, diff), save_success
+
+async def capture_price_snapshot():
+    """
+    Fetch a fresh catalogue, add the trend analysis and store it as a new snapshot.
+
+    Returns:
+        dict: {"data": DataFrame with trend columns, "timestamp": snapshot time, "save_success": bool,
+        "vendor_prices": VendorPrices of the catalogue, "group_key": key of the group "data" compares}
+    """
+    if not API_KEY:
+        raise ValueError("API key not found. Please ensure it's set in the .env file.")
+
+    try:
+        snapshot = await get_product_snapshot(force=True)
+    except httpx.HTTPError as e:
+        raise Exception(f"Error fetching data from API: {e}")
+
+    if snapshot.summary.empty:
+        raise Exception("Failed to fetch prices from API")
+
+    await _save_snapshot_prices(snapshot)
+
+    # Trend analysis and the snapshot write hit SQLite, so keep them off the event loop
+    loop = asyncio.get_running_loop()
+    df_with_trend, save_success = await loop.run_in_executor(None, _analyze_and_store, snapshot)
+    return {
+        "data": df_with_trend,
+        "timestamp": snapshot.timestamp,
+        "save_success": save_success,
+        "vendor_prices": snapshot.vendor_prices,
+        "group_key": snapshot.group.key(),
+    }
+
+def diff_against_previous(current_df, timestamp=None, previous=None):
+    """
+    Compare a snapshot with the data captured before it.
+
+    Args:
+        current_df: Snapshot DataFrame
+        timestamp: Time of the snapshot; compares with the latest stored snapshot if not provided
+        previous: (timestamp, summary DataFrame of the default pharmacy group) of the capture
+            right before, if the caller already has it; looked up otherwise
+
+    Returns:
+        dict: The diff from compute_snapshot_diff, plus the "previous_timestamp" it was compared with
+    """
     # Get previous data
     prev_timestamp = None
     prev_df = None
     
-    if timestamp:
-        # If we have a specific timestamp, get the data right before it
-        prev_timestamp, prev_df = get_most_recent_data_before(timestamp)
-        print(f"Using previous data from {prev_timestamp} to compare with {timestamp}")
+    if previous is not None:
+        prev_timestamp, prev_df = previous
+    elif timestamp:
+        # If we have a specific timestamp, get the data right before it, from the price cube if possible
+        group = get_pharmacy_group()
+        prev_timestamp, prev_df = get_price_summary_before(timestamp, group.own_pharmacy_id, group.pharmacies)
+        if prev_df is None:
+            prev_timestamp, prev_df = get_most_recent_data_before(timestamp)
+        logger.debug("Using previous data from %s to compare with %s", prev_timestamp, timestamp)
     else:
         # If no timestamp provided, get the most recent data in the DB
         timestamps = get_all_timestamps()
@@ -218,88 +260,130 @@ def add_trend_analysis(current_df, timestamp=None):
             # Current data hasn't been saved yet, so compare with the most recent
             prev_timestamp = timestamps[0]
             prev_df = get_data_by_timestamp(prev_timestamp)
-            print(f"Using most recent data from {prev_timestamp} for comparison")
+            logger.debug("Using most recent data from %s for comparison", prev_timestamp)
     
-    # If no previous data found, return dataframe without trend
+    # If no previous data found, trend columns are set to 'First data point'
     if prev_df is None or prev_df.empty:
-        print("No previous data found for comparison, marking all as 'First data point'")
-        df["Trend"] = "First data point"
-        
-        # Add competitor trend column
-        if "Best Competitor Price (€/g)" in df.columns:
-            df["Competitor Trend"] = "First data point"
-            
+        logger.info("No previous data found for comparison, marking all as 'First data point'")
+        with span("trend_analysis", rows=len(current_df)):
+            diff = compute_snapshot_diff(current_df, None)
+        diff["previous_timestamp"] = None
+        return diff
+
+    # One keyed merge against the previous snapshot; labels are assigned in bulk
+    with span("trend_analysis", rows=len(current_df)):
+        diff = compute_snapshot_diff(current_df, prev_df)
+    diff["previous_timestamp"] = prev_timestamp
+
+    summary = diff["summary"]
+    logger.info("Trend analysis complete: %d unchanged, %d increased, %d decreased, %d new products",
+                summary['unchanged'], summary['increased'], summary['decreased'], summary['new'])
+
+    return diff
+
+def get_data_with_trend(timestamp):
+    """
+    Load a stored snapshot with its trend columns.
+
+    The trend is read from the diff stored with the snapshot; a snapshot without
+    one (saved before diffs were stored, or whose previous capture was rewritten)
+    gets it computed and stored now.
+
+    Returns:
+        DataFrame: Snapshot with "Trend" and "Competitor Trend" columns, or None if there is no snapshot
+    """
+    df, summary = get_data_with_diff(timestamp)
+    if df is None or df.empty or summary is not None:
         return df
-    
-    # Initialize trend columns
-    df["Trend"] = ""
-    
-    # Add competitor trend column if we have competitor data
-    if "Best Competitor Price (€/g)" in df.columns:
-        df["Competitor Trend"] = ""
-    
-    # Track statistics for debugging
-    unchanged_count = 0
-    increased_count = 0
-    decreased_count = 0
-    new_count = 0
-    
-    # Compare prices for each product
-    for idx, row in df.iterrows():
-        product_name = row["Sorte"]
-        current_price = row["Price (€/g)"]
-        
-        # Find this product in previous data
-        prev_product = prev_df[prev_df["Sorte"] == product_name]
-        
-        if not prev_product.empty:
-            # If multiple pharmacies had the product previously, we need to be careful.
-            # Let's assume the stored data has the *cheapest* price from the *previous* set of top pharmacies.
-            prev_price = prev_product.iloc[0]["Price (€/g)"]
-            
-            # Calculate price difference with 2 decimal precision
-            price_diff = round(current_price - prev_price, 2)
-            
-            # Determine trend with threshold of 0.01 to account for minor calculation differences
-            if abs(price_diff) < 0.01:  # Price unchanged (within 1 cent)
-                df.at[idx, "Trend"] = "→ Unchanged"
-                unchanged_count += 1
-            elif price_diff > 0:  # Price increased
-                df.at[idx, "Trend"] = f"↑ +{price_diff:.2f}€"
-                increased_count += 1
-            else:  # Price decreased
-                df.at[idx, "Trend"] = f"↓ {price_diff:.2f}€"
-                decreased_count += 1
-                
-            # Add competitor price trend analysis if we have this data
-            if "Best Competitor Price (€/g)" in df.columns and "Best Competitor Price (€/g)" in prev_product.columns:
-                current_competitor_price = row["Best Competitor Price (€/g)"]
-                prev_competitor_price = prev_product.iloc[0]["Best Competitor Price (€/g)"]
-                
-                # Only calculate trend if both current and previous competitor prices exist
-                if current_competitor_price is not None and prev_competitor_price is not None:
-                    competitor_price_diff = round(current_competitor_price - prev_competitor_price, 2)
-                    
-                    if abs(competitor_price_diff) < 0.01:  # Price unchanged
-                        df.at[idx, "Competitor Trend"] = "→ Unchanged"
-                    elif competitor_price_diff > 0:  # Price increased
-                        df.at[idx, "Competitor Trend"] = f"↑ +{competitor_price_diff:.2f}€"
-                    else:  # Price decreased
-                        df.at[idx, "Competitor Trend"] = f"↓ {competitor_price_diff:.2f}€"
-                elif current_competitor_price is not None and prev_competitor_price is None:
-                    df.at[idx, "Competitor Trend"] = "New competitor"
-                elif current_competitor_price is None and prev_competitor_price is not None:
-                    df.at[idx, "Competitor Trend"] = "No competitors now"
-                else:
-                    df.at[idx, "Competitor Trend"] = "No competitors"
-        else:
-            # Product not in previous data
-            df.at[idx, "Trend"] = "New product"
-            if "Best Competitor Price (€/g)" in df.columns:
-                df.at[idx, "Competitor Trend"] = "New product"
-            new_count += 1
-    
-    # Print summary statistics
-    print(f"Trend analysis complete: {unchanged_count} unchanged, {increased_count} increased, {decreased_count} decreased, {new_count} new products")
-    
-    return df 
\ No newline at end of file
+    diff = diff_against_previous(df, timestamp)
+    save_snapshot_diff(timestamp, diff)
+    return apply_snapshot_diff(df, diff)
+
+def backfill_snapshot_diffs():
+    """
+    Compute and store the diff of every stored snapshot that doesn't have one, oldest first.
+
+    Returns:
+        int: Number of diffs stored
+    """
+    stored = 0
+    for timestamp in get_timestamps_without_diff():
+        df = get_data_by_timestamp(timestamp)
+        if df is not None and save_snapshot_diff(timestamp, diff_against_previous(df, timestamp)):
+            stored += 1
+    return stored
+
+# (capture timestamp, group key) -> DataFrame, least recently used first
+_group_views = OrderedDict()
+_group_views_lock = threading.Lock()
+_group_view_lookups = {"hit": 0, "miss": 0}
+
+def _cached_group_view(key, build):
+    with _group_views_lock:
+        if key in _group_views:
+            _group_views.move_to_end(key)
+            _group_view_lookups["hit"] += 1
+            return _group_views[key]
+        _group_view_lookups["miss"] += 1
+    view = build()
+    with _group_views_lock:
+        _group_views[key] = view
+        while len(_group_views) > GROUP_VIEW_CACHE_SIZE:
+            _group_views.popitem(last=False)
+    return view
+
+def get_group_view(latest, group):
+    """
+    The latest capture seen through a pharmacy group, with the trend against the group's previous capture.
+
+    The summary comes from the capture's vendor price index and the previous
+    prices from the price cube, so switching groups never refetches or reparses
+    the catalogue.
+
+    Args:
+        latest: Result of capture_price_snapshot
+        group: PharmacyGroup
+
+    Returns:
+        DataFrame: Snapshot with "Trend" and "Competitor Trend" columns
+    """
+    if group.key() == latest.get("group_key"):
+        return latest["data"]
+
+    def build():
+        summary = latest["vendor_prices"].summary(group.pharmacies, group.own_pharmacy_id)
+        _, prev_df = get_price_summary_before(latest["timestamp"], group.own_pharmacy_id, group.pharmacies)
+        return compute_trends(summary, prev_df)[0]
+
+    return _cached_group_view((latest["timestamp"], group.key()), build)
+
+def get_historical_group_view(timestamp, group):
+    """
+    A stored capture seen through a pharmacy group, rebuilt from the detailed prices.
+
+    Args:
+        timestamp: Snapshot timestamp
+        group: PharmacyGroup
+
+    Returns:
+        DataFrame: Snapshot with "Trend" and "Competitor Trend" columns, or None if there is no snapshot
+    """
+    if group.key() == get_pharmacy_group().key():
+        return get_data_with_trend(timestamp)
+    stored = get_data_by_timestamp(timestamp)
+    if stored is None or stored.empty:
+        return None
+
+    capture, summary = get_price_summary_before(timestamp, group.own_pharmacy_id, group.pharmacies, inclusive=True)
+    if summary is None:
+        return None
+    _, prev_df = get_price_summary_before(capture, group.own_pharmacy_id, group.pharmacies)
+    # The detailed prices don't keep the cultivar, so it comes from the stored snapshot where listed
+    kultivars = stored.set_index("id")["Kultivar"] if "Kultivar" in stored.columns else pd.Series(dtype=object)
+    summary.insert(2, "Kultivar", summary["id"].map(kultivars).fillna(""))
+    return compute_trends(summary, prev_df)[0]
+
+callback("sanvivo_group_view_cache_lookups", "Lookups of non-default pharmacy group views in memory", "counter",
+         ["result"], lambda: {(result,): count for result, count in _group_view_lookups.items()})
+callback("sanvivo_snapshot_cache_lookups", "Requests for the current catalogue served from the cache or by a fetch", "counter",
+         ["result"], lambda: {(result,): count for result, count in _snapshot_cache.lookups().items()})
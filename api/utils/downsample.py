@@ -0,0 +1,51 @@
+from api.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Pick the points that best preserve a series' shape (Largest-Triangle-Three-Buckets).
+
+    The first and last points are always kept. The points in between are split
+    into n_out - 2 buckets, and from each bucket the point forming the largest
+    triangle with the previously kept point and the next bucket's average is kept.
+
+    Args:
+        x: 1-D array of ascending x values (e.g. epoch seconds)
+        y: 1-D array of y values, same length as x
+        n_out: Maximum number of points to keep
+
+    Returns:
+        ndarray: Sorted indices of the kept points (all indices if the series is short enough)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])[:max(n_out, 1)]
+
+    # Bucket boundaries over the inner points 1 .. n-2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=int)
+    kept[0] = 0
+    kept[-1] = n - 1
+
+    # Average of every bucket, computed up front; the last point stands in for the bucket after the last one
+    counts = np.diff(edges)
+    next_x = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts, x[-1])[1:]
+    next_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts, y[-1])[1:]
+
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Twice the triangle areas; the constant factor doesn't change the argmax
+        areas = np.abs(
+            (x[previous] - next_x[bucket]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y[bucket] - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        kept[bucket + 1] = previous
+    return kept
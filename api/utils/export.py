@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+import zlib
+
+# Supported export formats and their media types
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Rows serialized per yielded chunk
+EXPORT_CHUNK_ROWS = 1000
+
+
+def iter_ndjson(rows, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Serialize rows as newline-delimited JSON, a chunk of rows at a time.
+
+    Args:
+        rows: Iterable of dicts
+        chunk_rows: Number of rows per yielded chunk
+
+    Yields:
+        bytes: UTF-8 encoded lines, one JSON object per row
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= chunk_rows:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_csv(rows, fields, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Serialize rows as CSV with a header line, a chunk of rows at a time.
+
+    Args:
+        rows: Iterable of dicts
+        fields: Column names, in output order
+        chunk_rows: Number of rows per yielded chunk
+
+    Yields:
+        bytes: UTF-8 encoded CSV text
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    pending = 0
+    for row in rows:
+        writer.writerow([row[field] for field in fields])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_gzip(chunks, level=6):
+    """
+    Gzip a stream of byte chunks on the fly.
+
+    Args:
+        chunks: Iterable of bytes
+        level: zlib compression level (1-9)
+
+    Yields:
+        bytes: Pieces of a single gzip member
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
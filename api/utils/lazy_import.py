@@ -0,0 +1,37 @@
+import importlib
+import sys
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """Stand-in for a module that is only imported when one of its attributes is first used."""
+
+    def __getattr__(self, name):
+        # Only called for attributes not copied yet; import_module is thread-safe and returns
+        # the module other threads may have finished importing in the meantime
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name):
+    """
+    Import a module on first use instead of now.
+
+    For heavy dependencies (pandas, NumPy, httpx) that most requests never
+    touch: a worker can start and answer /timestamps without loading them.
+    Use the result like the module itself (`pd = lazy_import("pandas")`);
+    it must not be used at import time (module-level code, default
+    arguments, annotations), or nothing is deferred.
+
+    Args:
+        name: Absolute module name
+
+    Returns:
+        module: The module if it is already imported, otherwise a stand-in that
+        imports it on the first attribute access
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import threading
+import time
+
+from api.utils.metrics import counter
+from api.utils.pharmacy_groups import get_pharmacy_group
+from api.utils.serialization import frame_to_json, json_envelope
+
+logger = logging.getLogger(__name__)
+
+# Comment line sent on an idle stream so proxies and browsers keep the connection open
+KEEPALIVE_EVENT = b": keepalive\n\n"
+
+# Placed in a subscriber's queue instead of the events it fell too far behind on
+_RESYNC = object()
+
+LIVE_EVENTS = counter("sanvivo_live_events", "Server-sent events queued for live subscribers", ["type"])
+
+
+def sse_event(event, data, id=None):
+    """
+    Frame one server-sent event.
+
+    Args:
+        event: Event name
+        data: Single-line UTF-8 payload (compact JSON)
+        id: Optional event ID, sent back by a reconnecting browser in Last-Event-ID
+
+    Returns:
+        bytes: The event, terminated by a blank line
+    """
+    head = f"event: {event}\n" + (f"id: {id}\n" if id is not None else "")
+    return head.encode("utf-8") + b"data: " + data + b"\n\n"
+
+
+def view_delta(previous, current):
+    """
+    Rows of a group view that differ from the view pushed before it.
+
+    A product is changed if it is new or any of its columns differs (its price,
+    best competitor, or a trend label that went back to unchanged), so a client
+    applying the delta ends up with exactly the current view.
+
+    Args:
+        previous: View of the previous capture
+        current: View of the new capture
+
+    Returns:
+        tuple: (DataFrame of the changed and new rows of current, list of product IDs
+        no longer listed), or None if the views don't have the same columns
+    """
+    if list(previous.columns) != list(current.columns):
+        return None
+    before = previous.drop_duplicates("id").set_index("id")
+    after = current.drop_duplicates("id").set_index("id")
+    common = after.index.intersection(before.index)
+    old, new = before.loc[common], after.loc[common]
+    same = ((old == new) | (old.isna() & new.isna())).all(axis=1)
+    changed = common[~same.to_numpy()].union(after.index.difference(before.index))
+    removed = before.index.difference(after.index)
+    return current[current["id"].isin(changed)], removed.tolist()
+
+
+class _Channel:
+    """Subscribers of one pharmacy group, and the view they were last sent."""
+
+    def __init__(self, name):
+        self.name = name
+        self.subscribers = set()
+        self.group_key = None
+        self.timestamp = None
+        self.save_success = None
+        self.view = None
+        # Encoded full snapshot event of `timestamp`, built on the first connect or resync
+        self.snapshot = None
+        # Held while the view is rebuilt in a worker thread, so a publish and a snapshot build don't interleave
+        self.lock = threading.Lock()
+
+
+class LiveUpdates:
+    """
+    Fans every new capture out to the open live update streams.
+
+    Subscribers are grouped by pharmacy group. For each new capture the group
+    view is built, diffed against the one sent before and encoded once per
+    group, then the same bytes are queued for every subscriber, so the cost of
+    a capture doesn't grow with the number of open dashboards and no
+    subscriber ever triggers an upstream request of its own. Views are built
+    and encoded in the default executor (they read SQLite and run pandas);
+    only queueing the finished events happens on the event loop.
+
+    A subscriber whose queue is full (a client reading too slowly) has its
+    pending events dropped and gets a full snapshot instead.
+    """
+
+    def __init__(self, view, current, keepalive_seconds, queue_size):
+        """
+        Args:
+            view: Function (capture result, PharmacyGroup) -> DataFrame, e.g. get_group_view
+            current: Coroutine function returning the latest capture result, including one
+                published by another worker
+            keepalive_seconds: Idle time after which a stream gets a keepalive comment and
+                the latest capture is checked
+            queue_size: Events a subscriber may fall behind before it is resynced
+        """
+        self._view = view
+        self._current = current
+        self.keepalive_seconds = keepalive_seconds
+        self.queue_size = queue_size
+        self._channels = {}
+        self._latest = None
+        self._publisher = None
+        self._checked_at = 0.0
+
+    def subscribers(self):
+        """Return the number of open streams."""
+        return sum(len(channel.subscribers) for channel in self._channels.values())
+
+    def notify(self, latest):
+        """
+        Push a capture result to the subscribers (a scheduler snapshot listener, called on the event loop).
+
+        Results that are not newer than the last one pushed are ignored. The
+        push runs in the background; captures arriving while one is pushed are
+        coalesced into the newest.
+        """
+        if self._latest is not None and latest["timestamp"] <= self._latest["timestamp"]:
+            return
+        self._latest = latest
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.ensure_future(self._publish_latest())
+
+    async def _publish_latest(self):
+        loop = asyncio.get_running_loop()
+        published = None
+        while published is not self._latest:
+            published = self._latest
+            for channel in list(self._channels.values()):
+                try:
+                    event = await loop.run_in_executor(None, self._publish, channel, published)
+                except Exception:
+                    logger.exception("group=%s live update failed", channel.name)
+                    continue
+                if event is not None:
+                    self._broadcast(channel, *event, published["timestamp"])
+
+    def _publish(self, channel, latest):
+        """Build a channel's next event for a capture (in a worker thread); None if it has nothing to send."""
+        with channel.lock:
+            if channel.timestamp is not None and channel.timestamp >= latest["timestamp"]:
+                # A first subscriber already got this capture's view as its snapshot
+                return None
+            group = get_pharmacy_group(channel.name)
+            view = self._view(latest, group)
+            delta = None
+            if channel.view is not None and channel.group_key == group.key():
+                delta = view_delta(channel.view, view)
+
+            previous_timestamp = channel.timestamp
+            channel.group_key, channel.timestamp, channel.save_success = group.key(), latest["timestamp"], latest["save_success"]
+            channel.view, channel.snapshot = view, None
+        if delta is None:
+            # No previous view (or the group was redefined): everyone starts over
+            return _RESYNC, "snapshot"
+        changed, removed = delta
+        event = sse_event("delta", json_envelope(
+            frame_to_json(changed),
+            timestamp=latest["timestamp"],
+            previous_timestamp=previous_timestamp,
+            save_success=latest["save_success"],
+            group=group.name,
+            removed=removed,
+        ), id=latest["timestamp"])
+        return event, "delta"
+
+    def _broadcast(self, channel, event, type, timestamp=None):
+        for queue in channel.subscribers:
+            try:
+                # Deltas carry their capture, so a subscriber can skip those its snapshot already includes
+                queue.put_nowait(event if event is _RESYNC else (timestamp, event))
+            except asyncio.QueueFull:
+                # Too far behind to catch up with deltas: drop them and resync
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(_RESYNC)
+                LIVE_EVENTS.inc(type="resync")
+                continue
+            LIVE_EVENTS.inc(type=type)
+
+    def _build_snapshot(self, channel, latest):
+        """
+        The full view the channel's subscribers are on, encoded once and shared by every (re)connect.
+
+        Runs in a worker thread. A channel without a view (or whose group was
+        redefined) gets the view of `latest`.
+
+        Returns:
+            tuple: (capture timestamp, encoded snapshot event, whether the group was redefined
+            under existing subscribers)
+        """
+        with channel.lock:
+            group = get_pharmacy_group(channel.name)
+            regrouped = channel.view is not None and channel.group_key != group.key()
+            if channel.view is None or regrouped:
+                channel.group_key, channel.timestamp, channel.save_success = group.key(), latest["timestamp"], latest["save_success"]
+                channel.view, channel.snapshot = self._view(latest, group), None
+            if channel.snapshot is None:
+                channel.snapshot = sse_event("snapshot", json_envelope(
+                    frame_to_json(channel.view),
+                    timestamp=channel.timestamp,
+                    save_success=channel.save_success,
+                    group=group.name,
+                ), id=channel.timestamp)
+            return channel.timestamp, channel.snapshot, regrouped
+
+    async def _snapshot_event(self, channel):
+        """Return (capture timestamp, encoded snapshot event) of the channel, see _build_snapshot."""
+        loop = asyncio.get_running_loop()
+        timestamp, event, regrouped = await loop.run_in_executor(None, self._build_snapshot, channel, self._latest)
+        if regrouped:
+            self._broadcast(channel, _RESYNC, "snapshot")
+        return timestamp, event
+
+    async def stop(self):
+        """Wait for a push in progress, so it doesn't read the database after it was closed."""
+        if self._publisher is not None:
+            await asyncio.gather(self._publisher, return_exceptions=True)
+
+    async def _check_latest(self):
+        """Pick up a capture published by another worker, at most once per keepalive interval."""
+        if time.monotonic() - self._checked_at < self.keepalive_seconds:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            latest = await self._current()
+        except Exception as e:
+            logger.warning("Could not check for a newer snapshot: %s", e)
+            return
+        if latest is not None:
+            self.notify(latest)
+
+    async def stream(self, group, latest):
+        """
+        Server-sent events for one subscriber: a full snapshot, then a delta per capture.
+
+        The snapshot is the view the group's other subscribers are on; a capture
+        still being pushed to them follows as a delta.
+
+        Args:
+            group: PharmacyGroup the subscriber compares prices in
+            latest: Latest capture result, sent as the first snapshot
+
+        Yields:
+            bytes: Encoded events and keepalive comments
+        """
+        self.notify(latest)
+        name = None if group.name == get_pharmacy_group().name else group.name
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = _Channel(name)
+        queue = asyncio.Queue(self.queue_size)
+        channel.subscribers.add(queue)
+        try:
+            LIVE_EVENTS.inc(type="snapshot")
+            sent, event = await self._snapshot_event(channel)
+            yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE_EVENT
+                    await self._check_latest()
+                    continue
+                if event is _RESYNC:
+                    # The snapshot is the channel's newest view, so the deltas queued since are already in it
+                    while not queue.empty():
+                        queue.get_nowait()
+                    sent, event = await self._snapshot_event(channel)
+                else:
+                    timestamp, event = event
+                    if timestamp <= sent:
+                        # Pushed while the snapshot was built, which already includes it
+                        continue
+                    sent = timestamp
+                yield event
+        finally:
+            channel.subscribers.discard(queue)
+            if not channel.subscribers and self._channels.get(name) is channel:
+                del self._channels[name]
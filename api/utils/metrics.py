@@ -0,0 +1,257 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cached response to a slow upstream fetch
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Size buckets in bytes, from a 304 to a full catalogue
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    """A named metric family with label names, rendered in the Prometheus text format."""
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Return (suffix, label values, extra labels, value) for every sample."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A monotonically increasing count per label combination."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        # Without labels the single sample is exposed (as 0) before the first increment
+        self._values = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [("_total", key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets per label combination, with their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self._values = {} if self.labelnames else {(): [[0] * (len(self.buckets) + 1), 0.0]}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    samples.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+                samples.append(("_sum", key, (), total))
+                samples.append(("_count", key, (), cumulative))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """A gauge or counter whose values are read from a function at scrape time."""
+
+    def __init__(self, name, help, type, labelnames, collect):
+        """
+        Args:
+            type: "gauge" or "counter"
+            collect: Function returning a dict of label values (tuple) to value
+        """
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self._collect = collect
+
+    def samples(self):
+        suffix = "_total" if self.type == "counter" else ""
+        return [(suffix, tuple(map(str, key)), (), value) for key, value in sorted(self._collect().items())]
+
+
+class Registry:
+    """The metric families exposed on /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        rendered = []
+        for metric in metrics:
+            try:
+                rendered.append(metric.render())
+            except Exception:
+                logger.exception("metric=%s collection failed", metric.name)
+        return "\n".join(rendered) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def callback(name, help, type, labelnames, collect):
+    return REGISTRY.register(CallbackMetric(name, help, type, labelnames, collect))
+
+
+# Pipeline stages: upstream_fetch, parse, trend_analysis, save_snapshot, save_detailed_prices, serialize
+STAGE_SECONDS = histogram("sanvivo_stage_duration_seconds", "Time spent in each stage of the fetch/analyze/save/serve pipeline", ["stage"])
+STAGE_ROWS = counter("sanvivo_stage_rows", "Rows processed by each pipeline stage", ["stage"])
+STAGE_ERRORS = counter("sanvivo_stage_errors", "Pipeline stages that raised", ["stage"])
+
+
+def record_stage(stage, seconds, rows=None, **fields):
+    """Record a stage measured elsewhere: its duration, row count and a structured log line."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if rows is not None:
+        STAGE_ROWS.inc(rows, stage=stage)
+        fields = {"rows": rows, **fields}
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("stage=%s duration_ms=%.2f%s", stage, seconds * 1000, "".join(f" {key}={value}" for key, value in fields.items()))
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Time a block as one pipeline stage.
+
+    Yields a dict the block can add fields to; a "rows" entry is counted in
+    sanvivo_stage_rows, and every field goes into the stage's log line.
+    """
+    fields = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield fields
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start, **fields)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, status and body size of every HTTP response.
+
+    Requests are labelled with the path template of the route that served
+    them (e.g. /api/prices/historical/{timestamp}), or "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            router = scope.get("router")
+            self._routes = {route.endpoint: route.path for route in getattr(router, "routes", []) if hasattr(route, "endpoint")}
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        response = {"status": 500, "bytes": 0}
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            route = self._route(scope)
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route, status=response["status"])
+            HTTP_RESPONSE_BYTES.observe(response["bytes"], route=route)
+
+
+HTTP_SECONDS = histogram("sanvivo_http_request_duration_seconds", "HTTP request latency, until the last body byte is sent", ["method", "route", "status"])
+HTTP_RESPONSE_BYTES = histogram("sanvivo_http_response_bytes", "HTTP response body size", ["route"], SIZE_BUCKETS)
@@ -0,0 +1,240 @@
+import codecs
+import json
+import re
+
+from api.utils.lazy_import import lazy_import
+from api.utils.vendor_prices import VendorPrices
+
+np = lazy_import("numpy")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _ColumnBuffer:
+    """A preallocated NumPy column that doubles its capacity when full."""
+
+    def __init__(self, dtype, capacity):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        """Append a list of values in one slice assignment."""
+        end = self.size + len(values)
+        if end > len(self._data):
+            grown = np.empty(max(end, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:end] = values
+        self.size = end
+
+    def values(self):
+        return self._data[:self.size]
+
+
+class ProductStreamParser:
+    """
+    Incremental parser for the DrAnsay product payload.
+
+    Accepts the response body in arbitrary chunks (feed) and decodes one
+    product at a time, so memory holds the unparsed remainder of a chunk and
+    the results rather than the whole document. Every vendor's price is
+    appended to preallocated columnar buffers as (product index, vendor code,
+    price); views of a pharmacy group are computed from the result
+    (VendorPrices) afterwards, without parsing again.
+
+    The payload is either a list of products or an object with a "products"
+    list; other members of that object are skipped.
+    """
+
+    def __init__(self, capacity=65536):
+        """
+        Args:
+            capacity: Initial number of price rows preallocated
+        """
+        # Vendor codes are assigned in order of first appearance
+        self._vendor_codes = {}
+
+        # One entry per product with at least one price
+        self._product_ids = []
+        self._product_names = []
+        self._kultivars = []
+
+        # One entry per price, flushed from the lists below into the buffers after every chunk
+        self._row_product = _ColumnBuffer(np.int32, capacity)
+        self._row_vendor = _ColumnBuffer(np.int32, capacity)
+        self._row_price = _ColumnBuffer(np.float64, capacity)
+        self._pending_product = []
+        self._pending_vendor = []
+        self._pending_price = []
+
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._text = ""
+        # start -> keys (inside the outer object) / items (inside the product list) -> done
+        self._state = "start"
+        self._list_in_object = False
+
+    def feed(self, chunk):
+        """Parse the next chunk of the response body (bytes)."""
+        self._text += self._utf8.decode(chunk)
+        self._parse(final=False)
+        self._flush()
+
+    def close(self):
+        """
+        Finish parsing.
+
+        Returns:
+            VendorPrices: The result() of the whole payload
+
+        Raises:
+            ValueError: If the payload is malformed or truncated
+        """
+        self._text += self._utf8.decode(b"", final=True)
+        self._parse(final=True)
+        self._flush()
+        if self._state != "done":
+            raise ValueError("Truncated product payload")
+        return self.result()
+
+    def _decode(self, text, pos, final):
+        """Decode the JSON value at pos; None if it may continue in the next chunk."""
+        try:
+            value, end = self._json.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        # A number at the very end of the buffer may have more digits coming
+        if end == len(text) and not final and text[end - 1] not in '"}]el':
+            return None
+        return value, end
+
+    def _parse(self, final):
+        text = self._text
+        n = len(text)
+        pos = 0
+        while True:
+            pos = _WHITESPACE.match(text, pos).end()
+            if pos == n:
+                break
+            char = text[pos]
+
+            if self._state == "items":
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "]":
+                    self._state = "keys" if self._list_in_object else "done"
+                    pos += 1
+                    continue
+                decoded = self._decode(text, pos, final)
+                if decoded is None:
+                    break
+                self.add_product(decoded[0])
+                pos = decoded[1]
+            elif self._state == "keys":
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "}":
+                    self._state = "done"
+                    pos += 1
+                    continue
+                decoded = self._decode(text, pos, final)
+                if decoded is None:
+                    break
+                key, end = decoded
+                colon = _WHITESPACE.match(text, end).end()
+                if colon == n:
+                    break
+                if text[colon] != ":":
+                    raise ValueError(f"Expected ':' at position {colon} of the product payload")
+                value_start = _WHITESPACE.match(text, colon + 1).end()
+                if value_start == n:
+                    break
+                if key == "products" and text[value_start] == "[":
+                    self._state = "items"
+                    self._list_in_object = True
+                    pos = value_start + 1
+                    continue
+                # Any other member is decoded only to skip it
+                decoded = self._decode(text, value_start, final)
+                if decoded is None:
+                    break
+                pos = decoded[1]
+            elif self._state == "start":
+                if char == "[":
+                    self._state = "items"
+                elif char == "{":
+                    self._state = "keys"
+                else:
+                    raise ValueError("Product payload must be a list or an object")
+                pos += 1
+            else:
+                raise ValueError("Unexpected data after the product payload")
+        self._text = text[pos:]
+
+    def add_product(self, product):
+        """Add one decoded product (a dictionary) to the results."""
+        if not isinstance(product, dict):
+            return
+        product_id = product.get("id")
+        product_name = product.get("sorte")
+        if not product_name or not product_id:  # Skip products without a name or ID
+            return
+
+        codes = self._vendor_codes
+        prices = []
+        vendors = []
+        for vendor_id, vendor_data in (product.get("vendors") or {}).items():
+            price_cents = vendor_data.get("price")
+            if price_cents is None:
+                continue
+            try:
+                price_euros = float(price_cents) / 100.0
+            except (ValueError, TypeError):
+                continue
+            code = codes.get(vendor_id)
+            if code is None:
+                code = codes[vendor_id] = len(codes)
+            prices.append(price_euros)
+            vendors.append(code)
+
+        if not prices:
+            return
+        index = len(self._product_ids)
+        self._product_ids.append(product_id)
+        self._product_names.append(product_name)
+        self._kultivars.append(product.get("kultivar", ""))
+        self._pending_product.extend([index] * len(prices))
+        self._pending_vendor.extend(vendors)
+        self._pending_price.extend(prices)
+
+    def _flush(self):
+        """Move the prices parsed from the last chunk into the column buffers."""
+        if self._pending_price:
+            self._row_product.extend(self._pending_product)
+            self._row_vendor.extend(self._pending_vendor)
+            self._row_price.extend(self._pending_price)
+            self._pending_product = []
+            self._pending_vendor = []
+            self._pending_price = []
+
+    def result(self):
+        """
+        Build the parse result.
+
+        Returns:
+            VendorPrices: Every vendor's price of every product
+        """
+        self._flush()
+        return VendorPrices(
+            np.array(self._product_ids, dtype=object),
+            np.array(self._product_names, dtype=object),
+            np.array(self._kultivars, dtype=object),
+            np.array(list(self._vendor_codes), dtype=object),
+            self._row_product.values().copy(),
+            self._row_vendor.values().copy(),
+            self._row_price.values().copy(),
+        )
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import re
+
+from api.database.db_handler import delete_pharmacy_group, get_pharmacy_group_rows, save_pharmacy_group
+
+# Pharmacies compared by default, by their IDs
+TOP_PHARMACY_IDS = {
+    "zMztHDq7X50CjGIs5NeX": "Asavita",
+    "CaotAefOXilSE0hewO1c": "Herbery Online Apotheke",
+    "FhCdipzdTKWJMGYvPK0P": "higreen Drei hasen Apotheke",
+    "QV7wYUp0cGHmAgUZWkT9": "Grafenberg Apotheke",
+    "i03wd7KWpfpLHv7xYT37": "360 Grad Apotheke",
+    "hxG2kWd9KHdqWin4L771": "higreen Adler Apotheke",
+    "rKtJBabOpl3G8wd9Rilm": "Medivital Apo420",
+    "2f6ANjI8S2zTFfYDagp6": "Cannoiva (Ehrlich Apotheke)",
+    "Ox4GxbMJuJUs4cTWPJQy": "sanvivo"
+}
+
+# Sanvivo pharmacy ID
+SANVIVO_ID = "Ox4GxbMJuJUs4cTWPJQy"
+
+# Group behind the stored snapshots and trends; it falls back to the pharmacies above until redefined
+DEFAULT_PHARMACY_GROUP = os.getenv("DEFAULT_PHARMACY_GROUP", "top")
+
+_GROUP_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class PharmacyGroup:
+    """A named set of pharmacies to compare, and the own pharmacy left out of the best competitor."""
+
+    def __init__(self, name, pharmacies, own_pharmacy_id=None):
+        """
+        Args:
+            name: Group name
+            pharmacies: Mapping of pharmacy ID to display name
+            own_pharmacy_id: Pharmacy excluded from the best competitor (None to exclude none)
+        """
+        self.name = name
+        self.pharmacies = dict(pharmacies)
+        self.own_pharmacy_id = own_pharmacy_id
+
+    def key(self):
+        """Hashable identity of the comparison, for caching views derived from the group."""
+        return (tuple(sorted(self.pharmacies.items())), self.own_pharmacy_id)
+
+    def digest(self):
+        """Short digest of key() that is stable across processes, for validators."""
+        return hashlib.sha1(json.dumps(self.key()).encode("utf-8")).hexdigest()[:12]
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "own_pharmacy_id": self.own_pharmacy_id,
+            "pharmacies": self.pharmacies,
+            "default": self.name == DEFAULT_PHARMACY_GROUP,
+        }
+
+
+def _builtin_default():
+    return PharmacyGroup(DEFAULT_PHARMACY_GROUP, TOP_PHARMACY_IDS, SANVIVO_ID)
+
+
+def get_pharmacy_groups():
+    """Return every pharmacy group by name, including the default group."""
+    groups = {row["name"]: PharmacyGroup(row["name"], row["pharmacies"], row["own_pharmacy_id"]) for row in get_pharmacy_group_rows()}
+    groups.setdefault(DEFAULT_PHARMACY_GROUP, _builtin_default())
+    return groups
+
+
+def get_pharmacy_group(name=None):
+    """
+    Return a pharmacy group (the default group if name is None).
+
+    Raises:
+        KeyError: If there is no group with that name
+    """
+    name = name or DEFAULT_PHARMACY_GROUP
+    rows = get_pharmacy_group_rows(name)
+    if rows:
+        return PharmacyGroup(name, rows[0]["pharmacies"], rows[0]["own_pharmacy_id"])
+    if name == DEFAULT_PHARMACY_GROUP:
+        return _builtin_default()
+    raise KeyError(name)
+
+
+def put_pharmacy_group(name, pharmacies, own_pharmacy_id=None):
+    """
+    Create or replace a pharmacy group.
+
+    Raises:
+        ValueError: If the name is invalid, the group is empty or the own pharmacy isn't a member
+    """
+    if not _GROUP_NAME.match(name):
+        raise ValueError("Group names are 1-64 letters, digits, '.', '_' or '-'")
+    if not pharmacies:
+        raise ValueError("A pharmacy group needs at least one pharmacy")
+    if own_pharmacy_id is not None and own_pharmacy_id not in pharmacies:
+        raise ValueError(f"own_pharmacy_id {own_pharmacy_id} is not one of the group's pharmacies")
+    # A pharmacy without a display name is shown by its ID
+    pharmacies = {pharmacy_id: display_name or pharmacy_id for pharmacy_id, display_name in pharmacies.items()}
+    save_pharmacy_group(name, pharmacies, own_pharmacy_id)
+    return PharmacyGroup(name, pharmacies, own_pharmacy_id)
+
+
+def remove_pharmacy_group(name):
+    """
+    Delete a pharmacy group; deleting the default group restores the built-in pharmacy list.
+
+    Returns:
+        bool: False if there was no stored group with that name
+    """
+    return delete_pharmacy_group(name)
+
+
+def pharmacy_names():
+    """Display name of every pharmacy in any group, by ID."""
+    names = {}
+    for group in get_pharmacy_groups().values():
+        names.update(group.pharmacies)
+    return names
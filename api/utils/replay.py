@@ -0,0 +1,238 @@
+import collections
+import datetime
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from api.database import db_handler, payload_store
+from api.utils import data_fetcher
+from api.utils.metrics import span
+
+# Worker processes parsing and aggregating recorded payloads during a replay (0: parse in the calling process)
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", str(os.cpu_count() or 1)))
+
+# Payloads parsed ahead of the one being stored, per worker; bounds the memory a replay holds
+REPLAY_PREFETCH_PER_WORKER = 2
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _init_worker(db_path, store_path):
+    # Pharmacy groups are read from the database being replayed into
+    db_handler.DB_PATH = db_path
+    payload_store.RAW_PAYLOAD_PATH = store_path
+
+
+def derive_capture(record):
+    """
+    Parse and aggregate one recorded payload, as the live ingestion does.
+
+    Runs in a replay worker process, so it only reads: the result is stored
+    by the caller, in timestamp order.
+
+    Args:
+        record: Row of db_handler.get_raw_payloads
+
+    Returns:
+        tuple: (record, snapshot DataFrame, detailed price columns)
+    """
+    vendor_prices = payload_store.parse_payload(record["digest"], record["encoding"], data_fetcher.new_payload_parser)
+    snapshot = data_fetcher.ProductSnapshot(record["timestamp"], vendor_prices)
+    return record, snapshot.summary, snapshot.detailed_prices
+
+
+def _derived(records, workers):
+    """Yield derive_capture results (or the exception) in record order, keeping a bounded number in flight."""
+    if workers <= 0:
+        for record in records:
+            try:
+                yield derive_capture(record)
+            except Exception as e:
+                yield record, e, None
+        return
+
+    # Spawned rather than forked, so workers don't inherit this process's SQLite connections
+    context = multiprocessing.get_context("spawn")
+    initargs = (db_handler.DB_PATH, payload_store.payload_store_path())
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=initargs) as pool:
+        pending = collections.deque()
+        remaining = iter(records)
+        for record in remaining:
+            pending.append((record, pool.submit(derive_capture, record)))
+            if len(pending) >= workers * REPLAY_PREFETCH_PER_WORKER:
+                break
+        while pending:
+            record, future = pending.popleft()
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                result = (record, e, None)
+            # Keep the pool busy while the parent stores this capture
+            following = next(remaining, None)
+            if following is not None:
+                pending.append((following, pool.submit(derive_capture, following)))
+            yield result
+
+
+def clear_history(conn, start, end):
+    """
+    Delete the snapshots and detailed price captures stored in [start, end], in the caller's transaction.
+
+    The capture after the range keeps its prices: every price the deleted rows
+    set is pinned there, as a back-fill does. The diffs of the deleted
+    snapshots and of the snapshot compared with the last of them are dropped;
+    the rollups are left to the caller.
+
+    Raises:
+        ValueError: If a capture or snapshot in the range has no recorded payload to replay it from
+
+    Returns:
+        dict: {"captures", "snapshots"} deleted
+    """
+    unrecorded = conn.execute("""
+        SELECT (SELECT COUNT(*) FROM detailed_price_captures WHERE timestamp >= ? AND timestamp <= ?
+                AND timestamp NOT IN (SELECT timestamp FROM raw_payloads)),
+            (SELECT COUNT(*) FROM snapshots WHERE timestamp >= ? AND timestamp <= ?
+                AND timestamp NOT IN (SELECT timestamp FROM raw_payloads WHERE snapshot = 1))
+    """, (start, end, start, end)).fetchone()
+    if any(unrecorded):
+        raise ValueError(f"{unrecorded[0]} captures and {unrecorded[1]} snapshots between {start} and {end} "
+                         "have no recorded payload and would be lost; replay a range without them")
+
+    next_capture = conn.execute(
+        "SELECT MIN(timestamp) FROM detailed_price_captures WHERE timestamp > ?", (end,)
+    ).fetchone()[0]
+    if next_capture is not None:
+        expected = db_handler._prices_as_of(conn, next_capture, inclusive=True)
+        keys = set(conn.execute(
+            "SELECT DISTINCT product_id, pharmacy_id FROM detailed_price_data WHERE timestamp >= ? AND timestamp <= ?",
+            (start, end)
+        ).fetchall())
+    conn.execute("DELETE FROM detailed_price_data WHERE timestamp >= ? AND timestamp <= ?", (start, end))
+    captures = conn.execute(
+        "DELETE FROM detailed_price_captures WHERE timestamp >= ? AND timestamp <= ?", (start, end)
+    ).rowcount
+    if next_capture is not None:
+        db_handler._restore_capture(conn, next_capture, expected, keys)
+
+    stale = conn.execute(
+        "SELECT timestamp FROM snapshot_diffs WHERE previous_timestamp >= ? AND previous_timestamp <= ? AND timestamp > ?",
+        (start, end, end)
+    ).fetchall()
+    for (timestamp,) in stale:
+        db_handler._delete_snapshot_diffs(conn, "timestamp = ?", timestamp)
+    for table in ("snapshot_diff_rows", "snapshot_diffs", "snapshot_prices"):
+        conn.execute(f"DELETE FROM {table} WHERE timestamp >= ? AND timestamp <= ?", (start, end))
+    snapshots = conn.execute("DELETE FROM snapshots WHERE timestamp >= ? AND timestamp <= ?", (start, end)).rowcount
+    return {"captures": captures, "snapshots": snapshots}
+
+
+def replay_payloads(start=None, end=None, workers=REPLAY_WORKERS):
+    """
+    Re-derive the stored history of a time range from the recorded raw payloads.
+
+    Every recorded capture in the range is parsed and aggregated again with
+    the current code and configuration (pharmacy groups, DETAILED_PRICE_VENDORS)
+    in a pool of worker processes. The history derived before, from the first
+    to the last of those captures, is deleted; the new results are stored in
+    timestamp order through the regular write path: detailed prices and, if
+    the capture stored one, the snapshot with its trend. Captures are stored
+    without touching the rollups, which are rebuilt over the range at the end.
+    A range reaching the latest capture is stored as appends, which is
+    fastest; earlier ranges are back-filled. Runs offline: nothing is fetched.
+    A payload that fails to parse leaves its capture out (the report lists
+    it); replaying again after fixing the cause restores it.
+
+    The run is recorded in replay_runs, in the same transaction as the deletion,
+    so the price cube of every worker rebuilds on its next use.
+
+    Args:
+        start: Earliest capture to replay (None for the first recorded one)
+        end: Latest capture to replay (None for the last recorded one)
+        workers: Worker processes parsing payloads (0 to parse in this process)
+
+    Raises:
+        ValueError: If a stored capture in the range has no recorded payload (see clear_history),
+            or a recorded payload is missing from the store
+
+    Returns:
+        dict: {"payloads", "distinct_payloads", "raw_bytes", "deleted" (see clear_history),
+        "captures", "snapshots", "failed" (timestamp -> error), "diffs_recomputed", "duration_seconds"}
+    """
+    started = time.perf_counter()
+    records = db_handler.get_raw_payloads(start, end)
+    report = {
+        "payloads": len(records),
+        "distinct_payloads": len({record["digest"] for record in records}),
+        "raw_bytes": sum(record["raw_bytes"] for record in records),
+        "deleted": {"captures": 0, "snapshots": 0},
+        "captures": 0,
+        "snapshots": 0,
+        "failed": {},
+        "diffs_recomputed": 0,
+    }
+    if not records:
+        report["duration_seconds"] = time.perf_counter() - started
+        return report
+
+    missing = [record["timestamp"] for record in records
+               if not os.path.exists(payload_store.payload_path(record["digest"], record["encoding"]))]
+    if missing:
+        raise ValueError(f"The payloads of {len(missing)} captures are missing from {payload_store.payload_store_path()}, "
+                         f"e.g. {missing[0]}")
+
+    first, last = records[0]["timestamp"], records[-1]["timestamp"]
+    manager = db_handler.get_connection_manager()
+    with manager.write() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        run_id = conn.execute(
+            "INSERT INTO replay_runs (started_at, range_start, range_end, workers) VALUES (?, ?, ?, ?)",
+            (_now(), first, last, workers)
+        ).lastrowid
+        report["deleted"] = clear_history(conn, first, last)
+
+    error = None
+    try:
+        # Summary of the capture stored last: the one the next capture is compared with
+        previous = None
+        with span("replay", rows=len(records), workers=workers):
+            for record, summary, detailed in _derived(records, workers):
+                if isinstance(summary, Exception):
+                    logger.error("Could not replay the payload of %s: %s", record["timestamp"], summary)
+                    report["failed"][record["timestamp"]] = str(summary)
+                    previous = None
+                    continue
+                timestamp = record["timestamp"]
+                if len(detailed["price"]) and db_handler.save_detailed_prices(detailed, timestamp, deferred=True):
+                    report["captures"] += 1
+                if record["snapshot"] and not summary.empty:
+                    diff = data_fetcher.diff_against_previous(summary, timestamp, previous)
+                    report["snapshots"] += db_handler.save_to_db(summary, timestamp, diff)
+                previous = (timestamp, summary) if len(detailed["price"]) else None
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        db_handler.rebuild_rollups(first, last)
+        with manager.write() as conn:
+            conn.execute("""
+                UPDATE replay_runs SET finished_at = ?, payloads = ?, captures = ?, snapshots = ?, failed = ?, error = ?
+                WHERE id = ?
+            """, (_now(), report["payloads"], report["captures"], report["snapshots"], len(report["failed"]), error, run_id))
+        db_handler._notify_history_rewrite(first)
+
+    # Snapshots after the range compared against captures that were just replaced
+    report["diffs_recomputed"] = data_fetcher.backfill_snapshot_diffs()
+    report["duration_seconds"] = time.perf_counter() - started
+    logger.info("Replayed %d payloads (%d captures, %d snapshots, %d failed) in %.1fs", len(records),
+                report["captures"], report["snapshots"], len(report["failed"]), report["duration_seconds"])
+    return report
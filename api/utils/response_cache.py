@@ -0,0 +1,106 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CachedResponse:
+    """A serialized response body and its strong ETag."""
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+
+
+def make_etag(body):
+    """Strong ETag for a response body (a quoted SHA-256 prefix)."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an ETag.
+
+    Uses the weak comparison RFC 9110 prescribes for If-None-Match, so
+    W/"x" matches "x"; "*" matches any ETag.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    Least-recently-used cache of serialized responses, bounded by total body size.
+
+    Bodies larger than the whole budget are returned but not stored.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes: Maximum total size of the cached bodies
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the CachedResponse for `key` (marking it recently used), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body):
+        """
+        Store a serialized body, evicting least recently used entries to stay within max_bytes.
+
+        Returns:
+            CachedResponse: The stored (or, if too large, uncached) response
+        """
+        entry = CachedResponse(body, make_etag(body))
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.body)
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+        return entry
+
+    def invalidate(self, predicate=None):
+        """Drop the entries whose key satisfies `predicate` (all entries if None)."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate is None or predicate(key)]:
+                self._size -= len(self._entries.pop(key).body)
+
+    def stats(self):
+        """Return entry count, size and hit/miss counters as a dictionary."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
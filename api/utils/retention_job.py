@@ -0,0 +1,163 @@
+import asyncio
+import datetime
+import logging
+import os
+import threading
+
+from api.database import db_handler, retention
+from api.utils.coordination import IngestLease
+from api.utils.data_fetcher import backfill_snapshot_diffs
+from api.utils.metrics import callback
+
+# Time between two compaction runs (the first one runs one interval after startup)
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "86400"))
+
+# Pause between two compaction batches, so captures and other writers get the write lock in between
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.5"))
+
+# How to give freed pages back to the file system after a run: incremental, full or off
+RETENTION_VACUUM = os.getenv("RETENTION_VACUUM", "incremental")
+
+# Worker processes serving the same database let one of them compact through this lease
+RETENTION_LEASE_NAME = "retention"
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class RetentionJob:
+    """
+    Compacts the price history in the background according to the retention policy.
+
+    Runs in a worker thread, one short write transaction per batch with a
+    pause in between, so captures and reads carry on while it works. With
+    several worker processes only the holder of the retention lease runs it.
+    After compacting, the diffs of the remaining snapshots whose predecessor
+    was removed are recomputed.
+    """
+
+    def __init__(self, interval_seconds, pause_seconds, vacuum, enabled=True, lease=None):
+        """
+        Args:
+            interval_seconds: Time between two runs
+            pause_seconds: Sleep between two batches of a run
+            vacuum: Vacuum mode after a run, one of retention.VACUUM_MODES
+            enabled: Whether start() launches the background loop
+            lease: IngestLease deciding which process compacts (None to always compact)
+        """
+        self.interval_seconds = interval_seconds
+        self.pause_seconds = pause_seconds
+        self.vacuum = vacuum
+        self.enabled = enabled
+        self.lease = lease
+        self._task = None
+        self._running = False
+        self._stop = threading.Event()
+
+        # Run statistics
+        self.runs = 0
+        self.failures = 0
+        self.last_started_at = None
+        self.last_report = None
+        self.last_error = None
+        self.next_run_at = None
+
+    def start(self):
+        """Start the background loop (no-op if disabled or already running)."""
+        if self.enabled and self._task is None:
+            self._stop.clear()
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        """Stop the loop; a run in progress ends after its current batch."""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.lease is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.lease.release)
+
+    def _run(self):
+        if self.lease is not None and not self.lease.acquire():
+            logger.debug("Another worker holds the retention lease, skipping this run")
+            return None
+        try:
+            report = retention.run_retention(vacuum=self.vacuum, pause_seconds=self.pause_seconds, stop=self._stop)
+            if report["batches"]:
+                report["diffs_recomputed"] = backfill_snapshot_diffs()
+            return report
+        finally:
+            if self.lease is not None:
+                self.lease.release()
+
+    async def run_once(self):
+        """
+        Run one compaction now in a worker thread.
+
+        Returns:
+            The run report, or None if another worker holds the lease or a run is in progress
+        """
+        if self._running:
+            return None
+        self._running = True
+        self.last_started_at = _now()
+        try:
+            report = await asyncio.get_running_loop().run_in_executor(None, self._run)
+            if report is not None:
+                self.last_report = report
+            self.last_error = None
+            return report
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            raise
+        finally:
+            self.runs += 1
+            self._running = False
+
+    async def _loop(self):
+        while True:
+            self.next_run_at = (datetime.datetime.now() + datetime.timedelta(seconds=self.interval_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("History compaction failed: %s", e)
+
+    def status(self):
+        """Return the policy, the job configuration and the latest runs as a dictionary."""
+        return {
+            "enabled": self.enabled,
+            "full_days": retention.RETENTION_FULL_DAYS,
+            "hourly_days": retention.RETENTION_HOURLY_DAYS or None,
+            "interval_seconds": self.interval_seconds,
+            "vacuum": self.vacuum,
+            "running": self._running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_started_at": self.last_started_at,
+            "last_report": self.last_report,
+            "last_error": self.last_error,
+            "next_run_at": self.next_run_at,
+            "history": db_handler.get_retention_runs(),
+        }
+
+
+# Background history compaction, started from the API's startup event when a policy is configured
+retention_job = RetentionJob(
+    RETENTION_INTERVAL_SECONDS,
+    RETENTION_BATCH_PAUSE_SECONDS,
+    RETENTION_VACUUM,
+    enabled=retention.RETENTION_FULL_DAYS > 0,
+    lease=IngestLease(RETENTION_LEASE_NAME, RETENTION_INTERVAL_SECONDS),
+)
+
+callback("sanvivo_retention_runs", "History compaction runs by outcome (failed runs are also counted in total)", "counter",
+         ["outcome"], lambda: {("total",): retention_job.runs, ("failed",): retention_job.failures})
@@ -0,0 +1,216 @@
+import os
+import asyncio
+import datetime
+import logging
+import random
+import time
+
+from api.utils.coordination import INGEST_LEASE_NAME, IngestLease, SharedSnapshot
+from api.utils.data_fetcher import capture_price_snapshot
+from api.utils.metrics import callback, span
+
+# Scheduler configuration
+SNAPSHOT_SCHEDULER_ENABLED = os.getenv("SNAPSHOT_SCHEDULER_ENABLED", "1") not in ("0", "false", "False", "")
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "900"))
+SNAPSHOT_JITTER_SECONDS = float(os.getenv("SNAPSHOT_JITTER_SECONDS", "30"))
+
+# How long the ingesting worker's lease lasts without renewal; another worker takes over after that
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", str(2 * SNAPSHOT_INTERVAL_SECONDS + SNAPSHOT_JITTER_SECONDS)))
+
+logger = logging.getLogger(__name__)
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+class SnapshotScheduler:
+    """
+    Captures price snapshots in the background at a jittered interval.
+
+    Only one capture runs at a time: a run that is due (or requested) while
+    another is in progress waits for that one instead of starting a second.
+    The latest successful result is kept in memory for the read endpoints.
+
+    With several worker processes, only the holder of the ingest lease
+    captures; it publishes every result to the shared snapshot, and the
+    other workers serve that instead of fetching and storing their own.
+    """
+
+    def __init__(self, capture, interval_seconds, jitter_seconds, enabled=True, lease=None, shared=None):
+        """
+        Args:
+            capture: Coroutine function that captures one snapshot and returns its result
+            interval_seconds: Average time between two captures
+            jitter_seconds: Maximum random deviation from the interval
+            enabled: Whether start() launches the background loop
+            lease: IngestLease deciding which process captures (None to always capture)
+            shared: SharedSnapshot the result is published to and read from (None to keep it in this process)
+        """
+        self._capture = capture
+        self.interval_seconds = interval_seconds
+        self.jitter_seconds = jitter_seconds
+        self.enabled = enabled
+        self.lease = lease
+        self.shared = shared
+        self.latest = None
+        self._listeners = []
+        self._task = None
+        self._running = None
+
+        # Run statistics
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.overlaps_skipped = 0
+        self.followed = 0
+        self.last_started_at = None
+        self.last_finished_at = None
+        self.last_duration_seconds = None
+        self.last_error = None
+        self.next_run_at = None
+
+    def on_snapshot(self, listener):
+        """
+        Register a callback for new snapshots.
+
+        `listener(result)` runs on the event loop whenever `latest` becomes a newer
+        capture, whether this process captured it or picked it up from the worker
+        holding the ingest lease.
+        """
+        self._listeners.append(listener)
+
+    def _set_latest(self, result):
+        newer = self.latest is None or result["timestamp"] > self.latest["timestamp"]
+        self.latest = result
+        if newer:
+            for listener in self._listeners:
+                try:
+                    listener(result)
+                except Exception:
+                    logger.exception("Snapshot listener failed")
+
+    def start(self):
+        """Start the background loop (no-op if disabled or already running)."""
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        """Cancel the background loop and give up the ingest lease."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.lease is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.lease.release)
+
+    async def current(self):
+        """
+        Return the latest result, picking up one published by another worker since.
+
+        Costs one stat of the shared snapshot unless it was replaced.
+        """
+        if self.shared is not None and self.shared.changed():
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, self.shared.load)
+            if result is not None and (self.latest is None or result["timestamp"] > self.latest["timestamp"]):
+                self._set_latest(result)
+        return self.latest
+
+    async def run_once(self):
+        """
+        Capture a snapshot now, or join the capture that is already running.
+
+        Returns:
+            The capture result (also stored as `latest`)
+        """
+        if self._running is None:
+            self._running = asyncio.ensure_future(self._run())
+        else:
+            self.overlaps_skipped += 1
+        return await asyncio.shield(self._running)
+
+    async def _run(self):
+        started = time.monotonic()
+        self.last_started_at = _now()
+        try:
+            loop = asyncio.get_running_loop()
+            if self.lease is not None and not await loop.run_in_executor(None, self.lease.acquire):
+                # Another worker ingests: serve what it published instead of storing a duplicate
+                result = await loop.run_in_executor(None, self.shared.load) if self.shared is not None else None
+                if result is None:
+                    raise RuntimeError("Another worker holds the ingest lease and has not published a snapshot yet")
+                self.followed += 1
+            else:
+                # The whole capture, covering the upstream_fetch, parse, trend_analysis and save stages
+                with span("capture"):
+                    result = await self._capture()
+                if self.shared is not None:
+                    await loop.run_in_executor(None, self.shared.publish, result)
+            self._set_latest(result)
+            self.last_error = None
+            self.consecutive_failures = 0
+            return result
+        except Exception as e:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = str(e)
+            raise
+        finally:
+            self.runs += 1
+            self.last_finished_at = _now()
+            self.last_duration_seconds = round(time.monotonic() - started, 3)
+            self._running = None
+
+    def _next_delay(self):
+        jitter = random.uniform(-self.jitter_seconds, self.jitter_seconds)
+        return max(1.0, self.interval_seconds + jitter)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Scheduled snapshot failed: %s", e)
+
+            delay = self._next_delay()
+            self.next_run_at = (datetime.datetime.now() + datetime.timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
+            await asyncio.sleep(delay)
+
+    def status(self):
+        """Return the scheduler configuration and run statistics as a dictionary."""
+        return {
+            "enabled": self.enabled,
+            "interval_seconds": self.interval_seconds,
+            "jitter_seconds": self.jitter_seconds,
+            "running": self._running is not None,
+            "runs": self.runs,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "overlaps_skipped": self.overlaps_skipped,
+            "followed": self.followed,
+            "last_run": {
+                "started_at": self.last_started_at,
+                "finished_at": self.last_finished_at,
+                "duration_seconds": self.last_duration_seconds,
+                "error": self.last_error,
+            },
+            "next_run_at": self.next_run_at,
+            "latest_snapshot": self.latest["timestamp"] if self.latest else None,
+            "ingest": self.lease.status() if self.lease is not None else None,
+        }
+
+# Background capture of price snapshots, started from the API's startup event
+snapshot_scheduler = SnapshotScheduler(
+    capture_price_snapshot,
+    SNAPSHOT_INTERVAL_SECONDS,
+    SNAPSHOT_JITTER_SECONDS,
+    enabled=SNAPSHOT_SCHEDULER_ENABLED,
+    lease=IngestLease(INGEST_LEASE_NAME, INGEST_LEASE_SECONDS),
+    shared=SharedSnapshot(),
+)
+
+callback("sanvivo_scheduler_runs", "Scheduled snapshot runs by outcome (failed runs are also counted in total)", "counter",
+         ["outcome"], lambda: {("total",): snapshot_scheduler.runs, ("failed",): snapshot_scheduler.failures,
+                               ("followed",): snapshot_scheduler.followed})
@@ -0,0 +1,185 @@
+import json
+import math
+from json.encoder import encode_basestring
+
+from api.utils.lazy_import import lazy_import
+from api.utils.metrics import span
+
+np = lazy_import("numpy")
+
+# Response shapes accepted by the ?format= parameter
+RESPONSE_FORMATS = ("records", "columnar")
+
+
+def _encode_value(value):
+    """JSON literal of a single Python value; None, NaN and ±inf become null."""
+    if value is None:
+        return "null"
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if isinstance(value, float):
+        return float.__repr__(value) if math.isfinite(value) else "null"
+    if isinstance(value, (bool, np.bool_)):
+        return "true" if value else "false"
+    if isinstance(value, (int, np.integer)):
+        return int.__repr__(int(value))
+    if isinstance(value, np.floating):
+        return _encode_value(float(value))
+    if hasattr(value, "isoformat"):
+        # pandas NaT is a datetime too, but has no meaningful ISO form
+        return "null" if value != value else encode_basestring(value.isoformat())
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+
+
+def encode_values(values):
+    """
+    Encode a list of Python values to JSON literals, one string per value.
+
+    Args:
+        values: List of values (str, int, float, bool, None, datetimes, or anything json.dumps accepts)
+
+    Returns:
+        list: JSON text of each value; None, NaN and ±inf are encoded as null
+    """
+    return [_encode_value(value) for value in values]
+
+
+def encode_series(series):
+    """
+    Encode a pandas Series to JSON literals, one string per row.
+
+    Float and integer columns are converted in bulk from their NumPy arrays;
+    other columns fall back to encoding value by value.
+
+    Returns:
+        list: JSON text of each row's value; missing and non-finite numbers are encoded as null
+    """
+    kind = series.dtype.kind
+    if kind == "f":
+        values = series.to_numpy()
+        encoded = list(map(float.__repr__, values.tolist()))
+        for index in np.flatnonzero(~np.isfinite(values)):
+            encoded[index] = "null"
+        return encoded
+    if kind in "iu":
+        return list(map(int.__repr__, series.tolist()))
+    if kind == "b":
+        return ["true" if value else "false" for value in series.tolist()]
+    return encode_values(series.tolist())
+
+
+def columns_to_json(names, columns, format="records"):
+    """
+    Assemble encoded columns into a JSON array of records or a columnar object.
+
+    Args:
+        names: Column names
+        columns: One list of encoded values (see encode_series / encode_values) per name
+        format: "records" for [{"name": value, ...}, ...] or "columnar" for {"name": [values], ...}
+
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    if format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown format: {format}. Available: {', '.join(RESPONSE_FORMATS)}")
+    keys = [encode_basestring(str(name)) for name in names]
+    if format == "columnar":
+        text = "{" + ",".join(f"{key}:[{','.join(column)}]" for key, column in zip(keys, columns)) + "}"
+    else:
+        # One %-template per row; the keys are escaped once instead of once per cell
+        template = "{" + ",".join(key.replace("%", "%%") + ":%s" for key in keys) + "}"
+        text = "[" + ",".join([template % row for row in zip(*columns)]) + "]"
+    return text.encode("utf-8")
+
+
+def frame_to_json(df, format="records"):
+    """
+    Serialize a DataFrame straight to JSON bytes, without per-row dictionaries.
+
+    Args:
+        df: DataFrame to serialize
+        format: "records" (a list of row objects) or "columnar" (one array per column)
+
+    Returns:
+        bytes: UTF-8 encoded JSON; missing and non-finite numbers are encoded as null
+    """
+    with span("serialize", rows=len(df)) as fields:
+        body = columns_to_json(df.columns, [encode_series(df[name]) for name in df.columns], format)
+        fields["bytes"] = len(body)
+    return body
+
+
+def records_to_json(records, format="records"):
+    """
+    Serialize a list of dictionaries sharing the same keys (e.g. history rows) to JSON bytes.
+
+    Args:
+        records: List of dictionaries
+        format: "records" or "columnar"
+
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    names = list(records[0]) if records else []
+    with span("serialize", rows=len(records)) as fields:
+        body = columns_to_json(names, [encode_values([record[name] for record in records]) for name in names], format)
+        fields["bytes"] = len(body)
+    return body
+
+
+def matrix_to_json(matrix):
+    """
+    Serialize a 2-D float array to JSON bytes as one array per row.
+
+    Returns:
+        bytes: UTF-8 encoded [[...], ...]; NaN and ±inf are encoded as null
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    height, width = matrix.shape
+    with span("serialize", rows=height) as fields:
+        values = matrix.ravel()
+        encoded = list(map(float.__repr__, values.tolist()))
+        for index in np.flatnonzero(~np.isfinite(values)):
+            encoded[index] = "null"
+        text = "[" + ",".join("[" + ",".join(encoded[row * width:(row + 1) * width]) + "]" for row in range(height)) + "]"
+        body = text.encode("utf-8")
+        fields["bytes"] = len(body)
+    return body
+
+
+def embed_json(name, raw, **fields):
+    """
+    Build a JSON object with one already serialized member, without decoding it again.
+
+    Args:
+        name: Key of the serialized member
+        raw: JSON bytes of that member
+        **fields: Further members (encoded with json.dumps)
+
+    Returns:
+        bytes: UTF-8 encoded {name: raw, **fields}
+    """
+    return embed_json_members({name: raw}, **fields)
+
+
+def embed_json_members(members, **fields):
+    """
+    Build a JSON object with several already serialized members (see embed_json).
+
+    Args:
+        members: Dict of key to JSON bytes (at least one)
+        **fields: Further members (encoded with json.dumps)
+
+    Returns:
+        bytes: UTF-8 encoded {**members, **fields}
+    """
+    head = b"{" + b",".join(encode_basestring(name).encode("utf-8") + b":" + raw for name, raw in members.items())
+    meta = json.dumps(fields, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+    if meta == b"{}":
+        return head + b"}"
+    return head + b"," + meta[1:]
+
+
+def json_envelope(data, **fields):
+    """Wrap already serialized data into a {"data": ..., **fields} response body."""
+    return embed_json("data", data, **fields)
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+
+class SnapshotCache:
+    """
+    TTL cache for one upstream snapshot with single-flight loading.
+
+    The first caller after the TTL expires runs the async loader; every caller
+    that arrives while that load is in progress awaits the same task and
+    receives the same result (or the same exception) instead of starting
+    another upstream request.
+    """
+
+    def __init__(self, loader, ttl_seconds):
+        """
+        Args:
+            loader: Coroutine function that fetches and parses the upstream payload
+            ttl_seconds: How long a loaded snapshot is served before refetching
+        """
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._value = None
+        self._loaded_at = 0.0
+        self._inflight = None
+        # Calls served from the cache, sharing an in-flight load, or starting one
+        self._lookups = {"hit": 0, "shared": 0, "miss": 0}
+
+    async def get(self, force=False):
+        """
+        Return the cached snapshot, loading it if it is missing or expired.
+
+        Args:
+            force: Skip the TTL check and load a fresh snapshot (an in-flight
+                load is still shared)
+
+        Returns:
+            The loader's result
+        """
+        if not force and self._value is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+            self._lookups["hit"] += 1
+            return self._value
+
+        if self._inflight is None:
+            self._lookups["miss"] += 1
+            self._inflight = asyncio.ensure_future(self._load())
+        else:
+            self._lookups["shared"] += 1
+        # Shielded so a disconnecting client does not cancel the shared load
+        return await asyncio.shield(self._inflight)
+
+    async def _load(self):
+        try:
+            value = await self._loader()
+            self._value = value
+            self._loaded_at = time.monotonic()
+            return value
+        finally:
+            self._inflight = None
+
+    def lookups(self):
+        """Return how many calls were cache hits, joined an in-flight load, or started a load."""
+        return dict(self._lookups)
+
+    def peek(self):
+        """Return the last loaded snapshot without checking the TTL (None if never loaded)."""
+        return self._value
+
+    def invalidate(self):
+        """Drop the cached snapshot so the next call fetches again."""
+        self._value = None
+        self._loaded_at = 0.0
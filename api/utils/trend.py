@@ -0,0 +1,141 @@
+from api.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+PRICE_COLUMN = "Price (€/g)"
+COMPETITOR_PRICE_COLUMN = "Best Competitor Price (€/g)"
+
+UNCHANGED_LABEL = "→ Unchanged"
+FIRST_DATA_POINT_LABEL = "First data point"
+NEW_PRODUCT_LABEL = "New product"
+
+
+def _price_delta_labels(delta):
+    """
+    Turn an array of rounded price deltas into trend labels in bulk.
+
+    Args:
+        delta: NumPy array of price differences already rounded to 2 decimals
+
+    Returns:
+        ndarray: Object array with "→ Unchanged", "↑ +x.xx€" or "↓ -x.xx€" labels
+    """
+    labels = np.full(delta.shape, UNCHANGED_LABEL, dtype=object)
+    if not delta.size:
+        return labels
+
+    # Threshold of 0.01 to account for minor calculation differences
+    unchanged = np.abs(delta) < 0.01
+    increased = ~unchanged & (delta > 0)
+    decreased = ~unchanged & ~increased
+
+    if increased.any():
+        labels[increased] = np.char.mod("↑ +%.2f€", delta[increased]).astype(object)
+    if decreased.any():
+        labels[decreased] = np.char.mod("↓ %.2f€", delta[decreased]).astype(object)
+    return labels
+
+
+def compute_snapshot_diff(current_df, prev_df):
+    """
+    Compare a snapshot with the previous one using a single keyed merge.
+
+    Products are matched by "Sorte"; if the previous snapshot lists a product
+    more than once, its first row is used.
+
+    Args:
+        current_df: DataFrame with the current snapshot
+        prev_df: DataFrame with the previous snapshot (may be None or empty)
+
+    Returns:
+        dict: Arrays aligned with the rows of current_df - "trend" and "competitor_trend"
+        labels (competitor_trend is None if current_df has no competitor price), "price_delta"
+        and "competitor_delta" (rounded differences, NaN where there is nothing to compare) -
+        and "summary" counts (unchanged, increased, decreased, new)
+    """
+    n = len(current_df)
+    has_competitor = COMPETITOR_PRICE_COLUMN in current_df.columns
+    diff = {
+        "trend": np.full(n, FIRST_DATA_POINT_LABEL, dtype=object),
+        "competitor_trend": np.full(n, FIRST_DATA_POINT_LABEL, dtype=object) if has_competitor else None,
+        "price_delta": np.full(n, np.nan),
+        "competitor_delta": np.full(n, np.nan),
+        "summary": {"unchanged": 0, "increased": 0, "decreased": 0, "new": 0},
+    }
+
+    if prev_df is None or prev_df.empty:
+        return diff
+
+    prev_has_competitor = COMPETITOR_PRICE_COLUMN in prev_df.columns
+    prev_columns = ["Sorte", PRICE_COLUMN] + ([COMPETITOR_PRICE_COLUMN] if prev_has_competitor else [])
+    prev_first = prev_df[prev_columns].drop_duplicates("Sorte", keep="first")
+    prev_first.columns = ["Sorte"] + ["_prev_" + column for column in prev_columns[1:]]
+
+    merged = current_df[["Sorte"]].merge(prev_first, on="Sorte", how="left", indicator=True)
+    matched = (merged["_merge"] == "both").to_numpy()
+
+    # Price trend
+    current_price = pd.to_numeric(current_df[PRICE_COLUMN], errors="coerce").to_numpy(dtype=float)
+    prev_price = pd.to_numeric(merged["_prev_" + PRICE_COLUMN], errors="coerce").to_numpy(dtype=float)
+    delta = np.round(current_price[matched] - prev_price[matched], 2)
+
+    trend = np.full(n, NEW_PRODUCT_LABEL, dtype=object)
+    trend[matched] = _price_delta_labels(delta)
+    diff["trend"] = trend
+    diff["price_delta"][matched] = delta
+
+    unchanged = np.abs(delta) < 0.01
+    summary = diff["summary"]
+    summary["unchanged"] = int(unchanged.sum())
+    summary["increased"] = int((~unchanged & (delta > 0)).sum())
+    summary["decreased"] = len(delta) - summary["unchanged"] - summary["increased"]
+    summary["new"] = int((~matched).sum())
+
+    # Competitor trend
+    if has_competitor:
+        competitor_trend = np.full(n, "", dtype=object)
+        competitor_trend[~matched] = NEW_PRODUCT_LABEL
+
+        if prev_has_competitor:
+            current_comp = pd.to_numeric(current_df[COMPETITOR_PRICE_COLUMN], errors="coerce").to_numpy(dtype=float)[matched]
+            prev_comp = pd.to_numeric(merged["_prev_" + COMPETITOR_PRICE_COLUMN], errors="coerce").to_numpy(dtype=float)[matched]
+            has_current = ~np.isnan(current_comp)
+            has_prev = ~np.isnan(prev_comp)
+
+            labels = np.full(len(current_comp), "No competitors", dtype=object)
+            both = has_current & has_prev
+            competitor_delta = np.round(current_comp[both] - prev_comp[both], 2)
+            labels[both] = _price_delta_labels(competitor_delta)
+            labels[has_current & ~has_prev] = "New competitor"
+            labels[~has_current & has_prev] = "No competitors now"
+            competitor_trend[matched] = labels
+            diff["competitor_delta"][np.flatnonzero(matched)[both]] = competitor_delta
+
+        diff["competitor_trend"] = competitor_trend
+
+    return diff
+
+
+def apply_snapshot_diff(current_df, diff):
+    """Return a copy of current_df with the "Trend" (and "Competitor Trend") columns of a diff added."""
+    df = current_df.copy()
+    df["Trend"] = diff["trend"]
+    if diff["competitor_trend"] is not None:
+        df["Competitor Trend"] = diff["competitor_trend"]
+    return df
+
+
+def compute_trends(current_df, prev_df):
+    """
+    Compare a snapshot with the previous one (see compute_snapshot_diff).
+
+    Args:
+        current_df: DataFrame with the current snapshot
+        prev_df: DataFrame with the previous snapshot (may be None or empty)
+
+    Returns:
+        tuple: (DataFrame with "Trend"/"Competitor Trend" columns added, dict of summary counts)
+    """
+    diff = compute_snapshot_diff(current_df, prev_df)
+    return apply_snapshot_diff(current_df, diff), diff["summary"]
@@ -0,0 +1,149 @@
+import asyncio
+import random
+import time
+
+from api.utils.lazy_import import lazy_import
+from api.utils.metrics import SIZE_BUCKETS, counter, histogram, record_stage
+
+httpx = lazy_import("httpx")
+
+# HTTP status codes worth retrying: throttling and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+UPSTREAM_RESPONSES = counter("sanvivo_upstream_responses", "Upstream responses by status code (or transport error)", ["status"])
+UPSTREAM_RETRIES = counter("sanvivo_upstream_retries", "Upstream requests retried after a transient failure")
+UPSTREAM_PAYLOAD_BYTES = histogram("sanvivo_upstream_payload_bytes", "Size of the upstream response bodies received", buckets=SIZE_BUCKETS)
+
+
+class UpstreamResponse:
+    """Parse result of an upstream response (None if it was served from a 304), plus whether it was."""
+
+    def __init__(self, body, not_modified):
+        self.body = body
+        self.not_modified = not_modified
+
+
+class UpstreamClient:
+    """
+    Async client for the DrAnsay products endpoint.
+
+    Keeps one pooled keep-alive session per event loop, retries transient
+    failures with jittered exponential backoff and sends conditional requests
+    (If-None-Match / If-Modified-Since), so an unchanged catalogue comes back
+    as a cheap 304 and the caller reuses its previous parse.
+    """
+
+    def __init__(self, url, headers, timeout=30.0, max_retries=3, backoff=0.5, max_connections=10):
+        """
+        Args:
+            url: Upstream endpoint URL
+            headers: Headers sent with every request (e.g. the API key)
+            timeout: Read/write timeout in seconds (connecting is capped at 10s)
+            max_retries: Retries after the first attempt for transient failures
+            backoff: Base delay in seconds for the exponential backoff
+            max_connections: Size of the connection pool
+        """
+        self.url = url
+        self.headers = dict(headers)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._client = None
+        self._client_loop = None
+        self._etag = None
+        self._last_modified = None
+
+    def _session(self):
+        """Return the pooled session, creating it for the running event loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 10.0)),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+            self._client_loop = loop
+        return self._client
+
+    def _conditional_headers(self, revalidate):
+        headers = dict(self.headers)
+        if revalidate:
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified:
+                headers["If-Modified-Since"] = self._last_modified
+        return headers
+
+    def _retry_delay(self, attempt):
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    async def fetch_parsed(self, make_parser, revalidate=True):
+        """
+        GET the upstream URL and parse the body incrementally as it arrives.
+
+        The body is never held in memory as a whole: each received chunk is fed to
+        the parser (in the default executor, so parsing doesn't stall the event loop).
+        A failed attempt is retried with a fresh parser.
+
+        Args:
+            make_parser: Called once per attempt; returns an object with feed(bytes) and close() -> result
+            revalidate: Send the validators of the last parsed response, because the caller
+                still holds its result (a 304 then returns no body)
+
+        Returns:
+            UpstreamResponse: `body` is the parser's result, or None if `not_modified`
+
+        Raises:
+            httpx.HTTPError: If the request still fails after all retries
+            ValueError: If the parser rejects the body
+        """
+        session = self._session()
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            # Parsing overlaps the download, so the time spent in the parser is measured
+            # separately and the upstream stage gets the remainder
+            parse_seconds = 0.0
+            received = 0
+            try:
+                async with session.stream("GET", self.url, headers=self._conditional_headers(revalidate)) as response:
+                    UPSTREAM_RESPONSES.inc(status=response.status_code)
+                    if response.status_code == 304 and revalidate:
+                        record_stage("upstream_fetch", time.perf_counter() - start, status=304)
+                        return UpstreamResponse(None, not_modified=True)
+                    response.raise_for_status()
+                    parser = make_parser()
+                    async for chunk in response.aiter_bytes():
+                        received += len(chunk)
+                        parse_start = time.perf_counter()
+                        await loop.run_in_executor(None, parser.feed, chunk)
+                        parse_seconds += time.perf_counter() - parse_start
+                    parse_start = time.perf_counter()
+                    result = await loop.run_in_executor(None, parser.close)
+                    parse_seconds += time.perf_counter() - parse_start
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.TransportError):
+                    UPSTREAM_RESPONSES.inc(status="error")
+                retryable = isinstance(e, httpx.TransportError) or e.response.status_code in RETRYABLE_STATUS_CODES
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                UPSTREAM_RETRIES.inc()
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+
+            self._etag = response.headers.get("ETag")
+            self._last_modified = response.headers.get("Last-Modified")
+            UPSTREAM_PAYLOAD_BYTES.observe(received)
+            record_stage("upstream_fetch", time.perf_counter() - start - parse_seconds, status=response.status_code, bytes=received)
+            record_stage("parse", parse_seconds, rows=len(result) if hasattr(result, "__len__") else None)
+            return UpstreamResponse(result, not_modified=False)
+
+    async def aclose(self):
+        """Close the pooled session."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
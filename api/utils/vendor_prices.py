@@ -0,0 +1,162 @@
+import threading
+
+from api.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+SUMMARY_COLUMNS = ["id", "Sorte", "Kultivar", "Pharmacy ID", "Price (€/g)", "Best Competitor", "Best Competitor Price (€/g)"]
+
+
+class VendorPrices:
+    """
+    Every vendor's price of every product in one catalogue, as columns.
+
+    Prices are rows of (product index, vendor code, price) in payload order.
+    Vendor codes index `vendor_ids`, so restricting to a pharmacy group is a
+    lookup of each row's code in a boolean table with one entry per vendor;
+    views of a group (cheapest and best competitor per product) are computed
+    from that index without touching the payload again and memoized per group.
+    """
+
+    def __init__(self, product_ids, product_names, kultivars, vendor_ids, row_product, row_vendor, price):
+        """
+        Args:
+            product_ids, product_names, kultivars: Object arrays with one entry per product
+            vendor_ids: Object array of vendor IDs; a row's vendor code indexes it
+            row_product: Product index of every price (int32)
+            row_vendor: Vendor code of every price (int32)
+            price: Price in €/g of every row (float64)
+        """
+        self.product_ids = product_ids
+        self.product_names = product_names
+        self.kultivars = kultivars
+        self.vendor_ids = vendor_ids
+        self.row_product = row_product
+        self.row_vendor = row_vendor
+        self.price = price
+        self._vendor_codes = {vendor_id: code for code, vendor_id in enumerate(vendor_ids)}
+        self._summaries = {}
+        self._summaries_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Shared between worker processes without the memoized group summaries
+        state = self.__dict__.copy()
+        del state["_summaries"], state["_summaries_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._summaries = {}
+        self._summaries_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.price)
+
+    def vendor_mask(self, pharmacy_ids):
+        """Boolean array over vendor codes, True for the vendors in `pharmacy_ids`."""
+        mask = np.zeros(len(self.vendor_ids), dtype=bool)
+        codes = [self._vendor_codes[pharmacy_id] for pharmacy_id in pharmacy_ids if pharmacy_id in self._vendor_codes]
+        mask[codes] = True
+        return mask
+
+    def summary(self, pharmacies, own_pharmacy_id=None):
+        """
+        Cheapest and best competitor price per product among a group of pharmacies.
+
+        Args:
+            pharmacies: Mapping of pharmacy ID to display name
+            own_pharmacy_id: Pharmacy left out of the best competitor
+
+        Returns:
+            DataFrame: One row per product listed by any of the pharmacies (SUMMARY_COLUMNS),
+            sorted by price. Ties go to the pharmacy listed first in the payload.
+        """
+        key = (tuple(sorted(pharmacies.items())), own_pharmacy_id)
+        with self._summaries_lock:
+            cached = self._summaries.get(key)
+        if cached is None:
+            cached = self._summary(pharmacies, own_pharmacy_id)
+            with self._summaries_lock:
+                self._summaries[key] = cached
+        return cached.copy()
+
+    def _summary(self, pharmacies, own_pharmacy_id):
+        rows = np.flatnonzero(self.vendor_mask(pharmacies)[self.row_vendor])
+        if not len(rows):
+            return pd.DataFrame(columns=SUMMARY_COLUMNS)
+        product = self.row_product[rows]
+        vendor = self.row_vendor[rows]
+        price = self.price[rows]
+
+        # Rows sorted by product, then price; the stable sort keeps payload order among equal prices
+        order = np.lexsort((price, product))
+        product, vendor, price = product[order], vendor[order], price[order]
+        first = np.r_[True, product[1:] != product[:-1]]
+        products = product[first]
+
+        competitor_price = np.full(len(products), np.nan)
+        competitor_vendor = np.full(len(products), -1)
+        own_code = self._vendor_codes.get(own_pharmacy_id, -1)
+        competing = vendor != own_code
+        competitor_product = product[competing]
+        if len(competitor_product):
+            first_competitor = np.r_[True, competitor_product[1:] != competitor_product[:-1]]
+            positions = np.searchsorted(products, competitor_product[first_competitor])
+            competitor_price[positions] = price[competing][first_competitor]
+            competitor_vendor[positions] = vendor[competing][first_competitor]
+
+        names = np.array([pharmacies.get(vendor_id, vendor_id) for vendor_id in self.vendor_ids], dtype=object)
+        has_competitor = competitor_vendor >= 0
+        df = pd.DataFrame({
+            "id": self.product_ids[products],
+            "Sorte": self.product_names[products],
+            "Kultivar": self.kultivars[products],
+            "Pharmacy ID": names[vendor[first]],
+            "Price (€/g)": price[first],
+            "Best Competitor": np.where(has_competitor, names[competitor_vendor], None),
+            # If no competitors found or only our own pharmacy has this product
+            "Best Competitor Price (€/g)": competitor_price,
+        })
+        return df.sort_values(by="Price (€/g)").reset_index(drop=True)
+
+    def detailed_columns(self, names, pharmacy_ids=None):
+        """
+        Detailed price rows for storage.
+
+        Args:
+            names: Mapping of pharmacy ID to display name; other vendors are named by their ID
+            pharmacy_ids: Only include these vendors (None for all)
+
+        Returns:
+            dict: product_id, product_name, kultivar, pharmacy_id, pharmacy_name and price arrays
+        """
+        rows = slice(None) if pharmacy_ids is None else np.flatnonzero(self.vendor_mask(pharmacy_ids)[self.row_vendor])
+        product = self.row_product[rows]
+        vendor = self.row_vendor[rows]
+        vendor_names = np.array([names.get(vendor_id, vendor_id) for vendor_id in self.vendor_ids], dtype=object)
+        return {
+            "product_id": self.product_ids[product],
+            "product_name": self.product_names[product],
+            "kultivar": self.kultivars[product],
+            "pharmacy_id": self.vendor_ids[vendor],
+            "pharmacy_name": vendor_names[vendor],
+            "price": self.price[rows],
+        }
+
+    def vendors(self, names=None):
+        """
+        Every vendor in the catalogue with how many products it lists.
+
+        Returns:
+            DataFrame: pharmacy_id, pharmacy_name (from `names`, else None) and product_count,
+            most products first
+        """
+        names = names or {}
+        counts = np.bincount(self.row_vendor, minlength=len(self.vendor_ids))
+        df = pd.DataFrame({
+            "pharmacy_id": self.vendor_ids,
+            "pharmacy_name": [names.get(vendor_id) for vendor_id in self.vendor_ids],
+            "product_count": counts,
+        })
+        return df.sort_values("product_count", ascending=False, kind="stable").reset_index(drop=True)
@@ -0,0 +1,96 @@
+"""
+Compare a bucketed chart series from the rollup tables with pulling the raw history.
+
+Simulates months of polling for products listed by nine pharmacies, then
+fetches one product's series per pharmacy both ways through the API:
+/api/prices/aggregates (per resolution, capped at --max-points per series)
+and every page of /api/prices/pharmacy-history. Also reports how much of the
+ingest time goes into keeping the rollups up to date.
+
+Usage:
+    python -m benchmarks.bench_aggregates [--days 90] [--polls-per-day 24] [--products 20] [--max-points 500]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+
+from api.database import db_handler
+from api.main import app
+from benchmarks.bench_change_storage import simulate
+
+
+def timed(func):
+    """Wrap func so its cumulative run time is collected in wrapper.seconds."""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            wrapper.seconds += time.perf_counter() - start
+    wrapper.seconds = 0.0
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--polls-per-day", type=int, default=24)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--max-points", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "aggregates.db")
+        db_handler.init_db()
+
+        add_to_rollups = db_handler._add_to_rollups = timed(db_handler._add_to_rollups)
+        start = time.perf_counter()
+        captures = 0
+        for timestamp, columns in simulate(args.days, args.polls_per_day, args.products, 9, 0.05, 0.002):
+            db_handler.save_detailed_prices_bulk(columns, timestamp)
+            captures += 1
+        ingest = time.perf_counter() - start
+        print(f"ingest: {captures} captures, {ingest / captures * 1000:.2f}ms per capture, "
+              f"of which rollups {add_to_rollups.seconds / captures * 1000:.2f}ms")
+
+        product = "product-1"
+        # Without the startup event, so the snapshot scheduler stays off
+        client = TestClient(app)
+        start = time.perf_counter()
+        raw_bytes = 0
+        raw_rows = 0
+        cursor = None
+        while True:
+            params = {"product_id": product, "limit": 10000}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/api/prices/pharmacy-history", params=params)
+            raw_bytes += len(response.content)
+            body = response.json()
+            raw_rows += len(body["data"])
+            cursor = body["next_cursor"]
+            if not cursor:
+                break
+        raw_time = time.perf_counter() - start
+        print(f"\n{'source':<22} {'points':>8} {'bytes':>12} {'time':>10}")
+        print(f"{'raw history':<22} {raw_rows:>8,} {raw_bytes:>12,} {raw_time * 1000:>8.1f}ms")
+
+        for resolution in db_handler.ROLLUP_RESOLUTIONS:
+            params = {"product_id": product, "resolution": resolution, "max_points": args.max_points}
+            start = time.perf_counter()
+            response = client.get("/api/prices/aggregates", params=params)
+            elapsed = time.perf_counter() - start
+            series = response.json()["series"]
+            points = sum(len(entry["points"]) for entry in series)
+            buckets = sum(entry["bucket_count"] for entry in series)
+            label = f"aggregates ({resolution})"
+            print(f"{label:<22} {points:>8,} {len(response.content):>12,} {elapsed * 1000:>8.1f}ms"
+                  f"   {len(series)} series, {buckets:,} buckets")
+        db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Show that a slow upstream fetch no longer blocks other endpoints.
+
+Starts a local stub of the DrAnsay endpoint with injected latency, requests
+/api/prices/current through the ASGI app and, while that fetch is in flight,
+polls /api/prices/timestamps on the same event loop. A second fetch after the
+forced capture checks that an unchanged catalogue is revalidated with a 304.
+
+Usage:
+    python -m benchmarks.bench_async_upstream [--latency 1.5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stub_upstream import StubUpstream, make_catalogue
+
+
+async def poll_while(task, client, path, interval):
+    """Request `path` repeatedly until `task` finishes; return the latencies in seconds."""
+    latencies = []
+    while not task.done():
+        start = time.perf_counter()
+        response = await client.get(path)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=1.5)
+    parser.add_argument("--interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DRANSAY_API_KEY", "benchmark")
+
+    with StubUpstream(make_catalogue(), latency=args.latency) as stub:
+        from api.database import db_handler
+        from api.main import app
+        from api.utils import data_fetcher
+        from api.utils.scheduler import snapshot_scheduler
+        data_fetcher.upstream_client.url = stub.url
+
+        async def run():
+            async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+                fetch = asyncio.ensure_future(client.get("/api/prices/current"))
+                latencies = await poll_while(fetch, client, "/api/prices/timestamps", args.interval)
+                (await fetch).raise_for_status()
+
+                # Force a new capture; the unchanged catalogue should come back as a 304
+                await snapshot_scheduler.run_once()
+            await data_fetcher.upstream_client.aclose()
+            return latencies
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_handler.DB_PATH = os.path.join(tmp, "bench.db")
+            db_handler.init_db()
+            latencies = asyncio.run(run())
+
+    print(f"upstream latency {args.latency:.2f}s: /timestamps answered {len(latencies)} times while /current was in flight")
+    print(f"  median {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms")
+    print(f"  upstream requests: {stub.hits}, revalidated with 304: {stub.not_modified}")
+    if max(latencies) > args.latency / 2:
+        raise SystemExit("/timestamps was blocked by the upstream fetch")
+    if stub.not_modified != 1:
+        raise SystemExit("expected the second fetch to be answered with 304")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Simulate a month of polling and compare full vs. change-only detailed price storage.
+
+Each poll moves a small share of prices and occasionally adds or drops a
+listing. Reports rows written, write time and database size per storage mode,
+and checks that both modes reconstruct the same price history.
+
+Usage:
+    python -m benchmarks.bench_change_storage [--days 30] [--polls-per-day 48] [--products 300]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.database import db_handler
+
+
+def simulate(days, polls_per_day, n_products, n_vendors, change_rate, churn_rate, seed=0):
+    """Yield (timestamp, columns) for every poll of the simulated month."""
+    rng = np.random.default_rng(seed)
+    product = np.repeat(np.arange(n_products), n_vendors)
+    vendor = np.tile(np.arange(n_vendors), n_products)
+    product_ids = np.array([f"product-{i}" for i in product], dtype=object)
+    product_names = np.array([f"Strain {i}" for i in product], dtype=object)
+    vendor_ids = np.array([f"pharmacy-{i}" for i in vendor], dtype=object)
+    vendor_names = np.array([f"Pharmacy {i}" for i in vendor], dtype=object)
+
+    cents = rng.integers(500, 2000, size=len(product))
+    listed = rng.random(len(product)) < 0.8
+    start = datetime.datetime(2024, 1, 1)
+    step = datetime.timedelta(days=1) / polls_per_day
+
+    for poll in range(days * polls_per_day):
+        moved = rng.random(len(cents)) < change_rate
+        cents[moved] = np.clip(cents[moved] + rng.integers(-100, 100, size=moved.sum()), 100, None)
+        flipped = rng.random(len(cents)) < churn_rate
+        listed[flipped] = ~listed[flipped]
+
+        timestamp = (start + poll * step).strftime("%Y-%m-%d %H:%M:%S")
+        yield timestamp, {
+            "product_id": product_ids[listed],
+            "product_name": product_names[listed],
+            "pharmacy_id": vendor_ids[listed],
+            "pharmacy_name": vendor_names[listed],
+            "price": cents[listed] / 100.0,
+        }
+
+
+def run_mode(mode, path, args):
+    db_handler.DETAILED_PRICE_STORAGE = mode
+    db_handler.DB_PATH = path
+    db_handler.init_db()
+
+    rows_written = 0
+    start = time.perf_counter()
+    polls = simulate(args.days, args.polls_per_day, args.products, args.vendors, args.change_rate, args.churn_rate)
+    for timestamp, columns in polls:
+        result = db_handler.save_detailed_prices_bulk(columns, timestamp)
+        rows_written += result["inserted"] + result["replaced"]
+    elapsed = time.perf_counter() - start
+
+    conn = db_handler.get_connection_manager().writer()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    history = pd.DataFrame(db_handler.get_pharmacy_price_history(product_id="product-0")[0])
+    db_handler.get_connection_manager().close()
+    return rows_written, elapsed, os.path.getsize(path), history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--polls-per-day", type=int, default=48)
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--vendors", type=int, default=6)
+    parser.add_argument("--change-rate", type=float, default=0.02, help="Share of prices that move per poll")
+    parser.add_argument("--churn-rate", type=float, default=0.001, help="Share of listings added/dropped per poll")
+    args = parser.parse_args()
+
+    polls = args.days * args.polls_per_day
+    print(f"{polls} polls, {args.products} products x {args.vendors} pharmacies")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("full", "changes"):
+            results[mode] = run_mode(mode, os.path.join(tmp, f"{mode}.db"), args)
+
+    full_rows, full_time, full_size, full_history = results["full"]
+    print(f"{'mode':<9} {'rows written':>13} {'write time':>11} {'db size':>10}")
+    for mode, (rows, elapsed, size, _) in results.items():
+        print(f"{mode:<9} {rows:>13,} {elapsed:>10.1f}s {size / 2**20:>8.1f}MB")
+    changes_rows, _, changes_size, changes_history = results["changes"]
+    print(f"change-only storage writes {full_rows / changes_rows:.1f}x fewer rows "
+          f"and uses {full_size / changes_size:.1f}x less space")
+
+    columns = ["timestamp", "product_id", "pharmacy_id", "price"]
+    full_history = full_history[columns].sort_values(columns).reset_index(drop=True)
+    changes_history = changes_history[columns].sort_values(columns).reset_index(drop=True)
+    if not full_history.equals(changes_history):
+        raise SystemExit("reconstructed history differs between storage modes")
+    print(f"reconstructed history identical ({len(full_history)} points for product-0)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare building a multi-snapshot comparison from one /compare request with one /historical request per snapshot.
+
+Stores a price history of generated catalogues (one capture per day, with
+its detailed prices), then times a week-over-week comparison of the last
+--snapshots weekly points through the ASGI app: a single
+/api/prices/compare?stride=1w request served from the price cube, the same
+request read from the stored snapshots (cube disabled), and one uncached
+/api/prices/historical/{timestamp} request per selected snapshot (what the
+frontend had to do before). Also checks that the price matrix matches the
+historical responses.
+
+Usage:
+    python -m benchmarks.bench_compare [--products 5000] [--snapshots 50] [--repeat 3]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--snapshots", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    from api.database import db_handler
+    from api.main import app, historical_cache
+    from api.utils.data_fetcher import diff_against_previous, parse_product_payload
+    from benchmarks.stub_upstream import CatalogueGenerator
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "bench.db")
+        db_handler.init_db()
+
+        # Daily captures, so a weekly stride skips six of every seven
+        generator = CatalogueGenerator(args.products, volatility=0.05, churn=0.005)
+        days = 7 * (args.snapshots - 1) + 1
+        start = datetime.datetime(2024, 1, 1, 9)
+        began = time.perf_counter()
+        for day in range(days):
+            timestamp = (start + datetime.timedelta(days=day)).strftime("%Y-%m-%d %H:%M:%S")
+            summary, detailed = parse_product_payload(generator.catalogue() if day == 0 else generator.advance())
+            db_handler.save_to_db(summary, timestamp, diff_against_previous(summary, timestamp))
+            db_handler.save_detailed_prices(detailed, timestamp)
+        print(f"Stored {days} daily snapshots of {args.products:,} products in {time.perf_counter() - began:.1f}s")
+
+        client = TestClient(app)
+        db_handler.get_price_cube()
+        cube_times, stored_times, single_times = [], [], []
+        for _ in range(args.repeat):
+            for times, cube in ((cube_times, True), (stored_times, False)):
+                db_handler.PRICE_CUBE_ENABLED = cube
+                began = time.perf_counter()
+                response = client.get("/api/prices/compare", params={"stride": "1w", "base": "first"})
+                times.append(time.perf_counter() - began)
+                response.raise_for_status()
+            db_handler.PRICE_CUBE_ENABLED = True
+            comparison = response.json()
+
+            historical_cache.invalidate()
+            began = time.perf_counter()
+            snapshots = [client.get(f"/api/prices/historical/{timestamp}").json()["data"] for timestamp in comparison["timestamps"]]
+            single_times.append(time.perf_counter() - began)
+
+        # The matrix holds the same prices as the snapshots read one by one
+        ids = [row["id"] for row in comparison["data"]]
+        prices = np.array(comparison["prices"], dtype=float)
+        for column, snapshot in enumerate(snapshots):
+            listed = {}
+            for row in snapshot:
+                listed.setdefault(row["id"], row["Price (€/g)"])
+            expected = np.array([listed.get(product_id, np.nan) for product_id in ids], dtype=float)
+            assert np.allclose(prices[:, column], expected, equal_nan=True), "price matrix differs from /historical"
+        db_handler.get_connection_manager().close()
+
+    print(f"{len(comparison['timestamps'])} weekly snapshots, {len(ids):,} products, {len(response.content) / 2**20:.1f} MiB")
+    print(f"  /compare from the price cube:        {min(cube_times) * 1000:>8.0f}ms")
+    print(f"  /compare from the stored snapshots:  {min(stored_times) * 1000:>8.0f}ms")
+    print(f"  one /historical per snapshot:        {min(single_times) * 1000:>8.0f}ms "
+          f"({min(single_times) / min(cube_times):.0f}x the cube)")
+
+
+if __name__ == "__main__":
+    main()
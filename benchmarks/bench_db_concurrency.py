@@ -0,0 +1,112 @@
+"""
+Stress the database layer with many concurrent readers and one writer.
+
+One thread keeps saving snapshots and detailed prices while reader threads
+call the functions behind the GET endpoints. Reports throughput and every
+error raised (e.g. "database is locked"); exits non-zero if any occurred.
+
+Usage:
+    python -m benchmarks.bench_db_concurrency [--readers 16] [--seconds 10]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from api.database import db_handler
+
+
+def make_snapshot(rng, n_products):
+    return pd.DataFrame({
+        "id": [f"product-{i}" for i in range(n_products)],
+        "Sorte": [f"Strain {i}" for i in range(n_products)],
+        "Kultivar": "",
+        "Pharmacy ID": "sanvivo",
+        "Price (€/g)": rng.integers(500, 2000, size=n_products) / 100.0,
+        "Best Competitor": "Asavita",
+        "Best Competitor Price (€/g)": rng.integers(500, 2000, size=n_products) / 100.0,
+    })
+
+
+def make_detailed(rng, n_products, pharmacies=("a", "b", "c", "d", "e")):
+    return [
+        {"product_id": f"product-{i}", "product_name": f"Strain {i}", "pharmacy_id": pharmacy,
+         "pharmacy_name": pharmacy, "price": float(rng.integers(500, 2000)) / 100.0}
+        for i in range(n_products) for pharmacy in pharmacies
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--products", type=int, default=500)
+    args = parser.parse_args()
+
+    ops = Counter()
+    errors = Counter()
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def record(kind, func, *func_args):
+        try:
+            # save_detailed_prices reports failures by returning False instead of raising
+            if func(*func_args) is False:
+                raise RuntimeError(f"{func.__name__} returned False")
+            with lock:
+                ops[kind] += 1
+        except Exception as e:
+            with lock:
+                errors[f"{kind}: {e}"] += 1
+
+    def writer():
+        rng = np.random.default_rng(0)
+        tick = 0
+        while not stop.is_set():
+            tick += 1
+            timestamp = f"2024-01-01 00:{tick // 60 % 60:02d}:{tick % 60:02d}.{tick}"
+            record("save_to_db", db_handler.save_to_db, make_snapshot(rng, args.products))
+            record("save_detailed_prices", db_handler.save_detailed_prices, make_detailed(rng, args.products), timestamp)
+
+    def reader(seed):
+        product = f"product-{seed % args.products}"
+        while not stop.is_set():
+            record("get_all_timestamps", db_handler.get_all_timestamps)
+            timestamps = db_handler.get_all_timestamps()
+            if timestamps:
+                record("get_data_by_timestamp", db_handler.get_data_by_timestamp, timestamps[0])
+                record("get_most_recent_data_before", db_handler.get_most_recent_data_before, timestamps[0])
+            record("get_pharmacy_price_history", db_handler.get_pharmacy_price_history, product)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "bench.db")
+        db_handler.init_db()
+        db_handler.save_to_db(make_snapshot(np.random.default_rng(1), args.products))
+
+        threads = [threading.Thread(target=writer)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        db_handler.get_connection_manager().close()
+
+    print(f"1 writer, {args.readers} readers, {args.seconds:.0f}s")
+    for kind, count in sorted(ops.items()):
+        print(f"  {kind:<28} {count:>8} ops  {count / args.seconds:>9.1f}/s")
+    if errors:
+        for message, count in errors.most_common():
+            print(f"  ERROR x{count}: {message}")
+        raise SystemExit(1)
+    print("  no errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compare detailed price ingestion throughput: per-row loop vs. bulk executemany.
+
+Usage:
+    python -m benchmarks.bench_detailed_ingest [--rows 200000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.database import db_handler
+
+
+def legacy_save_detailed_prices(data, timestamp):
+    """The original one-execute-per-item loop, kept for comparison."""
+    with db_handler.get_connection_manager().write() as conn:
+        c = conn.cursor()
+        for item in data:
+            c.execute("""
+                INSERT OR REPLACE INTO detailed_price_data
+                (timestamp, product_id, product_name, pharmacy_id, pharmacy_name, price)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                timestamp,
+                item.get("product_id"),
+                item.get("product_name"),
+                item.get("pharmacy_id"),
+                item.get("pharmacy_name"),
+                item.get("price")
+            ))
+
+
+def make_frame(n_rows, n_pharmacies=9, seed=0):
+    rng = np.random.default_rng(seed)
+    n_products = -(-n_rows // n_pharmacies)
+    product = np.repeat(np.arange(n_products), n_pharmacies)[:n_rows]
+    pharmacy = np.tile(np.arange(n_pharmacies), n_products)[:n_rows]
+    return pd.DataFrame({
+        "product_id": [f"product-{i}" for i in product],
+        "product_name": [f"Strain {i}" for i in product],
+        "pharmacy_id": [f"pharmacy-{i}" for i in pharmacy],
+        "pharmacy_name": [f"Pharmacy {i}" for i in pharmacy],
+        "price": rng.integers(500, 2000, size=n_rows) / 100.0,
+    })
+
+
+def timed(func, tmp, name, repeat=3):
+    """Best wall time over `repeat` runs, each against a fresh database; also returns the last result."""
+    best = float("inf")
+    result = None
+    for attempt in range(repeat):
+        db_handler.DB_PATH = os.path.join(tmp, f"{name}-{attempt}.db")
+        db_handler.init_db()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frame = make_frame(args.rows)
+    records = frame.to_dict(orient="records")
+    timestamp = "2024-01-01 00:00:00"
+
+    def reingest():
+        db_handler.save_detailed_prices_bulk(frame, timestamp)
+        return db_handler.save_detailed_prices_bulk(frame, timestamp)
+
+    runs = [
+        ("per-row loop (list of dicts)", lambda: legacy_save_detailed_prices(records, timestamp)),
+        ("bulk (list of dicts)", lambda: db_handler.save_detailed_prices(records, timestamp)),
+        ("bulk (DataFrame)", lambda: db_handler.save_detailed_prices_bulk(frame, timestamp)),
+        ("bulk (NumPy columns)", lambda: db_handler.save_detailed_prices_bulk(
+            {column: frame[column].to_numpy() for column in frame.columns}, timestamp)),
+    ]
+
+    print(f"{args.rows} price points, best of {args.repeat}")
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        for index, (name, run) in enumerate(runs):
+            elapsed, result = timed(run, tmp, f"run{index}", args.repeat)
+            baseline = baseline or elapsed
+            report = f"  {result}" if isinstance(result, dict) else ""
+            print(f"  {name:<30} {elapsed:>7.2f}s  {args.rows / elapsed:>10.0f} rows/s  {baseline / elapsed:>5.1f}x{report}")
+
+        # A second ingest of the same batch and timestamp replaces every row
+        _, result = timed(reingest, tmp, "reingest", 1)
+        print(f"  re-ingest of the same batch: {result}")
+        db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
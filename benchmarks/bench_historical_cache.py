@@ -0,0 +1,132 @@
+"""
+Measure /api/prices/historical/{timestamp} uncached, cached and revalidated (304).
+
+Stores a series of snapshots, then requests one of them with an empty
+response cache, from the cache, and with If-None-Match. Also checks that a
+rewritten snapshot drops the cached responses from that point on (also when
+another process, like another worker, rewrites it) and that /timestamps and
+/current answer 304 while nothing changed.
+
+Usage:
+    python -m benchmarks.bench_historical_cache [--products 2000] [--snapshots 20] [--repeat 50]
+"""
+import argparse
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from api.database import db_handler
+from api.main import app, historical_cache
+
+
+def make_snapshot(n_products, rng):
+    """A summary DataFrame shaped like the one parse_product_payload returns."""
+    prices = np.round(rng.uniform(5, 15, n_products), 2)
+    competitor = np.where(rng.random(n_products) < 0.8, np.round(prices + rng.normal(0, 1, n_products), 2), np.nan)
+    return pd.DataFrame({
+        "id": [f"product-{i}" for i in range(n_products)],
+        "Sorte": [f"Strain {i}" for i in range(n_products)],
+        "Kultivar": "Kultivar",
+        "Pharmacy ID": "sanvivo",
+        "Price (€/g)": prices,
+        "Best Competitor": np.where(np.isnan(competitor), None, "Asavita"),
+        "Best Competitor Price (€/g)": competitor,
+    })
+
+
+# Replaces the snapshot at argv[1] with new prices, as another worker would
+REWRITE_IN_OTHER_PROCESS = """
+import sys
+import numpy as np
+from api.database import db_handler
+from benchmarks.bench_historical_cache import make_snapshot
+db_handler.save_to_db(make_snapshot(int(sys.argv[2]), np.random.default_rng(1)), sys.argv[1])
+"""
+
+
+def median_ms(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--snapshots", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "historical.db")
+        db_handler.init_db()
+        start = datetime.datetime(2024, 1, 1)
+        timestamps = [(start + datetime.timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S") for i in range(args.snapshots)]
+        for timestamp in timestamps:
+            db_handler.save_to_db(make_snapshot(args.products, rng), timestamp)
+
+        # Without the startup event, so the snapshot scheduler stays off
+        client = TestClient(app)
+        url = f"/api/prices/historical/{timestamps[-1]}"
+
+        def uncached():
+            historical_cache.invalidate()
+            return client.get(url)
+
+        response = uncached()
+        assert response.status_code == 200 and response.headers["Cache-Control"].endswith("immutable")
+        etag = response.headers["ETag"]
+        assert client.get(url).headers["ETag"] == etag, "ETag must be stable"
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+        print(f"response size {len(response.content):,} bytes")
+        print(f"{'uncached':<12} {median_ms(uncached, args.repeat):>8.2f}ms")
+        print(f"{'cached':<12} {median_ms(lambda: client.get(url), args.repeat):>8.2f}ms")
+        print(f"{'304':<12} {median_ms(lambda: client.get(url, headers={'If-None-Match': etag}), args.repeat):>8.2f}ms")
+
+        # Rewriting a point in time drops that response and every later one, but not earlier ones
+        for timestamp in timestamps:
+            client.get(f"/api/prices/historical/{timestamp}")
+        middle = timestamps[len(timestamps) // 2]
+        db_handler.save_to_db(make_snapshot(args.products, rng), middle)
+        cached = [timestamp for timestamp in timestamps if historical_cache.get((timestamp, "records")) is not None]
+        assert cached == [timestamp for timestamp in timestamps if timestamp < middle], cached
+        assert client.get(f"/api/prices/historical/{middle}").headers["ETag"] != etag
+        print(f"rewrite of {middle} invalidated {len(timestamps) - len(cached)} of {len(timestamps)} cached responses")
+
+        # A rewrite by another process is noticed on the next request
+        for timestamp in timestamps:
+            client.get(f"/api/prices/historical/{timestamp}")
+        # The snapshot after the rewritten one compares with it, so its trend changes
+        following = timestamps[timestamps.index(middle) + 1]
+        before = client.get(f"/api/prices/historical/{following}").headers["ETag"]
+        subprocess.run([sys.executable, "-c", REWRITE_IN_OTHER_PROCESS, middle, str(args.products)], check=True,
+                       env={**os.environ, "SANVIVO_DB_PATH": db_handler.DB_PATH})
+        assert client.get(f"/api/prices/historical/{following}").headers["ETag"] != before
+        cached = [timestamp for timestamp in timestamps if historical_cache.get((timestamp, "records")) is not None]
+        assert cached == [timestamp for timestamp in timestamps if timestamp < middle] + [following], cached
+        print(f"rewrite of {middle} by another process invalidated the same responses here")
+
+        listing = client.get("/api/prices/timestamps")
+        assert client.get("/api/prices/timestamps", headers={"If-None-Match": listing.headers["ETag"]}).status_code == 304
+        db_handler.save_to_db(make_snapshot(args.products, rng), "2030-01-01 00:00:00")
+        assert client.get("/api/prices/timestamps", headers={"If-None-Match": listing.headers["ETag"]}).status_code == 200
+        print("/timestamps: 304 while unchanged, 200 after a new snapshot")
+        print(f"cache: {historical_cache.stats()}")
+        db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Check that the streaming history export keeps memory bounded as the export grows.
+
+Builds price histories of increasing size, then drives
+/api/prices/pharmacy-history/export through the ASGI app with a client that
+discards the body as it arrives. Reports throughput and the Python heap peak
+(tracemalloc) per format, and exits non-zero if the peak grows with the
+export size or a row goes missing.
+
+Usage:
+    python -m benchmarks.bench_history_export [--captures 125 1250] [--sql]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+from api.database import db_handler
+from api.main import app
+from benchmarks.bench_change_storage import simulate
+
+FORMATS = [("ndjson", False), ("csv", False), ("csv", True)]
+
+
+async def export(query):
+    """Request one export and return (status, body bytes, data lines) without keeping the body."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/prices/pharmacy-history/export", "raw_path": b"/api/prices/pharmacy-history/export",
+        "query_string": query.encode("ascii"), "headers": [], "client": ("127.0.0.1", 0), "server": ("test", 80),
+    }
+    state = {"status": None, "bytes": 0, "lines": 0}
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if "gzip=true" in query else None
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            state["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            state["bytes"] += len(chunk)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            state["lines"] += chunk.count(b"\n")
+
+    await app(scope, receive, send)
+    return state
+
+
+def measure(query):
+    """Return (state, heap peak, seconds); timed in a separate run since tracing slows Python down."""
+    start = time.perf_counter()
+    asyncio.run(export(query))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    state = asyncio.run(export(query))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return state, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--captures", type=int, nargs="+", default=[125, 1250])
+    parser.add_argument("--sql", action="store_true", help="Read from SQLite instead of the in-memory price cube")
+    args = parser.parse_args()
+    db_handler.PRICE_CUBE_ENABLED = not args.sql
+
+    print(f"{'rows':>10} {'format':>8} {'bytes':>12} {'rows/s':>10} {'peak':>8}")
+    peaks = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for captures in args.captures:
+            db_handler.DB_PATH = os.path.join(tmp, f"export-{captures}.db")
+            db_handler.init_db()
+            for timestamp, columns in simulate(1, captures, 100, 5, 0.02, 0.001):
+                db_handler.save_detailed_prices_bulk(columns, timestamp)
+            # Load the cube up front so only the reads themselves are measured
+            db_handler.get_price_cube()
+            total = db_handler.get_connection_manager().writer().execute(
+                "SELECT SUM(price_count) FROM detailed_price_captures"
+            ).fetchone()[0]
+
+            for fmt, compressed in FORMATS:
+                query = f"format={fmt}" + ("&gzip=true" if compressed else "")
+                state, peak, elapsed = measure(query)
+                # CSV has a header line
+                rows = state["lines"] - (1 if fmt == "csv" else 0)
+                if state["status"] != 200 or rows != total:
+                    raise SystemExit(f"{query}: status {state['status']}, {rows} of {total} rows")
+                label = fmt + ("+gz" if compressed else "")
+                peaks.setdefault(label, []).append(peak)
+                print(f"{total:>10,} {label:>8} {state['bytes']:>12,} {total / elapsed:>10,.0f} {peak / 2**20:>6.2f}MB")
+            db_handler.get_connection_manager().close()
+
+    for label, values in peaks.items():
+        if max(values) > 2 * min(values):
+            raise SystemExit(f"{label}: export memory grows with export size")
+    print("export memory is bounded across export sizes")
+
+
+if __name__ == "__main__":
+    main()
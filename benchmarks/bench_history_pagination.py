@@ -0,0 +1,88 @@
+"""
+Check that paging through /pharmacy-history keeps memory flat as history grows.
+
+For several history sizes, measures the Python heap peak (tracemalloc) of
+fetching one page, of walking the whole history page by page, and of the old
+approach of loading everything into a DataFrame and converting it to records.
+Exits non-zero if the per-page peak grows with history size.
+
+Usage:
+    python -m benchmarks.bench_history_pagination [--captures 125 625 1250] [--limit 1000] [--sql]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from api.database import db_handler
+from benchmarks.bench_change_storage import simulate
+
+
+def peak_of(func):
+    """Run func and return (result, peak traced bytes, seconds)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def walk_pages(limit):
+    """Consume the full history page by page, keeping only the current page."""
+    pages = 0
+    cursor = None
+    while True:
+        rows, cursor = db_handler.get_pharmacy_price_history(limit=limit, cursor=cursor)
+        pages += 1
+        if not cursor:
+            return pages
+
+
+def load_everything():
+    """The previous endpoint behaviour: the whole history as a DataFrame, then to_dict."""
+    df = pd.DataFrame(db_handler.iter_pharmacy_price_history())
+    return df.to_dict(orient="records")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--captures", type=int, nargs="+", default=[125, 625, 1250])
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--sql", action="store_true", help="Read from SQLite instead of the in-memory price cube")
+    args = parser.parse_args()
+    db_handler.PRICE_CUBE_ENABLED = not args.sql
+
+    print(f"{'history rows':>13} {'page peak':>10} {'page time':>10} {'walk peak':>10} {'pages':>6} {'load-all peak':>14}")
+    page_peaks = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for captures in args.captures:
+            db_handler.DB_PATH = os.path.join(tmp, f"history-{captures}.db")
+            db_handler.init_db()
+            for timestamp, columns in simulate(1, captures, 100, 5, 0.02, 0.001):
+                db_handler.save_detailed_prices_bulk(columns, timestamp)
+            # Load the cube up front so only the reads themselves are measured
+            db_handler.get_price_cube()
+            total = db_handler.get_connection_manager().writer().execute(
+                "SELECT SUM(price_count) FROM detailed_price_captures"
+            ).fetchone()[0]
+
+            _, page_peak, page_time = peak_of(lambda: db_handler.get_pharmacy_price_history(limit=args.limit))
+            pages, walk_peak, _ = peak_of(lambda: walk_pages(args.limit))
+            _, all_peak, _ = peak_of(load_everything)
+            page_peaks.append(page_peak)
+            print(f"{total:>13,} {page_peak / 2**20:>8.2f}MB {page_time * 1000:>8.0f}ms "
+                  f"{walk_peak / 2**20:>8.2f}MB {pages:>6} {all_peak / 2**20:>12.1f}MB")
+            db_handler.get_connection_manager().close()
+
+    if max(page_peaks) > 2 * min(page_peaks):
+        raise SystemExit("per-page memory grows with history size")
+    print("per-page memory is flat across history sizes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Load-test /api/prices/stream with many concurrent subscribers against a local mock upstream.
+
+For each subscriber count, starts `server.py --workers N` on a fresh database
+with a short snapshot interval, pointed at the stub DrAnsay endpoint whose
+prices change every interval, and keeps that many server-sent event streams
+open for a fixed time. Every subscriber applies the deltas it receives to its
+initial snapshot. Reports the events and bytes received, how far apart the
+subscribers received the same delta, and the upstream fetches per capture.
+Fails if a run fetches more than once per snapshot, or more often than the
+run with the fewest subscribers (give or take one capture interval), and
+checks that the table each subscriber rebuilt equals what /api/prices/current
+returns.
+
+Usage:
+    python -m benchmarks.bench_live [--subscribers 1 100 300] [--seconds 20] [--interval 3] [--workers 1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from benchmarks.bench_multi_worker import free_port, wait_ready
+from benchmarks.stub_upstream import CatalogueGenerator, StubUpstream
+
+
+class Subscriber:
+    """One dashboard: the table rebuilt from the stream, and when each event arrived."""
+
+    def __init__(self):
+        self.rows = {}
+        self.timestamp = None
+        self.events = {"snapshot": 0, "delta": 0}
+        self.bytes = 0
+        self.arrivals = {}
+        self.out_of_order = 0
+
+    def apply(self, event, payload):
+        self.events[event] += 1
+        if event == "snapshot":
+            self.rows = {row["id"]: row for row in payload["data"]}
+        else:
+            if payload["previous_timestamp"] != self.timestamp:
+                self.out_of_order += 1
+            for product_id in payload["removed"]:
+                self.rows.pop(product_id, None)
+            self.rows.update((row["id"], row) for row in payload["data"])
+            self.arrivals[payload["timestamp"]] = time.monotonic()
+        self.timestamp = payload["timestamp"]
+
+
+async def subscribe(client, subscriber, ready):
+    async with client.stream("GET", "/api/prices/stream") as response:
+        response.raise_for_status()
+        event = None
+        async for line in response.aiter_lines():
+            subscriber.bytes += len(line) + 1
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                subscriber.apply(event, json.loads(line[6:]))
+                ready.set()
+
+
+async def listen(base_url, subscribers, seconds):
+    """Hold `subscribers` streams open for `seconds`, then return them and the final /current."""
+    limits = httpx.Limits(max_connections=len(subscribers) + 1, max_keepalive_connections=len(subscribers) + 1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=None) as client:
+        events = [asyncio.Event() for _ in subscribers]
+        tasks = [asyncio.ensure_future(subscribe(client, subscriber, ready)) for subscriber, ready in zip(subscribers, events)]
+        connected = time.monotonic()
+        await asyncio.gather(*(ready.wait() for ready in events))
+        connect_seconds = time.monotonic() - connected
+        await asyncio.sleep(seconds)
+        current = (await client.get("/api/prices/current")).json()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return connect_seconds, current
+
+
+def run(count, args, stub):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "live.db")
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = {
+            **os.environ,
+            "SANVIVO_DB_PATH": db_path,
+            "DRANSAY_API_ENDPOINT": stub.url,
+            "DRANSAY_API_KEY": "benchmark",
+            "SNAPSHOT_SCHEDULER_ENABLED": "1",
+            "SNAPSHOT_INTERVAL_SECONDS": str(args.interval),
+            "SNAPSHOT_JITTER_SECONDS": "0",
+            "LIVE_KEEPALIVE_SECONDS": str(min(args.interval, 15)),
+        }
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--workers", str(args.workers), "--host", "127.0.0.1", "--port", str(port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(base_url)
+            hits_before = stub.hits
+            subscribers = [Subscriber() for _ in range(count)]
+            connect_seconds, current = asyncio.run(listen(base_url, subscribers, args.seconds))
+            fetches = stub.hits - hits_before
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        conn = sqlite3.connect(db_path)
+        try:
+            snapshots = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+        finally:
+            conn.close()
+
+    # How long after the first subscriber the last one received each delta
+    spreads = []
+    for timestamp in set().union(*(subscriber.arrivals for subscriber in subscribers)):
+        arrivals = [subscriber.arrivals[timestamp] for subscriber in subscribers if timestamp in subscriber.arrivals]
+        if len(arrivals) == count:
+            spreads.append(max(arrivals) - min(arrivals))
+
+    # Every subscriber that saw the final capture rebuilt exactly the /current table
+    expected = {row["id"]: row for row in current["data"]}
+    compared = [subscriber for subscriber in subscribers if subscriber.timestamp == current["timestamp"]]
+    mismatched = sum(subscriber.rows != expected for subscriber in compared)
+    return {
+        "subscribers": count,
+        "connect_seconds": connect_seconds,
+        "deltas": sum(subscriber.events["delta"] for subscriber in subscribers) / count,
+        "resyncs": sum(subscriber.events["snapshot"] - 1 for subscriber in subscribers),
+        "kib": sum(subscriber.bytes for subscriber in subscribers) / count / 1024,
+        "spread_ms": max(spreads) * 1000 if spreads else 0.0,
+        "snapshots": snapshots,
+        "fetches": fetches,
+        "out_of_order": sum(subscriber.out_of_order for subscriber in subscribers),
+        "compared": len(compared),
+        "mismatched": mismatched,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1, 100, 300])
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--interval", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--products", type=int, default=2000)
+    args = parser.parse_args()
+
+    generator = CatalogueGenerator(args.products, volatility=0.02, churn=0.002)
+    with StubUpstream(generator.catalogue()) as stub:
+        # New prices every capture interval
+        stop = threading.Event()
+
+        def advance():
+            while not stop.wait(args.interval):
+                stub.set_payload(generator.advance())
+
+        threading.Thread(target=advance, daemon=True).start()
+        print(f"{args.products:,} products, snapshot every {args.interval}s, {args.seconds:.0f}s per run, "
+              f"{args.workers} worker(s)")
+        print(f"\n{'subscribers':>11} {'connect':>8} {'deltas':>6} {'KiB/sub':>8} {'spread':>8} {'resyncs':>7} "
+              f"{'snapshots':>9} {'fetches':>7} {'rebuilt ok':>10}")
+        baseline = None
+        try:
+            for count in sorted(args.subscribers):
+                result = run(count, args, stub)
+                print(f"{result['subscribers']:>11} {result['connect_seconds']:>7.2f}s {result['deltas']:>6.1f} "
+                      f"{result['kib']:>8.0f} {result['spread_ms']:>6.0f}ms {result['resyncs']:>7} "
+                      f"{result['snapshots']:>9} {result['fetches']:>7} "
+                      f"{result['compared'] - result['mismatched']:>4}/{result['compared']:<5}")
+                assert result["out_of_order"] == 0, "a delta did not follow the capture the subscriber had"
+                assert result["mismatched"] == 0, "a rebuilt table differs from /current"
+                # One fetch per capture, whatever the number of subscribers
+                assert result["fetches"] <= result["snapshots"], \
+                    f"{result['fetches']} upstream fetches for {result['snapshots']} snapshots"
+                if baseline is None:
+                    baseline = result
+                # A run may span one capture interval more than the smallest one
+                assert result["fetches"] <= baseline["fetches"] + 1, \
+                    f"{count} subscribers caused {result['fetches']} upstream fetches, " \
+                    f"{baseline['subscribers']} caused {baseline['fetches']}"
+        finally:
+            stop.set()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Break a snapshot capture down into its pipeline stages and measure what the instrumentation costs.
+
+Runs several captures against a local stub of the DrAnsay endpoint, with a
+changed catalogue each time so every capture is fetched, parsed, compared and
+stored, then prints the time and rows per stage from the metrics registry, as
+/metrics would expose them. Also times an empty span() and a minimal ASGI
+request with and without MetricsMiddleware, and the rendering of /metrics.
+
+Usage:
+    python -m benchmarks.bench_metrics [--products 5000] [--captures 5] [--requests 2000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+from api.utils.metrics import REGISTRY, STAGE_ROWS, STAGE_SECONDS, MetricsMiddleware, span
+from benchmarks.bench_serialization import median_ms
+from benchmarks.stub_upstream import StubUpstream, make_catalogue
+
+STAGES = ["upstream_fetch", "parse", "trend_analysis", "save_snapshot", "save_detailed_prices", "serialize", "capture"]
+
+
+def stage_totals():
+    """Sum, count and rows per stage, read back from the registry."""
+    totals = {}
+    for suffix, (stage,), _, value in STAGE_SECONDS.samples():
+        if suffix in ("_sum", "_count"):
+            totals.setdefault(stage, {})[suffix] = value
+    for _, (stage,), _, value in STAGE_ROWS.samples():
+        totals.setdefault(stage, {})["rows"] = value
+    return totals
+
+
+def request_us(app, requests):
+    """Mean time per request to `app` through an in-process httpx client, in microseconds."""
+    async def run():
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            await client.get("/ping")
+            start = time.perf_counter()
+            for _ in range(requests):
+                await client.get("/ping")
+            return (time.perf_counter() - start) / requests * 1e6
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--captures", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    # httpx logs every request at INFO, which would dominate the in-process request timings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with StubUpstream(make_catalogue(args.products)) as stub:
+        from api.database import db_handler
+        from api.utils import data_fetcher
+        from api.utils.serialization import frame_to_json
+        data_fetcher.upstream_client.url = stub.url
+        # The API key only has to be present; the stub doesn't check it
+        data_fetcher.API_KEY = data_fetcher.upstream_client.headers["x-api-key"] = data_fetcher.API_KEY or "benchmark"
+
+        async def run():
+            for i in range(args.captures):
+                stub.set_payload(make_catalogue(args.products, seed=i))
+                result = await data_fetcher.capture_price_snapshot()
+                frame_to_json(result["data"], "records")
+            await data_fetcher.upstream_client.aclose()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_handler.DB_PATH = os.path.join(tmp, "bench.db")
+            db_handler.init_db()
+            start = time.perf_counter()
+            with span("capture"):
+                asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            db_handler.get_connection_manager().close()
+
+    totals = stage_totals()
+    print(f"{args.captures} captures of {args.products:,} products in {elapsed:.2f}s")
+    print(f"\n{'stage':<22} {'count':>6} {'mean':>10} {'rows':>10}")
+    for stage in STAGES:
+        total = totals.get(stage)
+        if total and total["_count"]:
+            mean = total["_sum"] / total["_count"] * 1000
+            print(f"{stage:<22} {total['_count']:>6} {mean:>8.1f}ms {total.get('rows', 0):>10,}")
+
+    repeat = 100_000
+
+    def spans():
+        for _ in range(repeat):
+            with span("bench"):
+                pass
+
+    print(f"\nspan(): {median_ms(spans, 3) / repeat * 1000:.2f}µs each")
+
+    async def ping(request):
+        return Response(b"pong")
+
+    app = Starlette(routes=[Route("/ping", ping)])
+    plain = request_us(app, args.requests)
+    instrumented = request_us(MetricsMiddleware(app), args.requests)
+    print(f"ASGI request: {plain:.0f}µs plain, {instrumented:.0f}µs with MetricsMiddleware (+{instrumented - plain:.0f}µs)")
+    print(f"/metrics rendering: {median_ms(REGISTRY.render, 20):.2f}ms for {len(REGISTRY.render()):,} bytes")
+
+
+if __name__ == "__main__":
+    main()
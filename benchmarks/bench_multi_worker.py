@@ -0,0 +1,193 @@
+"""
+Load-test the API in production mode with 1, 2 and 4 worker processes against a local mock upstream.
+
+For each worker count, starts `server.py --workers N` on a fresh database
+with a short snapshot interval, pointed at the stub DrAnsay endpoint, and
+drives /current, /best-competitor and /timestamps from several client
+processes for a fixed time. Reports throughput and latency, then checks the
+database: every capture interval must have produced exactly one snapshot and
+one detailed price capture (no worker ingesting alongside the lease holder),
+and the upstream must have been fetched once per capture.
+
+Throughput can only scale with the number of workers up to the number of
+CPU cores, which is printed first.
+
+Usage:
+    python -m benchmarks.bench_multi_worker [--workers 1 2 4] [--seconds 15] [--interval 3] [--connections 32]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stub_upstream import StubUpstream, make_catalogue
+
+ENDPOINTS = ["/api/prices/current", "/api/prices/best-competitor?format=columnar", "/api/prices/timestamps"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def drive(base_url, seconds, connections):
+    """Send requests from `connections` concurrent loops for `seconds`; return status counts and latencies."""
+    latencies = []
+    statuses = {}
+    deadline = time.monotonic() + seconds
+
+    async def loop(client, offset):
+        i = offset
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                status = (await client.get(ENDPOINTS[i % len(ENDPOINTS)])).status_code
+            except httpx.HTTPError:
+                status = "error"
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            i += 1
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(loop(client, offset) for offset in range(connections)))
+    return {"latencies": latencies, "statuses": statuses}
+
+
+def client(base_url, seconds, connections):
+    """Client process: drive the server and print the results as JSON."""
+    print(json.dumps(asyncio.run(drive(base_url, seconds, connections))))
+
+
+def wait_ready(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/prices/current", timeout=5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+
+def check_database(path, interval, jitter):
+    """Count snapshots and captures and find pairs closer together than one capture interval allows."""
+    conn = sqlite3.connect(path)
+    try:
+        timestamps = [row[0] for row in conn.execute("SELECT timestamp FROM snapshots ORDER BY timestamp")]
+        captures = conn.execute("SELECT COUNT(*) FROM detailed_price_captures").fetchone()[0]
+    finally:
+        conn.close()
+    times = [datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S") for timestamp in timestamps]
+    gaps = [(later - earlier).total_seconds() for earlier, later in zip(times, times[1:])]
+    # Timestamps have one-second resolution; the scheduler never waits less than interval - jitter
+    duplicates = sum(gap < max(1.0, interval - jitter) - 1 for gap in gaps)
+    return {"snapshots": len(timestamps), "captures": captures, "min_gap": min(gaps) if gaps else None, "duplicates": duplicates}
+
+
+def run(workers, args, stub):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "multi_worker.db")
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = {
+            **os.environ,
+            "SANVIVO_DB_PATH": db_path,
+            "DRANSAY_API_ENDPOINT": stub.url,
+            "DRANSAY_API_KEY": "benchmark",
+            "SNAPSHOT_SCHEDULER_ENABLED": "1",
+            "SNAPSHOT_INTERVAL_SECONDS": str(args.interval),
+            "SNAPSHOT_JITTER_SECONDS": str(args.jitter),
+        }
+        hits_before = stub.hits
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(base_url)
+            clients = [
+                subprocess.Popen(
+                    [sys.executable, "-m", "benchmarks.bench_multi_worker", "--client", base_url,
+                     "--seconds", str(args.seconds), "--connections", str(args.connections // args.clients)],
+                    stdout=subprocess.PIPE, text=True,
+                )
+                for _ in range(args.clients)
+            ]
+            results = [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in clients]
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        database = check_database(db_path, args.interval, args.jitter)
+
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    statuses = {}
+    for result in results:
+        for status, count in result["statuses"].items():
+            statuses[status] = statuses.get(status, 0) + count
+    return {
+        "workers": workers,
+        "requests_per_second": len(latencies) / args.seconds,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "statuses": statuses,
+        "upstream_fetches": stub.hits - hits_before,
+        **database,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--interval", type=float, default=3)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--clients", type=int, default=2, help="Client processes sharing the connections")
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.client:
+        client(args.client, args.seconds, args.connections)
+        return
+
+    print(f"CPU cores: {os.cpu_count()}, {args.connections} connections from {args.clients} client processes, "
+          f"{args.seconds:.0f}s per run, snapshot every {args.interval}s")
+    print(f"\n{'workers':>7} {'req/s':>8} {'p50':>8} {'p99':>8} {'statuses':<22} "
+          f"{'snapshots':>9} {'captures':>8} {'fetches':>7} {'min gap':>7} {'duplicates':>10}")
+    failures = []
+    with StubUpstream(make_catalogue(args.products)) as stub:
+        for workers in args.workers:
+            result = run(workers, args, stub)
+            statuses = ", ".join(f"{status}: {count}" for status, count in sorted(result["statuses"].items(), key=str))
+            print(f"{result['workers']:>7} {result['requests_per_second']:>8.0f} {result['p50_ms']:>6.1f}ms "
+                  f"{result['p99_ms']:>6.1f}ms {statuses:<22} {result['snapshots']:>9} {result['captures']:>8} "
+                  f"{result['upstream_fetches']:>7} {result['min_gap'] or 0:>6.0f}s {result['duplicates']:>10}")
+            # Every snapshot and capture comes from its own upstream fetch, at most one per interval
+            if result["duplicates"]:
+                failures.append(f"{workers} workers: {result['duplicates']} snapshot(s) closer together than one interval")
+            for kind in ("snapshots", "captures"):
+                if result[kind] > result["upstream_fetches"]:
+                    failures.append(f"{workers} workers: {result[kind]} {kind} from {result['upstream_fetches']} upstream fetches")
+    if failures:
+        raise SystemExit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Compare peak memory and time of buffering + json.loads + list-of-dicts parsing with the streaming payload parser.
+
+Generates a DrAnsay-shaped catalogue of about 50 MB (every product listed by
+the top pharmacies plus many other vendors), serves it from the local stub
+and fetches it once per mode in a fresh process, reporting that process's
+peak RSS above its baseline after imports. Also times both parsers on the
+in-memory body and checks that they produce the same summary and detailed
+prices.
+
+Usage:
+    python -m benchmarks.bench_payload_parser [--products 20000] [--other-vendors 40]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.stub_upstream import StubUpstream
+
+# Bytes fed to the streaming parser at a time when parsing from memory (httpx reads about this much)
+CHUNK_BYTES = 64 * 1024
+
+
+def make_large_catalogue(n_products, other_vendors, seed=0):
+    """A catalogue whose vendor maps include many pharmacies outside the top list."""
+    from api.utils.pharmacy_groups import TOP_PHARMACY_IDS
+
+    rng = random.Random(seed)
+    top = list(TOP_PHARMACY_IDS)
+    others = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", k=20))
+              for _ in range(other_vendors * 3)]
+    products = []
+    for i in range(n_products):
+        vendor_ids = rng.sample(top, rng.randint(1, len(top))) + rng.sample(others, other_vendors)
+        rng.shuffle(vendor_ids)
+        products.append({
+            "id": f"product-{i}",
+            "sorte": f"Strain {i}",
+            "kultivar": f"Cultivar {i % 50}",
+            "vendors": {vendor_id: {"price": rng.randint(500, 2000), "stock": rng.randint(0, 500)} for vendor_id in vendor_ids},
+        })
+    return {"products": products, "count": n_products}
+
+
+def legacy_parse(data):
+    """The original parse_product_payload: a summary dict and a detailed dict per price, then a DataFrame."""
+    from api.utils.pharmacy_groups import SANVIVO_ID, TOP_PHARMACY_IDS
+    from api.utils.vendor_prices import SUMMARY_COLUMNS
+
+    products_list = data if isinstance(data, list) else data.get('products', [])
+    detailed_prices = []
+    extracted_data = []
+    for product in products_list:
+        product_id = product.get('id')
+        product_name = product.get('sorte')
+        if not product_name or not product_id:
+            continue
+        kultivar = product.get('kultivar', '')
+        vendors = product.get('vendors', {})
+        cheapest_price = float('inf')
+        cheapest_vendor_id = None
+        best_competitor_price = float('inf')
+        best_competitor_id = None
+        for vendor_id, vendor_data in vendors.items():
+            if vendor_id not in TOP_PHARMACY_IDS:
+                continue
+            price_cents = vendor_data.get('price')
+            if price_cents is not None:
+                try:
+                    price_euros = float(price_cents) / 100.0
+                    detailed_prices.append({
+                        "product_id": product_id,
+                        "product_name": product_name,
+                        "kultivar": kultivar,
+                        "pharmacy_id": vendor_id,
+                        "pharmacy_name": TOP_PHARMACY_IDS.get(vendor_id),
+                        "price": price_euros
+                    })
+                    if price_euros < cheapest_price:
+                        cheapest_price = price_euros
+                        cheapest_vendor_id = vendor_id
+                    if vendor_id != SANVIVO_ID and price_euros < best_competitor_price:
+                        best_competitor_price = price_euros
+                        best_competitor_id = vendor_id
+                except (ValueError, TypeError):
+                    continue
+        if cheapest_vendor_id is not None:
+            best_competitor_name = None
+            if best_competitor_id is not None:
+                best_competitor_name = TOP_PHARMACY_IDS.get(best_competitor_id, best_competitor_id)
+            if best_competitor_price == float('inf'):
+                best_competitor_price = None
+            extracted_data.append({
+                "id": product_id,
+                "Sorte": product_name,
+                "Kultivar": kultivar,
+                "Pharmacy ID": TOP_PHARMACY_IDS.get(cheapest_vendor_id, cheapest_vendor_id),
+                "Price (€/g)": cheapest_price,
+                "Best Competitor": best_competitor_name,
+                "Best Competitor Price (€/g)": best_competitor_price
+            })
+    if not extracted_data:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS), detailed_prices
+    df = pd.DataFrame(extracted_data)
+    return df.sort_values(by="Price (€/g)").reset_index(drop=True), detailed_prices
+
+
+def top_pharmacy_views(vendor_prices):
+    """Summary and detailed prices of the built-in top pharmacies, as the legacy parser produced them."""
+    from api.utils.pharmacy_groups import SANVIVO_ID, TOP_PHARMACY_IDS
+
+    return (vendor_prices.summary(TOP_PHARMACY_IDS, SANVIVO_ID),
+            vendor_prices.detailed_columns(TOP_PHARMACY_IDS, TOP_PHARMACY_IDS))
+
+
+def stream_parse(body):
+    """Feed an in-memory body to the streaming parser in CHUNK_BYTES pieces."""
+    from api.utils.data_fetcher import new_payload_parser
+
+    parser = new_payload_parser()
+    view = memoryview(body)
+    for start in range(0, len(body), CHUNK_BYTES):
+        parser.feed(bytes(view[start:start + CHUNK_BYTES]))
+    return top_pharmacy_views(parser.close())
+
+
+def peak_rss_mib():
+    """
+    Peak resident set size of this process so far, in MiB.
+
+    Reads VmHWM, which starts over at exec; ru_maxrss would include the parent's peak before it.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def legacy_fetch(url):
+    """The original buffered fetch: read the whole response body into memory before parsing it."""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.content
+
+
+def worker(mode, url):
+    """Fetch and parse the payload once in this process and print timings and peak RSS as JSON."""
+    from api.utils.data_fetcher import new_payload_parser
+    from api.utils.upstream import UpstreamClient
+
+    baseline = peak_rss_mib()
+
+    async def fetch():
+        if mode == "legacy":
+            return legacy_parse(json.loads(await legacy_fetch(url)))
+        client = UpstreamClient(url, {})
+        try:
+            return top_pharmacy_views((await client.fetch_parsed(new_payload_parser, revalidate=False)).body)
+        finally:
+            await client.aclose()
+
+    start = time.perf_counter()
+    summary, detailed = asyncio.run(fetch())
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": elapsed,
+        "baseline_mib": baseline,
+        "peak_mib": peak_rss_mib(),
+        "products": len(summary),
+        "prices": len(detailed) if isinstance(detailed, list) else len(detailed["price"]),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--other-vendors", type=int, default=40)
+    parser.add_argument("--worker", choices=["legacy", "stream"], help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.url)
+        return
+
+    catalogue = make_large_catalogue(args.products, args.other_vendors)
+    with StubUpstream(catalogue) as stub:
+        del catalogue
+        body = stub.body
+        print(f"payload: {len(body) / 2**20:.1f} MiB, {args.products:,} products")
+
+        # Both parsers agree
+        start = time.perf_counter()
+        legacy_summary, legacy_detailed = legacy_parse(json.loads(body))
+        legacy_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        summary, detailed = stream_parse(body)
+        stream_seconds = time.perf_counter() - start
+        pd.testing.assert_frame_equal(summary, legacy_summary, check_dtype=False)
+        expected = pd.DataFrame(legacy_detailed)
+        for column in expected.columns:
+            assert np.array_equal(detailed[column], expected[column].to_numpy()), column
+        print(f"in-memory parse: json.loads + lists of dicts {legacy_seconds:.2f}s, streaming {stream_seconds:.2f}s "
+              f"({len(summary):,} products, {len(detailed['price']):,} prices, identical output)")
+
+        print(f"\n{'mode':<36} {'fetch+parse':>12} {'baseline RSS':>13} {'peak RSS':>10} {'growth':>10}")
+        for mode, label in [("legacy", "buffer + json.loads + lists of dicts"), ("stream", "streaming parser")]:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_payload_parser", "--worker", mode, "--url", stub.url],
+                check=True, capture_output=True, text=True, env={**os.environ, "SNAPSHOT_SCHEDULER_ENABLED": "0"}
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{label:<36} {result['seconds']:>11.2f}s {result['baseline_mib']:>10.0f}MiB "
+                  f"{result['peak_mib']:>7.0f}MiB {result['peak_mib'] - result['baseline_mib']:>7.0f}MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare switching the compared pharmacy group by reparsing the payload with evaluating the vendor price index.
+
+Generates a DrAnsay-shaped catalogue with the top pharmacies plus many other
+vendors and times, per group size, building the group's summary (cheapest and
+best competitor per product) three ways: parsing the decoded payload again
+with the group as filter (the previous approach), computing it from the
+VendorPrices index built once at ingest, and reading it back from the index's
+per-group memo. Also checks that the index gives the same summary as the
+reparse.
+
+Usage:
+    python -m benchmarks.bench_pharmacy_groups [--products 20000] [--other-vendors 40] [--repeat 5]
+"""
+import argparse
+import json
+import random
+
+import pandas as pd
+
+from api.utils.payload_parser import ProductStreamParser
+from api.utils.pharmacy_groups import SANVIVO_ID, TOP_PHARMACY_IDS
+from benchmarks.bench_payload_parser import legacy_parse, make_large_catalogue
+from benchmarks.bench_serialization import median_ms
+
+
+def filtered_parse(data, pharmacies, own_pharmacy_id):
+    """The previous approach: parse the payload again, keeping only the group's vendors."""
+    import api.utils.pharmacy_groups as pharmacy_groups
+
+    saved = pharmacy_groups.TOP_PHARMACY_IDS, pharmacy_groups.SANVIVO_ID
+    pharmacy_groups.TOP_PHARMACY_IDS, pharmacy_groups.SANVIVO_ID = pharmacies, own_pharmacy_id
+    try:
+        return legacy_parse(data)[0]
+    finally:
+        pharmacy_groups.TOP_PHARMACY_IDS, pharmacy_groups.SANVIVO_ID = saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--other-vendors", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = make_large_catalogue(args.products, args.other_vendors)
+    payload_parser = ProductStreamParser()
+    for product in data["products"]:
+        payload_parser.add_product(product)
+    vendor_prices = payload_parser.result()
+    print(f"{len(vendor_prices.product_ids):,} products, {len(vendor_prices.vendor_ids)} vendors, "
+          f"{len(vendor_prices):,} prices")
+
+    rng = random.Random(1)
+    others = [vendor_id for vendor_id in vendor_prices.vendor_ids if vendor_id not in TOP_PHARMACY_IDS]
+    groups = {"top": dict(TOP_PHARMACY_IDS)}
+    for size in (5, 20, 60):
+        members = rng.sample(others, min(size, len(others)))
+        groups[f"{size} others + own"] = {SANVIVO_ID: "sanvivo", **{vendor_id: vendor_id for vendor_id in members}}
+
+    print(f"\n{'group':<20} {'vendors':>8} {'reparse':>10} {'index':>10} {'memoized':>10}")
+    for name, pharmacies in groups.items():
+        expected = filtered_parse(data, pharmacies, SANVIVO_ID)
+        summary = vendor_prices._summary(pharmacies, SANVIVO_ID)
+        key = ["id", "Pharmacy ID", "Price (€/g)", "Best Competitor", "Best Competitor Price (€/g)"]
+        pd.testing.assert_frame_equal(
+            summary[key].sort_values(["Price (€/g)", "id"]).reset_index(drop=True),
+            expected[key].sort_values(["Price (€/g)", "id"]).reset_index(drop=True),
+            check_dtype=False
+        )
+        vendor_prices.summary(pharmacies, SANVIVO_ID)
+        print(f"{name:<20} {len(pharmacies):>8} "
+              f"{median_ms(lambda: filtered_parse(data, pharmacies, SANVIVO_ID), args.repeat):>8.1f}ms "
+              f"{median_ms(lambda: vendor_prices._summary(pharmacies, SANVIVO_ID), args.repeat):>8.1f}ms "
+              f"{median_ms(lambda: vendor_prices.summary(pharmacies, SANVIVO_ID), args.repeat):>8.1f}ms")
+
+    # What the reparse started from: the decoded payload, or the raw body that had to be decoded first
+    body = json.dumps(data).encode("utf-8")
+    print(f"\n(json.loads of the {len(body) / 2**20:.0f} MiB body, also needed to reparse without the decoded payload: "
+          f"{median_ms(lambda: json.loads(body), args.repeat):.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Compare history and previous-capture lookups on the in-memory price cube with SQLite.
+
+Simulates polling a catalogue of products listed by nine pharmacies, then
+times the same queries against the SQL reconstruction and the price cube,
+reports the cube's build, save and memory-mapped load times, and its memory
+use per million stored changes, next to what a dense capture × product ×
+pharmacy array of the same history would take.
+
+Usage:
+    python -m benchmarks.bench_price_cube [--days 20] [--polls-per-day 48] [--products 300] [--repeat 20]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from api.database import db_handler
+from benchmarks.bench_change_storage import simulate
+
+
+def median_ms(func, repeat):
+    """Median wall time of func over `repeat` runs, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def sql_summary_before(timestamp, competitor_excluded):
+    """The SQL way to get cheapest and best competitor prices at the previous capture."""
+    with db_handler.get_connection_manager().read() as conn:
+        previous = conn.execute(
+            "SELECT MAX(timestamp) FROM detailed_price_captures WHERE timestamp < ?", (timestamp,)
+        ).fetchone()[0]
+        prices = db_handler._prices_as_of(conn, previous, inclusive=True)
+    df = pd.DataFrame(
+        [(key[0], key[1], value[2]) for key, value in prices.items()],
+        columns=["product_id", "pharmacy_id", "price"]
+    )
+    cheapest = df.groupby("product_id")["price"].min()
+    competitor = df[df["pharmacy_id"] != competitor_excluded].groupby("product_id")["price"].min()
+    return pd.concat([cheapest, competitor], axis=1)
+
+
+def with_cube(enabled, func):
+    """Run func with the price cube switched on or off."""
+    def run():
+        db_handler.PRICE_CUBE_ENABLED = enabled
+        try:
+            return func()
+        finally:
+            db_handler.PRICE_CUBE_ENABLED = True
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=20)
+    parser.add_argument("--polls-per-day", type=int, default=48)
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "cube.db")
+        db_handler.init_db()
+        polls = list(simulate(args.days, args.polls_per_day, args.products, 9, 0.02, 0.001))
+        for timestamp, columns in polls:
+            db_handler.save_detailed_prices_bulk(columns, timestamp)
+
+        start = time.perf_counter()
+        cube = db_handler.get_price_cube()
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        db_handler.save_price_cube()
+        save = time.perf_counter() - start
+        cube.invalidate()
+        start = time.perf_counter()
+        db_handler.get_price_cube()
+        load = time.perf_counter() - start
+
+        usage = cube.memory_usage()
+        print(f"cube: {usage['captures']:,} captures x {usage['products']:,} products x {usage['pharmacies']} pharmacies, "
+              f"{usage['price_points']:,} price points from {usage['changes']:,} stored changes")
+        print(f"      build {build:.2f}s, save {save:.2f}s, memory-mapped load {load * 1000:.1f}ms")
+        print(f"      {usage['bytes_used'] / 2**20:.2f} MiB used ({usage['bytes_used'] / usage['changes'] * 1e6 / 2**20:.1f} MiB "
+              f"per million stored changes); a dense capture x product x pharmacy array would take "
+              f"{usage['dense_bytes'] / 2**20:.1f} MiB")
+
+        middle = polls[len(polls) // 2][0]
+        queries = {
+            "history, 1 product x 1 pharmacy": lambda: db_handler.get_pharmacy_price_history("product-7", "pharmacy-3"),
+            "history, 1 product": lambda: db_handler.get_pharmacy_price_history("product-7"),
+            "history page (limit 1000)": lambda: db_handler.get_pharmacy_price_history(limit=1000),
+            "history page at mid-range cursor": lambda: db_handler.get_pharmacy_price_history(
+                end_date=middle, limit=1000
+            ),
+            "price at one capture": lambda: db_handler.get_pharmacy_price_history(
+                "product-7", "pharmacy-3", end_date=middle, limit=1
+            ),
+        }
+        print(f"\n{'query':<36} {'sql':>10} {'cube':>10} {'speedup':>8}")
+        for name, query in queries.items():
+            sql = median_ms(with_cube(False, query), args.repeat)
+            in_memory = median_ms(query, args.repeat)
+            print(f"{name:<36} {sql:>8.2f}ms {in_memory:>8.2f}ms {sql / in_memory:>7.1f}x")
+
+        sql = median_ms(lambda: sql_summary_before(middle, "pharmacy-0"), args.repeat)
+        in_memory = median_ms(lambda: db_handler.get_price_summary_before(middle, "pharmacy-0"), args.repeat)
+        print(f"{'cheapest / best competitor before':<36} {sql:>8.2f}ms {in_memory:>8.2f}ms {sql / in_memory:>7.1f}x")
+        db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
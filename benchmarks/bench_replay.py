@@ -0,0 +1,144 @@
+"""
+Record generated upstream payloads, replay them and check the derived history comes out identical.
+
+Ingests --days days of generated catalogues (--per-hour captures per hour,
+a --repeat fraction of them unchanged from the previous one) through the
+live capture path, recording every payload in the payload store. Then
+replays it with --workers processes: the whole range over the stored
+history, its middle third (back-filled in front of the later captures), and
+the whole range into emptied derived tables (snapshots, diffs, detailed
+prices, rollups), as a rebuild from scratch would. Each must reproduce every
+snapshot, trend, detailed price state and rollup exactly. Reports the
+payload store's size and deduplication, and the replay throughput with the
+time a 90-day history at 15-minute captures would take.
+
+Usage:
+    python -m benchmarks.bench_replay [--products 500] [--days 7] [--per-hour 4] [--repeat 0.3] [--workers 2]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+DERIVED_TABLES = ("snapshot_diff_rows", "snapshot_diffs", "snapshot_prices", "snapshots",
+                  "detailed_price_rollups", "detailed_price_data", "detailed_price_captures")
+
+
+def history_state(db_handler, timestamps):
+    """Everything derived from the payloads, in comparable form."""
+    with db_handler.get_connection_manager().read() as conn:
+        detailed = {timestamp: db_handler._prices_as_of(conn, timestamp, inclusive=True) for timestamp in timestamps}
+        # Sums rebuilt in one query add up in another order than when accumulated capture by capture
+        rollups = conn.execute("""
+            SELECT resolution, product_id, pharmacy_id, bucket, min_price, max_price, ROUND(sum_price, 6),
+                price_count, last_price, last_timestamp
+            FROM detailed_price_rollups ORDER BY resolution, product_id, pharmacy_id, bucket
+        """).fetchall()
+    return {
+        "timestamps": db_handler.get_all_timestamps(),
+        "snapshots": {timestamp: db_handler.get_data_by_timestamp(timestamp) for timestamp in timestamps},
+        "diffs": {timestamp: db_handler.get_snapshot_diff(timestamp) for timestamp in timestamps},
+        "detailed": detailed,
+        "rollups": rollups,
+    }
+
+
+def assert_same(expected, actual, label):
+    assert actual["timestamps"] == expected["timestamps"], f"{label}: snapshot timestamps differ"
+    for timestamp, df in expected["snapshots"].items():
+        assert actual["snapshots"][timestamp].equals(df), f"{label}: snapshot {timestamp} differs"
+    for timestamp, diff in expected["diffs"].items():
+        other = actual["diffs"][timestamp]
+        assert (diff is None) == (other is None), f"{label}: diff of {timestamp} differs"
+        if diff is not None:
+            assert json.dumps(other, sort_keys=True, default=str) == json.dumps(diff, sort_keys=True, default=str), \
+                f"{label}: diff of {timestamp} differs"
+    assert actual["detailed"] == expected["detailed"], f"{label}: detailed prices differ"
+    assert actual["rollups"] == expected["rollups"], f"{label}: rollups differ"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--per-hour", type=int, default=4)
+    parser.add_argument("--repeat", type=float, default=0.3, help="Fraction of captures with an unchanged catalogue")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    from api.database import db_handler, payload_store
+    from api.utils import data_fetcher, replay
+    from benchmarks.stub_upstream import CatalogueGenerator
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "bench.db")
+        db_handler.init_db()
+
+        generator = CatalogueGenerator(args.products, volatility=0.02, churn=0.002)
+        rng = random.Random(1)
+        start = datetime.datetime(2024, 1, 1)
+        step = datetime.timedelta(hours=1) / args.per_hour
+        captures = int(args.days * 24 * args.per_hour)
+        timestamps = []
+        catalogue = generator.catalogue()
+        began = time.perf_counter()
+        for i in range(captures):
+            if i and rng.random() >= args.repeat:
+                catalogue = generator.advance()
+            timestamp = (start + i * step).strftime("%Y-%m-%d %H:%M:%S")
+            # The live capture path: the body is recorded while it is parsed, then stored
+            recording = payload_store.RecordingParser(data_fetcher.new_payload_parser())
+            recording.feed(json.dumps(catalogue).encode())
+            snapshot = data_fetcher.ProductSnapshot(timestamp, recording.close(), recording.payload)
+            snapshot.save_detailed_prices()
+            data_fetcher._analyze_and_store(snapshot)
+            timestamps.append(timestamp)
+        ingest_seconds = time.perf_counter() - began
+        print(f"Ingested {captures} captures of {args.products:,} products in {ingest_seconds:.1f}s")
+
+        records = db_handler.get_raw_payloads()
+        store = payload_store.payload_store_path()
+        files = [os.path.join(directory, name) for directory, _, names in os.walk(store) for name in names]
+        raw_bytes = sum(record["raw_bytes"] for record in records)
+        stored_bytes = sum(os.path.getsize(path) for path in files)
+        print(f"Payload store ({payload_store.RAW_PAYLOAD_COMPRESSION}): {len(records)} captures, {len(files)} stored payloads, "
+              f"{raw_bytes / 2**20:.1f} MiB raw -> {stored_bytes / 2**20:.1f} MiB on disk "
+              f"({raw_bytes / max(stored_bytes, 1):.0f}x)")
+        expected = history_state(db_handler, timestamps)
+
+        results = {}
+        report = replay.replay_payloads(workers=args.workers)
+        assert not report["failed"], report["failed"]
+        assert_same(expected, history_state(db_handler, timestamps), "in-place replay")
+        results["whole"] = report
+
+        # A range in the middle of the history is back-filled in front of the captures after it
+        middle = replay.replay_payloads(timestamps[len(timestamps) // 3], timestamps[2 * len(timestamps) // 3],
+                                        workers=args.workers)
+        assert not middle["failed"], middle["failed"]
+        assert_same(expected, history_state(db_handler, timestamps), "middle replay")
+        results["middle"] = middle
+
+        with db_handler.get_connection_manager().write() as conn:
+            for table in DERIVED_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+        report = replay.replay_payloads(workers=args.workers)
+        assert not report["failed"], report["failed"]
+        assert_same(expected, history_state(db_handler, timestamps), "rebuild")
+        results["rebuild"] = report
+        db_handler.get_connection_manager().close()
+
+    print(f"\nReplay with {args.workers} workers:")
+    for label, report in results.items():
+        rate = report["payloads"] / report["duration_seconds"]
+        print(f"  {label:<9} {report['duration_seconds']:>6.1f}s  {rate:>6.1f} captures/s  "
+              f"{report['raw_bytes'] / 2**20 / report['duration_seconds']:>5.1f} MiB/s  "
+              f"90 days at 15 min: ~{90 * 96 / rate / 60:.0f} min")
+    print("Replayed history identical to the live ingestion (snapshots, trends, detailed prices, rollups)")
+
+
+if __name__ == "__main__":
+    main()
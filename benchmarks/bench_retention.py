@@ -0,0 +1,128 @@
+"""
+Compact a generated price history with the retention policy and check that nothing kept changed.
+
+Stores --days days of generated captures (--per-hour per hour, each with its
+snapshot and detailed prices), then compacts them as if it were the end of
+the last day: full resolution for --full-days, one capture per hour up to
+--hourly-days, one per day before that. While compaction runs, a second
+connection keeps taking the write lock for a tiny write, measuring how long
+it had to wait. Reports the removed rows, the bytes reclaimed by the vacuum
+and the batch timings, and checks that every kept snapshot, the detailed
+prices in effect at every kept capture and the price cube's matrix over the
+kept captures are identical before and after, and that every remaining
+snapshot has its diff again.
+
+Usage:
+    python -m benchmarks.bench_retention [--products 500] [--days 6] [--per-hour 2] [--full-days 1] [--hourly-days 3]
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+def probe_writes(db_path, stop, waits):
+    """Take the write lock for a one-row write every 10ms, recording how long each took."""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    try:
+        while not stop.wait(0.01):
+            began = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO leases (name, owner, acquired_at, expires_at) VALUES ('probe', 'probe', 0, 0)")
+            conn.execute("COMMIT")
+            waits.append(time.perf_counter() - began)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--days", type=int, default=6)
+    parser.add_argument("--per-hour", type=int, default=2)
+    parser.add_argument("--full-days", type=float, default=1)
+    parser.add_argument("--hourly-days", type=float, default=3)
+    parser.add_argument("--vacuum", choices=("incremental", "full", "off"), default="incremental")
+    args = parser.parse_args()
+
+    from api.database import db_handler, retention
+    from api.utils.data_fetcher import backfill_snapshot_diffs, diff_against_previous, parse_product_payload
+    from benchmarks.stub_upstream import CatalogueGenerator
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "bench.db")
+        db_handler.init_db()
+        manager = db_handler.get_connection_manager()
+
+        generator = CatalogueGenerator(args.products, volatility=0.02, churn=0.002)
+        start = datetime.datetime(2024, 1, 1)
+        step = datetime.timedelta(hours=1) / args.per_hour
+        captures = args.days * 24 * args.per_hour
+        began = time.perf_counter()
+        for i in range(captures):
+            timestamp = (start + i * step).strftime("%Y-%m-%d %H:%M:%S")
+            summary, detailed = parse_product_payload(generator.catalogue() if i == 0 else generator.advance())
+            db_handler.save_to_db(summary, timestamp, diff_against_previous(summary, timestamp))
+            db_handler.save_detailed_prices(detailed, timestamp)
+        now = start + datetime.timedelta(days=args.days)
+        print(f"Stored {captures} captures of {args.products:,} products in {time.perf_counter() - began:.1f}s")
+
+        hourly_cutoff, daily_cutoff = retention.retention_cutoffs(now, args.full_days, args.hourly_days)
+        with manager.read() as conn:
+            batches = retention.plan_compaction(conn, hourly_cutoff, daily_cutoff)
+            removed = {timestamp for batch in batches for entry in batch for kind in ("snapshot", "capture")
+                       if entry[kind] for timestamp in entry[kind][1]}
+            kept = [timestamp for timestamp in db_handler.get_all_timestamps()[::-1] if timestamp not in removed]
+            states = {timestamp: db_handler._prices_as_of(conn, timestamp, inclusive=True) for timestamp in kept}
+            rows_before = conn.execute("SELECT COUNT(*) FROM detailed_price_data").fetchone()[0]
+        snapshots = {timestamp: db_handler.get_data_by_timestamp(timestamp) for timestamp in kept}
+        matrix = db_handler.get_price_matrix(kept)
+        file_before = os.path.getsize(db_handler.DB_PATH)
+
+        stop, waits = threading.Event(), []
+        probe = threading.Thread(target=probe_writes, args=(db_handler.DB_PATH, stop, waits))
+        probe.start()
+        try:
+            report = retention.run_retention(now, args.full_days, args.hourly_days, vacuum=args.vacuum)
+        finally:
+            stop.set()
+            probe.join()
+        began = time.perf_counter()
+        recomputed = backfill_snapshot_diffs()
+        backfill_seconds = time.perf_counter() - began
+
+        # Everything kept reads back exactly as before
+        with manager.read() as conn:
+            for timestamp in kept:
+                assert db_handler._prices_as_of(conn, timestamp, inclusive=True) == states[timestamp], f"detailed prices at {timestamp} changed"
+            rows_after = conn.execute("SELECT COUNT(*) FROM detailed_price_data").fetchone()[0]
+        assert db_handler.get_all_timestamps()[::-1] == kept, "the remaining snapshots are not the kept ones"
+        for timestamp in kept:
+            assert db_handler.get_data_by_timestamp(timestamp).equals(snapshots[timestamp]), f"snapshot {timestamp} changed"
+        assert not db_handler.get_timestamps_without_diff(), "a remaining snapshot has no diff"
+        compacted = db_handler.get_price_matrix(kept)
+        assert db_handler.get_price_cube().timestamps == kept, "the price cube was not rebuilt"
+        assert list(compacted[0]) == list(matrix[0]) and np.array_equal(compacted[2], matrix[2], equal_nan=True), "price cube differs"
+        manager.close()
+
+    vacuum = report["vacuum"] or {}
+    print(f"Cutoffs: hourly before {hourly_cutoff}, daily before {daily_cutoff}")
+    print(f"Snapshots: {len(kept) + report['snapshots_removed']} -> {len(kept)} "
+          f"({report['captures_removed']} detailed captures removed)")
+    print(f"Detailed price rows: {rows_before:,} -> {rows_after:,}")
+    print(f"Compaction: {report['batches']} batches in {report['duration_seconds']:.2f}s, "
+          f"{recomputed} diffs recomputed in {backfill_seconds:.2f}s")
+    print(f"Concurrent writes while compacting: {len(waits)}, max wait {max(waits, default=0) * 1000:.0f}ms, "
+          f"median {np.median(waits) * 1000 if waits else 0:.1f}ms")
+    print(f"Vacuum ({vacuum.get('mode', 'off')}): reclaimed {vacuum.get('bytes_reclaimed', 0) / 2**20:.1f} MiB, "
+          f"file {file_before / 2**20:.1f} MiB -> {vacuum.get('file_bytes', file_before) / 2**20:.1f} MiB")
+    print("Kept snapshots, detailed prices and price cube unchanged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare response serialization through to_dict + jsonable_encoder with the column-wise JSON encoder.
+
+Builds the payload of each endpoint (/current and /historical snapshots,
+/best-competitor, a /pharmacy-history page and /aggregates points) and
+times encoding it both ways, with the peak memory allocated while doing so
+(tracemalloc). Also checks that both produce the same JSON, with NaN and
+±inf encoded as null, and reports the size of the columnar format.
+
+Usage:
+    python -m benchmarks.bench_serialization [--products 5000] [--history-rows 10000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api.database import db_handler
+from api.utils.serialization import frame_to_json, json_envelope, records_to_json
+from api.utils.trend import compute_trends
+from benchmarks.bench_change_storage import simulate
+from benchmarks.bench_historical_cache import make_snapshot
+
+
+def median_ms(func, repeat):
+    """Median wall time of func over `repeat` runs, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def peak_kib(func):
+    """Peak memory traced while running func once, in KiB."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def legacy(data):
+    """The previous path: per-row dictionaries, jsonable_encoder, then JSONResponse rendering."""
+    if hasattr(data, "to_dict"):
+        data = data.astype(object).where(data.notna(), None).to_dict(orient="records")
+    return JSONResponse(jsonable_encoder({"data": data, "timestamp": "2024-01-01 00:00:00"})).body
+
+
+def columnar_path(data, format):
+    """The new path: columns encoded straight to JSON bytes."""
+    encoded = frame_to_json(data, format) if hasattr(data, "to_dict") else records_to_json(data, format)
+    return json_envelope(encoded, timestamp="2024-01-01 00:00:00")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--history-rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    previous, snapshot = make_snapshot(args.products, rng), make_snapshot(args.products, rng)
+    # A few non-finite competitor prices, which the old to_dict path let through
+    snapshot.loc[snapshot.index[:3], "Best Competitor Price (€/g)"] = [np.inf, -np.inf, np.nan]
+    current, _ = compute_trends(snapshot, previous)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, "serialization.db")
+        db_handler.init_db()
+        for timestamp, columns in simulate(7, 24, 200, 9, 0.05, 0.001):
+            db_handler.save_detailed_prices_bulk(columns, timestamp)
+        history, _ = db_handler.get_pharmacy_price_history(limit=args.history_rows)
+        aggregates = db_handler.get_price_aggregates("product-7", None, "hour", None, None)
+        db_handler.get_connection_manager().close()
+
+    payloads = {
+        "/current, /historical": current,
+        "/best-competitor": current[current["Best Competitor"].notna()],
+        "/pharmacy-history": history,
+        "/aggregates": aggregates[["bucket", "min", "max", "mean", "last", "count"]],
+    }
+
+    print(f"{'endpoint':<24} {'rows':>6} {'legacy':>10} {'records':>10} {'columnar':>10} "
+          f"{'peak legacy':>12} {'peak new':>10} {'size rec/col':>16}")
+    for name, data in payloads.items():
+        records = columnar_path(data, "records")
+        columnar = columnar_path(data, "columnar")
+        # The legacy path raises on ±inf, so it gets a copy with them already replaced
+        finite = data.replace([np.inf, -np.inf], np.nan) if hasattr(data, "replace") else data
+        assert json.loads(records) == json.loads(legacy(finite)), f"{name}: records output differs"
+
+        print(f"{name:<24} {len(data):>6} "
+              f"{median_ms(lambda: legacy(finite), args.repeat):>8.2f}ms "
+              f"{median_ms(lambda: columnar_path(data, 'records'), args.repeat):>8.2f}ms "
+              f"{median_ms(lambda: columnar_path(data, 'columnar'), args.repeat):>8.2f}ms "
+              f"{peak_kib(lambda: legacy(finite)):>9.0f}KiB "
+              f"{peak_kib(lambda: columnar_path(data, 'records')):>7.0f}KiB "
+              f"{len(records) // 1024:>7}/{len(columnar) // 1024}KiB")
+
+
+if __name__ == "__main__":
+    main()
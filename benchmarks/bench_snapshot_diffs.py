@@ -0,0 +1,78 @@
+"""
+Compare reading a historical snapshot with its stored diff against recomputing the trend on every read.
+
+Stores snapshots of several catalogue sizes without diffs, times the backfill,
+then times the old read path (load the snapshot, load the previous one,
+compare) against the join with the stored diff, and checks both agree.
+
+Usage:
+    python -m benchmarks.bench_snapshot_diffs [--sizes 500 2000 10000] [--snapshots 10] [--repeat 20]
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.database import db_handler
+from api.utils import data_fetcher
+from api.utils.trend import apply_snapshot_diff
+from benchmarks.bench_historical_cache import make_snapshot
+
+
+def median_ms(func, repeat):
+    """Median wall time of func over `repeat` runs, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def recompute(timestamp):
+    """The old /historical path: read the snapshot and the one before it, then compare."""
+    df = db_handler.get_data_by_timestamp(timestamp)
+    return apply_snapshot_diff(df, data_fetcher.diff_against_previous(df, timestamp))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 10000])
+    parser.add_argument("--snapshots", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'products':>9} {'backfill/snapshot':>18} {'recompute':>10} {'stored diff':>12} {'speedup':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_handler.DB_PATH = os.path.join(tmp, "diffs.db")
+            db_handler.init_db()
+            start = datetime.datetime(2024, 1, 1)
+            timestamps = [(start + datetime.timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S") for i in range(args.snapshots)]
+            for timestamp in timestamps:
+                db_handler.save_to_db(make_snapshot(size, rng), timestamp)
+
+            # The trend code reports what it compared with; keep the timings readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                began = time.perf_counter()
+                stored = data_fetcher.backfill_snapshot_diffs()
+                backfill = (time.perf_counter() - began) / stored
+
+                timestamp = timestamps[-1]
+                pd.testing.assert_frame_equal(data_fetcher.get_data_with_trend(timestamp), recompute(timestamp))
+                old = median_ms(lambda: recompute(timestamp), args.repeat)
+            new = median_ms(lambda: data_fetcher.get_data_with_trend(timestamp), args.repeat)
+            print(f"{size:>9} {backfill * 1000:>16.1f}ms {old:>8.2f}ms {new:>10.2f}ms {old / new:>7.1f}x")
+            db_handler.get_connection_manager().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Count upstream requests while many clients hit the fetch paths at once.
+
+Starts a local stub of the DrAnsay endpoint with injected latency, then fires
+concurrent get_product_snapshot / fetch_and_analyze_all_pharmacy_prices calls
+(the code behind /pharmacy-history/refresh) and reports how many requests actually reached the upstream.
+
+Usage:
+    python -m benchmarks.bench_snapshot_sharing [--clients 50] [--latency 0.5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.stub_upstream import StubUpstream, make_catalogue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--ttl", type=float, default=60.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DRANSAY_API_KEY", "benchmark")
+    os.environ["SNAPSHOT_TTL_SECONDS"] = str(args.ttl)
+
+    with StubUpstream(make_catalogue(), latency=args.latency) as stub:
+        from api.database import db_handler
+        from api.utils import data_fetcher
+        data_fetcher.upstream_client.url = stub.url
+
+        async def summary():
+            return (await data_fetcher.get_product_snapshot()).summary
+
+        calls = [summary, data_fetcher.fetch_and_analyze_all_pharmacy_prices]
+
+        async def wave():
+            return await asyncio.gather(*(calls[i % 2]() for i in range(args.clients)))
+
+        async def run():
+            start = time.perf_counter()
+            results = await wave()
+            elapsed = time.perf_counter() - start
+            # Within the TTL a second wave must be served from the cached snapshot
+            await wave()
+            await data_fetcher.upstream_client.aclose()
+            return results, elapsed
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_handler.DB_PATH = os.path.join(tmp, "bench.db")
+            db_handler.init_db()
+            results, elapsed = asyncio.run(run())
+
+        assert all(not result.empty for result in results), "every caller should receive data"
+        print(f"{2 * args.clients} concurrent calls in two waves -> {stub.hits} upstream request(s), "
+              f"first wave {elapsed:.2f}s")
+        if stub.hits != 1:
+            raise SystemExit(f"expected exactly one upstream request, got {stub.hits}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Compare snapshot reads from the legacy JSON blobs with the normalized snapshot_prices table.
+
+Builds a database holding the same snapshots in both layouts, then times
+loading a snapshot by timestamp, the previous-snapshot lookup used by the
+trend analysis, and one product's price history across all snapshots.
+
+Usage:
+    python -m benchmarks.bench_snapshot_store [--snapshots 10000] [--products 100]
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.database import db_handler
+
+
+def legacy_get_data_by_timestamp(conn, timestamp):
+    row = conn.execute("SELECT data FROM price_data WHERE timestamp = ?", (timestamp,)).fetchone()
+    return pd.read_json(row[0], orient="records") if row else None
+
+
+def legacy_get_most_recent_data_before(conn, timestamp):
+    row = conn.execute(
+        "SELECT timestamp, data FROM price_data WHERE timestamp < ? ORDER BY timestamp DESC LIMIT 1", (timestamp,)
+    ).fetchone()
+    return (row[0], pd.read_json(row[1], orient="records")) if row else (None, None)
+
+
+def legacy_product_history(conn, product_id):
+    prices = []
+    for timestamp, blob in conn.execute("SELECT timestamp, data FROM price_data ORDER BY timestamp"):
+        df = pd.read_json(blob, orient="records")
+        match = df[df["id"] == product_id]
+        if not match.empty:
+            prices.append((timestamp, match.iloc[0]["Price (€/g)"]))
+    return prices
+
+
+def normalized_product_history(conn, product_id):
+    return conn.execute(
+        "SELECT timestamp, price FROM snapshot_prices WHERE product_id = ? ORDER BY timestamp", (product_id,)
+    ).fetchall()
+
+
+def build_database(path, n_snapshots, n_products, seed=0):
+    """Write the same snapshots as legacy blobs and as normalized rows; return their timestamps."""
+    rng = np.random.default_rng(seed)
+    db_handler.DB_PATH = path
+    db_handler.init_db()
+
+    base = pd.DataFrame({
+        "id": [f"product-{i}" for i in range(n_products)],
+        "Sorte": [f"Strain {i}" for i in range(n_products)],
+        "Kultivar": "",
+        "Pharmacy ID": "sanvivo",
+        "Best Competitor": "Asavita",
+    })
+    start = datetime.datetime(2024, 1, 1)
+    timestamps = []
+    conn = sqlite3.connect(path)
+    for i in range(n_snapshots):
+        timestamp = (start + datetime.timedelta(minutes=15 * i)).strftime("%Y-%m-%d %H:%M:%S")
+        df = base.copy()
+        df["Price (€/g)"] = rng.integers(500, 2000, size=n_products) / 100.0
+        df["Best Competitor Price (€/g)"] = rng.integers(500, 2000, size=n_products) / 100.0
+        df = df[list(db_handler.SNAPSHOT_COLUMNS)]
+        conn.execute("INSERT INTO price_data (timestamp, data) VALUES (?, ?)", (timestamp, df.to_json(orient="records")))
+        db_handler._insert_snapshot(conn, timestamp, list(df.itertuples(index=False, name=None)))
+        timestamps.append(timestamp)
+    conn.commit()
+    conn.close()
+    return timestamps
+
+
+def best_of(func, args_list):
+    """Average seconds per call over `args_list`."""
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--snapshots", type=int, default=10_000)
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"building {args.snapshots} snapshots x {args.products} products ...")
+        timestamps = build_database(path, args.snapshots, args.products)
+        sample = [(timestamp,) for timestamp in random.Random(1).sample(timestamps, min(args.lookups, len(timestamps)))]
+        conn = sqlite3.connect(path)
+
+        results = [
+            ("snapshot by timestamp",
+             best_of(lambda ts: legacy_get_data_by_timestamp(conn, ts), sample),
+             best_of(db_handler.get_data_by_timestamp, sample)),
+            ("previous snapshot (trend)",
+             best_of(lambda ts: legacy_get_most_recent_data_before(conn, ts), sample),
+             best_of(db_handler.get_most_recent_data_before, sample)),
+            ("product history",
+             best_of(lambda pid: legacy_product_history(conn, pid), [("product-0",)]),
+             best_of(lambda pid: normalized_product_history(conn, pid), [("product-0",)])),
+        ]
+        conn.close()
+
+    print(f"{'query':<28} {'JSON blob (ms)':>15} {'normalized (ms)':>16} {'speedup':>9}")
+    for name, legacy, normalized in results:
+        print(f"{name:<28} {legacy * 1000:>15.2f} {normalized * 1000:>16.2f} {legacy / normalized:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Measure the import time and the time to first response of a cold API worker.
+
+Stores a small price history, then repeatedly (after one untimed warm-up
+run) starts fresh processes against a copy of it: one that only imports
+api.main, reporting the import time and which heavy modules it loaded, and
+one uvicorn worker, timing from process start to the first 200 of
+/api/prices/timestamps and of a /api/prices/historical snapshot (which does
+need pandas). The snapshot scheduler is disabled, so nothing but the
+worker's own start is measured.
+
+With --baseline REV the same is measured for a git revision (checked out in a
+temporary worktree) and the run fails unless the import time and the time to
+the first /timestamps response are both at least --target percent lower.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 5] [--baseline REV] [--target 40]
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_multi_worker import free_port
+
+HEAVY_MODULES = ("numpy", "pandas", "httpx")
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+started = time.perf_counter()
+import api.main
+print(json.dumps({{"seconds": time.perf_counter() - started, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def worker_env(db_path):
+    return {
+        **os.environ,
+        "SANVIVO_DB_PATH": db_path,
+        "PRICE_CUBE_PATH": f"{db_path}.cube",
+        "DRANSAY_API_KEY": "benchmark",
+        "SNAPSHOT_SCHEDULER_ENABLED": "0",
+        "LOG_LEVEL": "WARNING",
+        "PYTHONPATH": "",
+    }
+
+
+def measure_import(tree, db_path):
+    """Import api.main in a fresh interpreter; return (import seconds, process seconds, heavy modules loaded)."""
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=tree, env=worker_env(db_path),
+                            capture_output=True, text=True, check=True).stdout
+    process_seconds = time.perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["seconds"], process_seconds, result["loaded"]
+
+
+def first_ok(client, url, started, deadline=60):
+    """Poll `url` until it answers 200; return the seconds since `started`."""
+    while time.perf_counter() - started < deadline:
+        try:
+            if client.get(url).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.002)
+    raise TimeoutError(f"{url} did not answer within {deadline}s")
+
+
+def measure_first_response(tree, db_path, timestamp):
+    """Start a uvicorn worker; return the seconds to the first /timestamps and the first /historical response."""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=tree, env=worker_env(db_path), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=base_url, timeout=30) as client:
+            timestamps = first_ok(client, "/api/prices/timestamps", started)
+            historical = first_ok(client, f"/api/prices/historical/{timestamp}", started)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return timestamps, historical
+
+
+def measure(tree, template_db, timestamp, runs, tmp, label):
+    """Median timings of `runs` cold starts of the API in `tree` (after one untimed warm-up)."""
+    db_path = os.path.join(tmp, f"{label}.db")
+    shutil.copy(template_db, db_path)
+    results = {"import": [], "process": [], "timestamps": [], "historical": []}
+    loaded = None
+    for run in range(runs + 1):
+        import_seconds, process_seconds, loaded = measure_import(tree, db_path)
+        timestamps, historical = measure_first_response(tree, db_path, timestamp)
+        if run:
+            for key, value in zip(results, (import_seconds, process_seconds, timestamps, historical)):
+                results[key].append(value)
+    medians = {key: statistics.median(values) for key, values in results.items()}
+    medians["loaded"] = loaded
+    return medians
+
+
+def build_history(db_path, products, captures):
+    """Store `captures` hourly snapshots with detailed prices; return the last timestamp."""
+    from api.database import db_handler
+    from api.utils.data_fetcher import diff_against_previous, parse_product_payload
+    from benchmarks.stub_upstream import CatalogueGenerator
+
+    db_handler.DB_PATH = db_path
+    db_handler.init_db()
+    generator = CatalogueGenerator(products, volatility=0.05, churn=0.005)
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(captures):
+        timestamp = (start + datetime.timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S")
+        summary, detailed = parse_product_payload(generator.catalogue() if i == 0 else generator.advance())
+        db_handler.save_to_db(summary, timestamp, diff_against_previous(summary, timestamp))
+        db_handler.save_detailed_prices(detailed, timestamp)
+    db_handler.get_connection_manager().close()
+    return timestamp
+
+
+def report(label, result):
+    print(f"{label:<10} {result['import'] * 1000:>8.0f}ms {result['process'] * 1000:>9.0f}ms "
+          f"{result['timestamps'] * 1000:>12.0f}ms {result['historical'] * 1000:>12.0f}ms  {', '.join(result['loaded']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--captures", type=int, default=48)
+    parser.add_argument("--baseline", help="Git revision to compare with, e.g. HEAD~1")
+    parser.add_argument("--target", type=float, default=40,
+                        help="With --baseline: minimum reduction (percent) of the import time and the first /timestamps response")
+    args = parser.parse_args()
+
+    tree = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        template_db = os.path.join(tmp, "template.db")
+        timestamp = build_history(template_db, args.products, args.captures)
+        print(f"{args.captures} captures of {args.products:,} products, median of {args.runs} cold starts")
+        print(f"\n{'':<10} {'import':>10} {'process':>11} {'/timestamps':>14} {'/historical':>14}  heavy modules at import")
+
+        baseline = None
+        if args.baseline:
+            baseline_tree = os.path.join(tmp, "baseline")
+            subprocess.run(["git", "worktree", "add", "--detach", baseline_tree, args.baseline], cwd=tree,
+                           check=True, capture_output=True)
+            try:
+                baseline = measure(baseline_tree, template_db, timestamp, args.runs, tmp, "baseline")
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", baseline_tree], cwd=tree, check=True, capture_output=True)
+            report(args.baseline, baseline)
+        current = measure(tree, template_db, timestamp, args.runs, tmp, "current")
+        report("current", current)
+
+    if baseline is not None:
+        missed = []
+        for key, name in (("import", "import time"), ("timestamps", "first /timestamps response")):
+            reduction = 100 * (1 - current[key] / baseline[key])
+            print(f"{name}: {reduction:.0f}% lower (target {args.target:.0f}%)")
+            if reduction < args.target:
+                missed.append(name)
+        if missed:
+            sys.exit(f"Target missed for the {' and '.join(missed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark the vectorized trend engine against the original iterrows loop.
+
+Usage:
+    python -m benchmarks.bench_trend [--sizes 1000 10000 100000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.utils.trend import compute_trends
+
+
+def legacy_trends(current_df, prev_df):
+    """The original row-by-row trend comparison, kept for comparison."""
+    df = current_df.copy()
+    df["Trend"] = ""
+    if "Best Competitor Price (€/g)" in df.columns:
+        df["Competitor Trend"] = ""
+
+    for idx, row in df.iterrows():
+        product_name = row["Sorte"]
+        current_price = row["Price (€/g)"]
+        prev_product = prev_df[prev_df["Sorte"] == product_name]
+
+        if not prev_product.empty:
+            prev_price = prev_product.iloc[0]["Price (€/g)"]
+            price_diff = round(current_price - prev_price, 2)
+            if abs(price_diff) < 0.01:
+                df.at[idx, "Trend"] = "→ Unchanged"
+            elif price_diff > 0:
+                df.at[idx, "Trend"] = f"↑ +{price_diff:.2f}€"
+            else:
+                df.at[idx, "Trend"] = f"↓ {price_diff:.2f}€"
+
+            if "Best Competitor Price (€/g)" in df.columns and "Best Competitor Price (€/g)" in prev_product.columns:
+                current_competitor_price = row["Best Competitor Price (€/g)"]
+                prev_competitor_price = prev_product.iloc[0]["Best Competitor Price (€/g)"]
+                if current_competitor_price is not None and prev_competitor_price is not None:
+                    competitor_price_diff = round(current_competitor_price - prev_competitor_price, 2)
+                    if abs(competitor_price_diff) < 0.01:
+                        df.at[idx, "Competitor Trend"] = "→ Unchanged"
+                    elif competitor_price_diff > 0:
+                        df.at[idx, "Competitor Trend"] = f"↑ +{competitor_price_diff:.2f}€"
+                    else:
+                        df.at[idx, "Competitor Trend"] = f"↓ {competitor_price_diff:.2f}€"
+                elif current_competitor_price is not None and prev_competitor_price is None:
+                    df.at[idx, "Competitor Trend"] = "New competitor"
+                elif current_competitor_price is None and prev_competitor_price is not None:
+                    df.at[idx, "Competitor Trend"] = "No competitors now"
+                else:
+                    df.at[idx, "Competitor Trend"] = "No competitors"
+        else:
+            df.at[idx, "Trend"] = "New product"
+            if "Best Competitor Price (€/g)" in df.columns:
+                df.at[idx, "Competitor Trend"] = "New product"
+    return df
+
+
+def make_snapshots(n_products, seed=0):
+    """Build a (current, previous) pair of snapshots with price moves, new and removed products."""
+    rng = np.random.default_rng(seed)
+    names = np.array([f"Strain {i}" for i in range(n_products)], dtype=object)
+    cents = rng.integers(500, 2000, size=n_products)
+    competitor_cents = cents + rng.integers(-300, 300, size=n_products)
+
+    prev = pd.DataFrame({
+        "id": [f"p{i}" for i in range(n_products)],
+        "Sorte": names,
+        "Kultivar": "",
+        "Pharmacy ID": "sanvivo",
+        "Price (€/g)": cents / 100.0,
+        "Best Competitor": "Asavita",
+        "Best Competitor Price (€/g)": competitor_cents / 100.0,
+    })
+
+    current = prev.copy()
+    moved = rng.random(n_products) < 0.3
+    current.loc[moved, "Price (€/g)"] = (cents[moved] + rng.integers(-150, 150, size=moved.sum())) / 100.0
+    competitor_moved = rng.random(n_products) < 0.3
+    current.loc[competitor_moved, "Best Competitor Price (€/g)"] = (
+        competitor_cents[competitor_moved] + rng.integers(-150, 150, size=competitor_moved.sum())
+    ) / 100.0
+
+    # 5% of products are new in the current snapshot, 5% disappeared from it
+    new = rng.random(n_products) < 0.05
+    current.loc[new, "Sorte"] = [f"New strain {i}" for i in range(new.sum())]
+    removed = rng.random(n_products) < 0.05
+    current = current[~removed].sort_values("Price (€/g)").reset_index(drop=True)
+    return current, prev
+
+
+def time_call(func, *args, repeat=3):
+    """Return the best wall time in seconds over `repeat` runs, and the last result."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--legacy-max", type=int, default=100_000,
+                        help="Skip the legacy loop above this size (it is O(n*m))")
+    args = parser.parse_args()
+
+    print(f"{'products':>10} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}  identical")
+    for size in args.sizes:
+        current, prev = make_snapshots(size)
+        vector_time, (vector_df, _) = time_call(compute_trends, current, prev)
+
+        if size <= args.legacy_max:
+            legacy_time, legacy_df = time_call(legacy_trends, current, prev, repeat=1)
+            identical = legacy_df.equals(vector_df)
+            print(f"{size:>10} {legacy_time:>12.3f} {vector_time:>15.4f} {legacy_time / vector_time:>8.0f}x  {identical}")
+        else:
+            print(f"{size:>10} {'skipped':>12} {vector_time:>15.4f} {'-':>9}  -")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Local stand-in for the DrAnsay products endpoint.
+
+Serves a generated catalogue over HTTP with an ETag, answers matching
+If-None-Match requests with 304, counts the requests it receives and can
+inject latency, so benchmarks can run fully offline. CatalogueGenerator
+produces a reproducible series of catalogues whose prices change between
+captures.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_catalogue(n_products=500, vendors_per_product=5, seed=0):
+    """Build a DrAnsay-shaped product list with prices in cents."""
+    # Imported here so callers can configure the environment before api modules load
+    from api.utils.pharmacy_groups import TOP_PHARMACY_IDS
+
+    rng = random.Random(seed)
+    vendor_ids = list(TOP_PHARMACY_IDS)
+    products = []
+    for i in range(n_products):
+        vendors = rng.sample(vendor_ids, min(vendors_per_product, len(vendor_ids)))
+        products.append({
+            "id": f"product-{i}",
+            "sorte": f"Strain {i}",
+            "kultivar": f"Cultivar {i % 50}",
+            "vendors": {vendor_id: {"price": rng.randint(500, 2000)} for vendor_id in vendors},
+        })
+    return products
+
+
+class CatalogueGenerator:
+    """
+    Reproducible sequence of DrAnsay catalogues whose prices evolve between captures.
+
+    The first catalogue lists `n_products` products, each offered by
+    `vendors_per_product` vendors drawn from the top pharmacies plus
+    `other_vendors` further ones. Every following catalogue moves a
+    `volatility` fraction of the prices by up to ±`max_change` (relative) and
+    delists or relists a `churn` fraction of the offers. The same arguments
+    always produce the same sequence.
+    """
+
+    def __init__(self, n_products=500, vendors_per_product=5, other_vendors=0, volatility=0.1,
+                 max_change=0.15, churn=0.01, seed=0):
+        from api.utils.pharmacy_groups import TOP_PHARMACY_IDS
+
+        self.n_products = n_products
+        self.volatility = volatility
+        self.max_change = max_change
+        self.churn = churn
+        self.step = 0
+        self._rng = random.Random(seed)
+        vendor_ids = list(TOP_PHARMACY_IDS) + [f"vendor-{i:04d}" for i in range(other_vendors)]
+        # product index -> vendor ID -> price in cents, None while delisted
+        self._prices = []
+        for _ in range(n_products):
+            vendors = self._rng.sample(vendor_ids, min(vendors_per_product, len(vendor_ids)))
+            self._prices.append({vendor_id: self._rng.randint(500, 2000) for vendor_id in vendors})
+
+    def catalogue(self):
+        """The current catalogue, as served by the products endpoint."""
+        products = []
+        for i, prices in enumerate(self._prices):
+            vendors = {vendor_id: {"price": price} for vendor_id, price in prices.items() if price is not None}
+            products.append({"id": f"product-{i}", "sorte": f"Strain {i}", "kultivar": f"Cultivar {i % 50}", "vendors": vendors})
+        return products
+
+    def advance(self):
+        """Move to the next capture's prices and return its catalogue."""
+        rng = self._rng
+        for prices in self._prices:
+            for vendor_id, price in prices.items():
+                if rng.random() < self.churn:
+                    prices[vendor_id] = rng.randint(500, 2000) if price is None else None
+                elif price is not None and rng.random() < self.volatility:
+                    prices[vendor_id] = max(1, round(price * (1 + rng.uniform(-self.max_change, self.max_change))))
+        self.step += 1
+        return self.catalogue()
+
+
+class StubUpstream:
+    """Threaded HTTP server returning a JSON payload on every GET."""
+
+    def __init__(self, payload, latency=0.0, host="127.0.0.1", port=0):
+        self.set_payload(payload)
+        self.latency = latency
+        self.hits = 0
+        self.not_modified = 0
+        self._hits_lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with stub._hits_lock:
+                    stub.hits += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if self.headers.get("If-None-Match") == stub.etag:
+                    with stub._hits_lock:
+                        stub.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", stub.etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", stub.etag)
+                self.send_header("Content-Length", str(len(stub.body)))
+                self.end_headers()
+                self.wfile.write(stub.body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def set_payload(self, payload):
+        """Replace the served catalogue (and its ETag)."""
+        self.body = json.dumps(payload).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/products"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
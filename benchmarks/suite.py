@@ -0,0 +1,324 @@
+"""
+Run the benchmark suite on a synthetic catalogue and write the results as JSON for comparing runs.
+
+Builds a price history from a reproducible series of generated catalogues
+(see CatalogueGenerator: products, vendors per product, price volatility and
+churn), timing the ingest functions on the way: payload parsing, the trend
+against the previous capture, save_to_db and save_detailed_prices. Then times
+the read functions of db_handler and the serializer, a full capture through
+the scheduler against a local stub of the DrAnsay endpoint, fetch_and_analyze_all_pharmacy_prices,
+and the API endpoints through the ASGI app in-process (no sockets on the
+client side).
+
+Every benchmark reports the median, p95 and minimum of its runs in
+milliseconds. --output writes them with the run parameters, Python and
+package versions and the git commit; --compare prints the change against such
+a file and --max-regression makes the run fail when a median got slower than
+that percentage.
+
+Usage:
+    python -m benchmarks.suite [--products 5000] [--captures 24] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_upstream import CatalogueGenerator, StubUpstream
+
+# Benchmarks whose median changed less than this are reported as unchanged by --compare
+NOISE_PERCENT = 5.0
+
+
+def summarize(times, **extra):
+    """Median, p95 and minimum of run times given in seconds, in milliseconds."""
+    ordered = sorted(times)
+    return {
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "runs": len(ordered),
+        **extra,
+    }
+
+
+def measure(func, repeat, setup=None, **extra):
+    """Time `repeat` calls of func, running setup (untimed) before each, or one untimed warm-up call without setup."""
+    if setup is None:
+        func()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return summarize(times, **extra)
+
+
+async def measure_async(func, repeat, setup=None, **extra):
+    """Time `repeat` awaited calls of the coroutine function func (see measure)."""
+    if setup is None:
+        await func()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - start)
+    return summarize(times, **extra)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import numpy
+    import pandas
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "sqlite": __import__("sqlite3").sqlite_version,
+        "commit": git_commit(),
+    }
+
+
+def wait_next_second():
+    """Snapshot timestamps have one-second resolution: start the next capture in a new second."""
+    time.sleep(1 - time.time() % 1 + 0.01)
+
+
+def ingest_history(generator, captures, results):
+    """
+    Store `captures` generated catalogues one hour apart, timing each ingest step.
+
+    Returns:
+        list: The stored timestamps, oldest first
+    """
+    from api.database.db_handler import save_detailed_prices, save_to_db
+    from api.utils.data_fetcher import diff_against_previous, parse_product_payload
+
+    start = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=captures + 1)
+    steps = {"parse_product_payload": [], "diff_against_previous": [], "save_to_db": [], "save_detailed_prices": []}
+    timestamps = []
+    rows = 0
+    for i in range(captures):
+        catalogue = generator.catalogue() if i == 0 else generator.advance()
+        timestamp = (start + datetime.timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S")
+
+        began = time.perf_counter()
+        summary, detailed = parse_product_payload(catalogue)
+        parsed = time.perf_counter()
+        diff = diff_against_previous(summary, timestamp)
+        compared = time.perf_counter()
+        save_to_db(summary, timestamp, diff)
+        saved = time.perf_counter()
+        save_detailed_prices(detailed, timestamp)
+        finished = time.perf_counter()
+
+        steps["parse_product_payload"].append(parsed - began)
+        steps["diff_against_previous"].append(compared - parsed)
+        steps["save_to_db"].append(saved - compared)
+        steps["save_detailed_prices"].append(finished - saved)
+        timestamps.append(timestamp)
+        rows = len(detailed["price"])
+
+    for name, times in steps.items():
+        results[f"ingest.{name}"] = summarize(times, rows=rows if name == "save_detailed_prices" else len(summary))
+    return timestamps
+
+
+def micro_benchmarks(timestamps, repeat, results):
+    """Time the read functions on the stored history and the serializer on a snapshot."""
+    from api.database import db_handler
+    from api.utils.data_fetcher import get_data_with_trend
+    from api.utils.serialization import frame_to_json
+    from api.utils.trend import compute_snapshot_diff
+
+    latest, previous = timestamps[-1], timestamps[-2]
+    snapshot = db_handler.get_data_by_timestamp(latest)
+    previous_snapshot = db_handler.get_data_by_timestamp(previous)
+    product_id = snapshot["id"].iloc[0]
+    with_trend = get_data_with_trend(latest)
+
+    results["micro.get_all_timestamps"] = measure(db_handler.get_all_timestamps, repeat, rows=len(timestamps))
+    results["micro.get_data_by_timestamp"] = measure(lambda: db_handler.get_data_by_timestamp(latest), repeat, rows=len(snapshot))
+    results["micro.get_most_recent_data_before"] = measure(lambda: db_handler.get_most_recent_data_before(latest), repeat)
+    results["micro.get_data_with_trend"] = measure(lambda: get_data_with_trend(latest), repeat, rows=len(with_trend))
+    results["micro.get_price_summary_before"] = measure(lambda: db_handler.get_price_summary_before(latest), repeat)
+    results["micro.compute_snapshot_diff"] = measure(lambda: compute_snapshot_diff(snapshot, previous_snapshot), repeat, rows=len(snapshot))
+    page, _ = db_handler.get_pharmacy_price_history(limit=1000)
+    results["micro.get_pharmacy_price_history"] = measure(lambda: db_handler.get_pharmacy_price_history(limit=1000), repeat, rows=len(page))
+    results["micro.get_pharmacy_price_history.product"] = measure(
+        lambda: db_handler.get_pharmacy_price_history(product_id=product_id, limit=1000), repeat)
+    results["micro.get_price_aggregates"] = measure(lambda: db_handler.get_price_aggregates(product_id, resolution="hour"), repeat)
+    results["micro.frame_to_json"] = measure(lambda: frame_to_json(with_trend), repeat, rows=len(with_trend))
+    results["micro.frame_to_json.columnar"] = measure(lambda: frame_to_json(with_trend, "columnar"), repeat, rows=len(with_trend))
+    return product_id
+
+
+async def endpoint_benchmarks(generator, stub, timestamps, product_id, repeat, results):
+    """Time a capture, fetch_and_analyze_all_pharmacy_prices and the API endpoints through the ASGI app."""
+    import httpx
+
+    from api.main import app, historical_cache
+    from api.utils import data_fetcher
+    from api.utils.scheduler import snapshot_scheduler
+
+    # Captures run on demand here; the background loop is never started
+    snapshot_scheduler.enabled = True
+
+    async def capture():
+        await snapshot_scheduler.run_once()
+
+    def next_catalogue():
+        stub.set_payload(generator.advance())
+        wait_next_second()
+
+    captures = max(3, repeat // 10)
+    results["e2e.capture"] = await measure_async(capture, captures, setup=next_catalogue)
+
+    latest = timestamps[-1]
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        async def get(path, **kwargs):
+            response = await client.get(path, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"GET {path}: {response.status_code} {response.text[:200]}")
+            return response
+
+        current = await get("/api/prices/current")
+        etag = current.headers["ETag"]
+        endpoints = {
+            "current": ("/api/prices/current", {}),
+            "current.columnar": ("/api/prices/current?format=columnar", {}),
+            "current.304": ("/api/prices/current", {"headers": {"If-None-Match": etag}}),
+            "best_competitor": ("/api/prices/best-competitor", {}),
+            "timestamps": ("/api/prices/timestamps", {}),
+            "historical.cached": (f"/api/prices/historical/{latest}", {}),
+            "historical.diff": (f"/api/prices/historical/{latest}/diff", {}),
+            "pharmacy_history": ("/api/prices/pharmacy-history?limit=1000", {}),
+            "pharmacy_history.product": (f"/api/prices/pharmacy-history?product_id={product_id}", {}),
+            "aggregates": (f"/api/prices/aggregates?product_id={product_id}&resolution=hour", {}),
+            "compare": ("/api/prices/compare?base=first", {}),
+            "metrics": ("/metrics", {}),
+        }
+        for name, (path, kwargs) in endpoints.items():
+            size = len((await get(path, **kwargs)).content)
+            results[f"e2e.{name}"] = await measure_async(lambda: get(path, **kwargs), repeat, bytes=size)
+        path = f"/api/prices/historical/{latest}"
+        results["e2e.historical.uncached"] = await measure_async(lambda: get(path), repeat, setup=historical_cache.invalidate)
+
+    # A cold fetch: request, streaming parse and storing the detailed prices, as /pharmacy-history/refresh does
+    def cold():
+        stub.set_payload(generator.advance())
+        data_fetcher._snapshot_cache.invalidate()
+        wait_next_second()
+
+    results["e2e.fetch_and_analyze_all_pharmacy_prices"] = await measure_async(data_fetcher.fetch_and_analyze_all_pharmacy_prices, captures, setup=cold)
+    await data_fetcher.upstream_client.aclose()
+
+
+def compare(results, baseline_path, max_regression):
+    """Print the change of every median against a baseline file; return the regressed benchmarks."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressed = []
+    print(f"\nAgainst {baseline_path}:")
+    print(f"{'benchmark':<40} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>10} {result['median_ms']:>8.2f}ms {'new':>8}")
+            continue
+        change = (result["median_ms"] / before["median_ms"] - 1) * 100 if before["median_ms"] else 0.0
+        flag = ""
+        if max_regression is not None and change > max_regression:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        elif abs(change) < NOISE_PERCENT:
+            flag = "  ~"
+        print(f"{name:<40} {before['median_ms']:>8.2f}ms {result['median_ms']:>8.2f}ms {change:>+7.1f}%{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--vendors-per-product", type=int, default=5)
+    parser.add_argument("--other-vendors", type=int, default=0, help="Vendors besides the top pharmacies")
+    parser.add_argument("--volatility", type=float, default=0.1, help="Fraction of prices changing per capture")
+    parser.add_argument("--max-change", type=float, default=0.15, help="Largest relative price change")
+    parser.add_argument("--churn", type=float, default=0.01, help="Fraction of offers delisted or relisted per capture")
+    parser.add_argument("--captures", type=int, default=24, help="Captures of stored history")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, help="With --compare, fail if a median is this many percent slower")
+    args = parser.parse_args()
+    if args.captures < 2:
+        parser.error("--captures must be at least 2")
+
+    generator = CatalogueGenerator(args.products, args.vendors_per_product, args.other_vendors, args.volatility,
+                                   args.max_change, args.churn, args.seed)
+    results = {}
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp, StubUpstream(generator.catalogue()) as stub:
+        # The api modules read their configuration on import, so they are only imported from here on
+        os.environ.update({
+            "DRANSAY_API_ENDPOINT": stub.url,
+            "DRANSAY_API_KEY": os.getenv("DRANSAY_API_KEY") or "benchmark",
+            "SNAPSHOT_SCHEDULER_ENABLED": "0",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        })
+        if "api.utils.data_fetcher" in sys.modules:
+            raise RuntimeError("api modules must not be imported before the suite configures them")
+        from api.database import db_handler
+
+        db_handler.DB_PATH = os.path.join(tmp, "suite.db")
+        db_handler.init_db()
+        timestamps = ingest_history(generator, args.captures, results)
+        product_id = micro_benchmarks(timestamps, args.repeat, results)
+        asyncio.run(endpoint_benchmarks(generator, stub, timestamps, product_id, args.repeat, results))
+        db_handler.get_connection_manager().close()
+
+    print(f"{args.products:,} products, {args.captures} captures of history, {time.perf_counter() - started:.0f}s in total\n")
+    print(f"{'benchmark':<40} {'median':>10} {'p95':>10} {'min':>10} {'runs':>5}")
+    for name, result in results.items():
+        print(f"{name:<40} {result['median_ms']:>8.2f}ms {result['p95_ms']:>8.2f}ms {result['min_ms']:>8.2f}ms {result['runs']:>5}")
+
+    if args.output:
+        report = {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "max_regression")},
+            "environment": environment(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.compare:
+        regressed = compare(results, args.compare, args.max_regression)
+        if regressed:
+            raise SystemExit(f"{len(regressed)} benchmark(s) regressed by more than {args.max_regression}%: {', '.join(regressed)}")
+
+
+if __name__ == "__main__":
+    main()
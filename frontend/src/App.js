@@ -12,7 +12,7 @@ import Header from './components/Header';
 import ControlPanel from './components/ControlPanel';
 import PriceTable from './components/PriceTable';
 import Footer from './components/Footer';
-import { fetchCurrentPrices, fetchTimestamps, fetchHistoricalPrices } from './services/api';
+import { applyPriceDelta, fetchTimestamps, fetchHistoricalPrices, fetchPharmacyGroups, mergeNewestTimestamps, subscribeToPrices } from './services/api';
 
 // Create a theme
 const theme = createTheme({
@@ -72,7 +72,8 @@ function App() {
   const [priceData, setPriceData] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
-  const [timestamps, setTimestamps] = useState([]);
+  // Loaded pages of timestamps, newest first, and the cursor of the next older page (null once all are loaded)
+  const [timestampList, setTimestampList] = useState({ timestamps: [], cursor: null });
   const [currentTimestamp, setCurrentTimestamp] = useState(null);
   
   // --- Group State ---
@@ -81,6 +82,13 @@ function App() {
   const [selectedGroup, setSelectedGroup] = useState('all'); 
   // --- End Group State ---
 
+  // --- Pharmacy Group (Competitor Set) State ---
+  const [pharmacyGroups, setPharmacyGroups] = useState([]);
+  const [selectedPharmacyGroup, setSelectedPharmacyGroup] = useState(''); // '' = default group
+  const [loadedView, setLoadedView] = useState(null); // 'current', a timestamp, or null
+  const [liveConnection, setLiveConnection] = useState(0); // Bumped to reconnect the live stream
+  // --- End Pharmacy Group State ---
+
   // --- View Mode State ---
   const [viewMode, setViewMode] = useState('all'); // 'all' or 'groupOnly'
   // --- End View Mode State ---
@@ -102,7 +110,7 @@ function App() {
     const getTimestamps = async () => {
       try {
         const response = await fetchTimestamps();
-        setTimestamps(response.timestamps);
+        setTimestampList({ timestamps: response.timestamps, cursor: response.next_cursor });
       } catch (err) {
         setError("Failed to load timestamps. Please try again later.");
       }
@@ -111,37 +119,89 @@ function App() {
     getTimestamps();
   }, []);
 
-  // Function to fetch current prices
-  const handleFetchCurrentPrices = async () => {
+  // Fetch the pharmacy groups on component mount
+  useEffect(() => {
+    const getPharmacyGroups = async () => {
+      try {
+        const response = await fetchPharmacyGroups();
+        setPharmacyGroups(response.groups);
+      } catch (err) {
+        // The default group is still used without the list
+      }
+    };
+
+    getPharmacyGroups();
+  }, []);
+
+  // While the current prices are shown, the live stream pushes the products that change with each capture
+  useEffect(() => {
+    if (loadedView !== 'current') return undefined;
+
+    // A new snapshot adds a timestamp (a cheap 304 otherwise); older pages already loaded are kept
+    const refreshTimestamps = async () => {
+      try {
+        const response = await fetchTimestamps();
+        setTimestampList((loaded) => mergeNewestTimestamps(loaded, response));
+      } catch (err) {
+        // Keep the list we have
+      }
+    };
+
+    return subscribeToPrices(selectedPharmacyGroup, {
+      onSnapshot: (snapshot) => {
+        setPriceData(snapshot.data);
+        setCurrentTimestamp(snapshot.timestamp);
+        setError(null);
+        setIsLoading(false);
+        refreshTimestamps();
+      },
+      onDelta: (delta) => {
+        setPriceData((rows) => applyPriceDelta(rows, delta));
+        setCurrentTimestamp(delta.timestamp);
+        refreshTimestamps();
+      },
+      onError: () => {
+        setError("Live price updates interrupted. Reconnecting...");
+        setIsLoading(false);
+      },
+    });
+  }, [loadedView, selectedPharmacyGroup, liveConnection]);
+
+  // Show the current prices: the live stream starts with the full latest snapshot
+  const handleFetchCurrentPrices = () => {
     setIsLoading(true);
     setError(null);
-    
+    setLoadedView('current');
+    setLiveConnection((connection) => connection + 1);
+  };
+
+  // Append the next older page of timestamps to the dropdown
+  const handleLoadOlderTimestamps = async () => {
+    const { cursor } = timestampList;
+    if (!cursor) return;
     try {
-      const response = await fetchCurrentPrices();
-      setPriceData(response.data);
-      setCurrentTimestamp(response.timestamp);
-      
-      // Refresh timestamps after successful fetch
-      const timestamps = await fetchTimestamps();
-      setTimestamps(timestamps.timestamps);
+      const response = await fetchTimestamps({ cursor });
+      // Ignore the page if the list was replaced meanwhile
+      setTimestampList((loaded) => (loaded.cursor === cursor
+        ? { timestamps: loaded.timestamps.concat(response.timestamps), cursor: response.next_cursor }
+        : loaded));
     } catch (err) {
-      setError("Failed to fetch current prices. Please try again later.");
-    } finally {
-      setIsLoading(false);
+      setError("Failed to load older timestamps. Please try again.");
     }
   };
 
   // Function to load historical data
-  const handleLoadHistoricalData = async (timestamp) => {
+  const handleLoadHistoricalData = async (timestamp, pharmacyGroup = selectedPharmacyGroup) => {
     if (!timestamp) return;
     
     setIsLoading(true);
     setError(null);
     
     try {
-      const response = await fetchHistoricalPrices(timestamp);
+      const response = await fetchHistoricalPrices(timestamp, pharmacyGroup);
       setPriceData(response.data);
       setCurrentTimestamp(response.timestamp);
+      setLoadedView(timestamp);
     } catch (err) {
       setError(`Failed to load data from ${timestamp}. Please try again.`);
     } finally {
@@ -149,6 +209,15 @@ function App() {
     }
   };
 
+  // Switch the competitor set and reload what is on screen with it
+  const handlePharmacyGroupSelect = (groupName) => {
+    setSelectedPharmacyGroup(groupName);
+    // The live stream resubscribes with the new group by itself
+    if (loadedView && loadedView !== 'current') {
+      handleLoadHistoricalData(loadedView, groupName);
+    }
+  };
+
   // Handle filter changes (excluding group selection)
   const handleFilterChange = (name, value) => {
     setFilters(prev => ({
@@ -298,9 +367,11 @@ function App() {
         <Container maxWidth="lg" sx={{ mt: 4, mb: 4, flex: 1 }}>
           <Paper sx={{ p: 3, mb: 3 }}>
             <ControlPanel 
-              onFetchPrices={handleFetchCurrentPrices}
+              onFetchPrices={() => handleFetchCurrentPrices()}
               onLoadHistoricalData={handleLoadHistoricalData}
-              timestamps={timestamps}
+              timestamps={timestampList.timestamps}
+              hasOlderTimestamps={Boolean(timestampList.cursor)}
+              onLoadOlderTimestamps={handleLoadOlderTimestamps}
               isLoading={isLoading}
               filters={filters}
               onFilterChange={handleFilterChange}
@@ -312,6 +383,9 @@ function App() {
               onDeleteGroup={deleteGroup}
               viewMode={viewMode}
               onViewModeChange={handleViewModeChange}
+              pharmacyGroups={pharmacyGroups}
+              selectedPharmacyGroup={selectedPharmacyGroup}
+              onPharmacyGroupSelect={handlePharmacyGroupSelect}
             />
           </Paper>
           
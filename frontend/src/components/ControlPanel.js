@@ -26,10 +26,15 @@ import DeleteIcon from '@mui/icons-material/Delete';
 import VisibilityIcon from '@mui/icons-material/Visibility';
 import VisibilityOffIcon from '@mui/icons-material/VisibilityOff';
 
+// Dropdown entry that loads the next older page of timestamps
+const OLDER_TIMESTAMPS = '__older__';
+
 const ControlPanel = ({
   onFetchPrices,
   onLoadHistoricalData,
   timestamps,
+  hasOlderTimestamps,
+  onLoadOlderTimestamps,
   isLoading,
   filters,
   onFilterChange,
@@ -40,18 +45,26 @@ const ControlPanel = ({
   onAddGroup,
   onDeleteGroup,
   viewMode,
-  onViewModeChange
+  onViewModeChange,
+  pharmacyGroups,
+  selectedPharmacyGroup,
+  onPharmacyGroupSelect
 }) => {
   const [selectedTimestamp, setSelectedTimestamp] = useState('');
   const [newGroupName, setNewGroupName] = useState('');
 
   const handleTimestampChange = (event) => {
+    // The last entry pages in older timestamps instead of selecting one
+    if (event.target.value === OLDER_TIMESTAMPS) {
+      onLoadOlderTimestamps();
+      return;
+    }
     setSelectedTimestamp(event.target.value);
   };
 
   const handleLoadHistoricalData = () => {
     if (selectedTimestamp) {
-      onLoadHistoricalData(selectedTimestamp);
+      onLoadHistoricalData(selectedTimestamp, selectedPharmacyGroup);
     }
   };
 
@@ -63,6 +76,10 @@ const ControlPanel = ({
     onGroupSelect(event.target.value);
   };
 
+  const handlePharmacyGroupChange = (event) => {
+    onPharmacyGroupSelect(event.target.value);
+  };
+
   const handleNewGroupNameChange = (event) => {
     setNewGroupName(event.target.value);
   };
@@ -120,7 +137,7 @@ const ControlPanel = ({
       
       <Grid container spacing={3} alignItems="center">
         {/* Fetch Current Prices Section */}
-        <Grid item xs={12} md={4}>
+        <Grid item xs={12} md={2}>
           <Button
             variant="contained"
             color="primary"
@@ -133,6 +150,29 @@ const ControlPanel = ({
           </Button>
         </Grid>
         
+        {/* Competitor Set (Pharmacy Group) Section */}
+        <Grid item xs={12} md={2}>
+          <FormControl fullWidth size="small">
+            <InputLabel id="pharmacy-group-label">Competitor Set</InputLabel>
+            <Select
+              labelId="pharmacy-group-label"
+              value={selectedPharmacyGroup}
+              label="Competitor Set"
+              onChange={handlePharmacyGroupChange}
+              disabled={isLoading}
+            >
+              <MenuItem value="">
+                <em>Default</em>
+              </MenuItem>
+              {pharmacyGroups.filter((group) => !group.default).map((group) => (
+                <MenuItem key={group.name} value={group.name}>
+                  {group.name} ({Object.keys(group.pharmacies).length})
+                </MenuItem>
+              ))}
+            </Select>
+          </FormControl>
+        </Grid>
+        
         {/* Historical Data Section */}
         <Grid item xs={12} md={4}>
           <Grid container spacing={1}>
@@ -150,6 +190,11 @@ const ControlPanel = ({
                       {timestamp}
                     </MenuItem>
                   ))}
+                  {hasOlderTimestamps && (
+                    <MenuItem value={OLDER_TIMESTAMPS}>
+                      <em>Load older snapshots…</em>
+                    </MenuItem>
+                  )}
                 </Select>
               </FormControl>
             </Grid>
@@ -2,13 +2,14 @@ import axios from 'axios';
 
 const API_BASE_URL = '/api/prices';
 
-// Add timestamp to prevent caching
-const getTimestampParam = () => `?t=${new Date().getTime()}`;
+// No cache-busting: the API sends ETags, so the browser revalidates /current and
+// /timestamps (304 when unchanged) and keeps historical snapshots cached (revalidating
+// the ones history compaction may still change)
 
-// Fetch current prices from the API
-export const fetchCurrentPrices = async () => {
+// Fetch current prices from the API, compared within a pharmacy group (the default group if not given)
+export const fetchCurrentPrices = async (group) => {
   try {
-    const response = await axios.get(`${API_BASE_URL}/current${getTimestampParam()}`);
+    const response = await axios.get(`${API_BASE_URL}/current`, { params: group ? { group } : {} });
     return response.data;
   } catch (error) {
     console.error('Error fetching current prices:', error);
@@ -16,10 +17,48 @@ export const fetchCurrentPrices = async () => {
   }
 };
 
-// Fetch all available timestamps
-export const fetchTimestamps = async () => {
+// Subscribe to live price updates (server-sent events), compared within a pharmacy group.
+// onSnapshot receives the full view on connect (and again if the client fell behind),
+// onDelta the products that changed with each capture. Returns a function that closes the stream
+export const subscribeToPrices = (group, { onSnapshot, onDelta, onError } = {}) => {
+  const query = group ? `?group=${encodeURIComponent(group)}` : '';
+  const source = new EventSource(`${API_BASE_URL}/stream${query}`);
+  source.addEventListener('snapshot', (event) => onSnapshot && onSnapshot(JSON.parse(event.data)));
+  source.addEventListener('delta', (event) => onDelta && onDelta(JSON.parse(event.data)));
+  // The browser reconnects by itself and then receives a full snapshot again
+  source.onerror = (error) => {
+    console.error('Live price updates interrupted:', error);
+    if (onError) onError(error);
+  };
+  return () => source.close();
+};
+
+// Apply a delta event to the rows it follows: changed products are replaced in place,
+// new ones appended and delisted ones dropped
+export const applyPriceDelta = (rows, delta) => {
+  const removed = new Set(delta.removed);
+  const changed = new Map(delta.data.map((row) => [row.id, row]));
+  const updated = rows
+    .filter((row) => !removed.has(row.id))
+    .map((row) => {
+      const next = changed.get(row.id);
+      changed.delete(row.id);
+      return next || row;
+    });
+  return updated.concat(Array.from(changed.values()));
+};
+
+// Timestamps shown in the snapshot dropdown (the newest ones)
+const TIMESTAMPS_PAGE_SIZE = 500;
+
+// Fetch one page of available timestamps, newest first; pass the previous page's next_cursor for older ones
+export const fetchTimestamps = async ({ start, end, cursor, limit = TIMESTAMPS_PAGE_SIZE } = {}) => {
   try {
-    const response = await axios.get(`${API_BASE_URL}/timestamps${getTimestampParam()}`);
+    const params = { limit };
+    if (start) params.start = start;
+    if (end) params.end = end;
+    if (cursor) params.cursor = cursor;
+    const response = await axios.get(`${API_BASE_URL}/timestamps`, { params });
     return response.data;
   } catch (error) {
     console.error('Error fetching timestamps:', error);
@@ -27,13 +66,53 @@ export const fetchTimestamps = async () => {
   }
 };
 
-// Fetch historical prices by timestamp
-export const fetchHistoricalPrices = async (timestamp) => {
+// Merge a freshly fetched newest page into the timestamps loaded so far ({ timestamps, cursor }),
+// keeping the older pages already loaded and the cursor that continues after them
+export const mergeNewestTimestamps = (loaded, page) => {
+  const oldest = page.timestamps[page.timestamps.length - 1];
+  const older = oldest === undefined ? [] : loaded.timestamps.filter((timestamp) => timestamp < oldest);
+  return {
+    timestamps: page.timestamps.concat(older),
+    cursor: older.length ? loaded.cursor : page.next_cursor,
+  };
+};
+
+// Fetch historical prices by timestamp, compared within a pharmacy group (the stored snapshot if not given)
+export const fetchHistoricalPrices = async (timestamp, group) => {
   try {
-    const response = await axios.get(`${API_BASE_URL}/historical/${timestamp}${getTimestampParam()}`);
+    const response = await axios.get(`${API_BASE_URL}/historical/${timestamp}`, { params: group ? { group } : {} });
     return response.data;
   } catch (error) {
     console.error(`Error fetching historical prices for ${timestamp}:`, error);
     throw error;
   }
-}; 
\ No newline at end of file
+}; 
+
+// Compare several snapshots in one request: either a list of timestamps, or a range
+// ({ start, end, stride }, e.g. stride '1w' for week over week). Returns the products,
+// a product × snapshot price matrix, the deltas against `base` and per-snapshot counts
+export const fetchPriceComparison = async ({ timestamps, start, end, stride, base, price, group } = {}) => {
+  const params = { base, price, group, start, end, stride };
+  if (timestamps && timestamps.length) {
+    params.timestamps = timestamps.join(',');
+  }
+  Object.keys(params).forEach((key) => params[key] === undefined && delete params[key]);
+  try {
+    const response = await axios.get(`${API_BASE_URL}/compare`, { params });
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching price comparison:', error);
+    throw error;
+  }
+};
+
+// Fetch the configured pharmacy groups (competitor sets)
+export const fetchPharmacyGroups = async () => {
+  try {
+    const response = await axios.get('/api/pharmacy-groups');
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching pharmacy groups:', error);
+    throw error;
+  }
+};
@@ -1,4 +1,18 @@
+import argparse
+import os
+
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("api.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the Sanvivo Pricing API")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", "0")),
+                        help="Production mode with this many worker processes (default: one auto-reloading development process)")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    args = parser.parse_args()
+
+    if args.workers:
+        # Workers share the database: one holds the ingest lease and captures snapshots, the others serve what it publishes
+        uvicorn.run("api.main:app", host=args.host, port=args.port, workers=args.workers, log_level="warning")
+    else:
+        uvicorn.run("api.main:app", host=args.host, port=args.port, reload=True)